@@ -9,6 +9,84 @@ class Settings(BaseSettings):
     SECRET_KEY: str = os.getenv("SECRET_KEY", "default_secret_key")
     ALGORITHM: str = os.getenv("ALGORITHM", "HS256")
     ACCESS_TOKEN_EXPIRE_MINUTES: int = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", 30))
+    # Columnar copies of uploaded files, written once at ingest and read by /query and /download
+    COLUMNAR_FILES_DIR: str = os.getenv("COLUMNAR_FILES_DIR", "data/columnar_files")
+    # Serve columnar copies as ArrowDtype frames backed by the shared memory map (fully zero-copy);
+    # false converts them to NumPy-backed frames (a private copy per worker for columns with nulls or text)
+    COLUMNAR_ARROW_BACKED_DATAFRAMES: bool = os.getenv("COLUMNAR_ARROW_BACKED_DATAFRAMES", "true").lower() in ("1", "true", "yes")
+    # Column profiler: "exact" (pandas nunique/sample), "streaming" (chunked sketches) or "auto" (streaming for large files)
+    COLUMN_PROFILER_MODE: str = os.getenv("COLUMN_PROFILER_MODE", "auto")
+    COLUMN_PROFILER_STREAMING_MIN_BYTES: int = int(os.getenv("COLUMN_PROFILER_STREAMING_MIN_BYTES", 50 * 1024 * 1024))
+    COLUMN_PROFILER_CHUNK_ROWS: int = int(os.getenv("COLUMN_PROFILER_CHUNK_ROWS", 100_000))
+    COLUMN_PROFILER_TOP_K: int = int(os.getenv("COLUMN_PROFILER_TOP_K", 10))
+    # Async LLM client: shared keep-alive pool, per-provider concurrency limits and timeouts
+    LLM_HTTP_MAX_CONNECTIONS: int = int(os.getenv("LLM_HTTP_MAX_CONNECTIONS", 32))
+    LLM_HTTP_MAX_KEEPALIVE_CONNECTIONS: int = int(os.getenv("LLM_HTTP_MAX_KEEPALIVE_CONNECTIONS", 16))
+    LLM_HTTP_KEEPALIVE_EXPIRY_SECONDS: float = float(os.getenv("LLM_HTTP_KEEPALIVE_EXPIRY_SECONDS", 60))
+    LLM_CONNECT_TIMEOUT_SECONDS: float = float(os.getenv("LLM_CONNECT_TIMEOUT_SECONDS", 5))
+    LLM_QUEUE_TIMEOUT_SECONDS: float = float(os.getenv("LLM_QUEUE_TIMEOUT_SECONDS", 30))
+    LLM_SILICONFLOW_MAX_CONCURRENCY: int = int(os.getenv("LLM_SILICONFLOW_MAX_CONCURRENCY", 8))
+    LLM_SILICONFLOW_TIMEOUT_SECONDS: float = float(os.getenv("LLM_SILICONFLOW_TIMEOUT_SECONDS", 30))
+    LLM_OLLAMA_MAX_CONCURRENCY: int = int(os.getenv("LLM_OLLAMA_MAX_CONCURRENCY", 2))
+    LLM_OLLAMA_TIMEOUT_SECONDS: float = float(os.getenv("LLM_OLLAMA_TIMEOUT_SECONDS", 60))
+    # Persistent cache of LLM-parsed conditions (SQLite), keyed by query, schema, provider, model and temperature
+    LLM_PARSE_CACHE_PATH: str = os.getenv("LLM_PARSE_CACHE_PATH", "data/llm_parse_cache.sqlite3")
+    LLM_PARSE_CACHE_TTL_SECONDS: float = float(os.getenv("LLM_PARSE_CACHE_TTL_SECONDS", 7 * 24 * 3600))
+    LLM_PARSE_CACHE_MAX_ENTRIES: int = int(os.getenv("LLM_PARSE_CACHE_MAX_ENTRIES", 10_000))
+    # Stream LLM replies and close the connection as soon as the JSON object with "filters" is complete
+    LLM_STREAM_RESPONSES: bool = os.getenv("LLM_STREAM_RESPONSES", "true").lower() in ("1", "true", "yes")
+    # Rule-based parser tried before the LLM; its result is used only at or above this confidence
+    FAST_PARSER_ENABLED: bool = os.getenv("FAST_PARSER_ENABLED", "true").lower() in ("1", "true", "yes")
+    FAST_PARSER_MIN_CONFIDENCE: float = float(os.getenv("FAST_PARSER_MIN_CONFIDENCE", 0.9))
+    # Schema part of the LLM system prompt: token budget (0 = unlimited), per-provider/model overrides
+    # as JSON ({"ollama": 1500, "siliconflow:Qwen/Qwen3-8B": 4000}) and the sample value length cap
+    LLM_SCHEMA_TOKEN_BUDGET: int = int(os.getenv("LLM_SCHEMA_TOKEN_BUDGET", 3000))
+    LLM_SCHEMA_TOKEN_BUDGETS: str = os.getenv("LLM_SCHEMA_TOKEN_BUDGETS", "{}")
+    LLM_SCHEMA_SAMPLE_MAX_CHARS: int = int(os.getenv("LLM_SCHEMA_SAMPLE_MAX_CHARS", 40))
+    # Ollama model residency: keep_alive sent with each request ("30m", "-1" = forever) and preload at startup:
+    # "true", "false" or "auto" (when Ollama is the default provider or enabled as a fallback)
+    OLLAMA_KEEP_ALIVE: str = os.getenv("OLLAMA_KEEP_ALIVE", "30m")
+    OLLAMA_PRELOAD_ON_STARTUP: str = os.getenv("OLLAMA_PRELOAD_ON_STARTUP", "auto").lower()
+    # LLM dispatch: hedge to the other provider past the primary's latency percentile (default delay until
+    # enough samples), fail over on errors, and open a provider's circuit after consecutive failures
+    LLM_HEDGING_ENABLED: bool = os.getenv("LLM_HEDGING_ENABLED", "true").lower() in ("1", "true", "yes")
+    LLM_FAILOVER_ENABLED: bool = os.getenv("LLM_FAILOVER_ENABLED", "true").lower() in ("1", "true", "yes")
+    LLM_HEDGE_PERCENTILE: float = float(os.getenv("LLM_HEDGE_PERCENTILE", 95))
+    LLM_HEDGE_MIN_SAMPLES: int = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", 20))
+    LLM_HEDGE_DEFAULT_DELAY_SECONDS: float = float(os.getenv("LLM_HEDGE_DEFAULT_DELAY_SECONDS", 8))
+    LLM_HEDGE_MIN_DELAY_SECONDS: float = float(os.getenv("LLM_HEDGE_MIN_DELAY_SECONDS", 1))
+    LLM_CIRCUIT_FAILURE_THRESHOLD: int = int(os.getenv("LLM_CIRCUIT_FAILURE_THRESHOLD", 5))
+    LLM_CIRCUIT_COOLDOWN_SECONDS: float = float(os.getenv("LLM_CIRCUIT_COOLDOWN_SECONDS", 30))
+    # Use Ollama as a hedge/failover target even before it has answered in this worker (off: it may not be deployed)
+    LLM_OLLAMA_FALLBACK_ENABLED: bool = os.getenv("LLM_OLLAMA_FALLBACK_ENABLED", "false").lower() in ("1", "true", "yes")
+    # Range filters on frames with at least this many rows use a lazily built sorted index (0 = never)
+    FILTER_SORTED_INDEX_MIN_ROWS: int = int(os.getenv("FILTER_SORTED_INDEX_MIN_ROWS", 100_000))
+    # equals/in filters on columns with at most this many distinct values use dictionary codes and
+    # per-value packed bitmaps, on frames with at least FILTER_BITMAP_INDEX_MIN_ROWS rows
+    FILTER_BITMAP_INDEX_MIN_ROWS: int = int(os.getenv("FILTER_BITMAP_INDEX_MIN_ROWS", 100_000))
+    FILTER_BITMAP_INDEX_MAX_CARDINALITY: int = int(os.getenv("FILTER_BITMAP_INDEX_MAX_CARDINALITY", 1000))
+    # contains/not_contains on frames with at least this many rows narrow candidates with a trigram index (0 = never)
+    FILTER_TRIGRAM_INDEX_MIN_ROWS: int = int(os.getenv("FILTER_TRIGRAM_INDEX_MIN_ROWS", 100_000))
+    # Filter execution backend: "pandas" (in memory), "duckdb" (SQL over the file on disk), "chunked"
+    # (files of at least FILTER_SQL_BACKEND_MIN_BYTES filtered FILTER_CHUNK_ROWS rows at a time) or
+    # "auto" (duckdb for those files if installed, else chunked)
+    FILTER_EXECUTION_BACKEND: str = os.getenv("FILTER_EXECUTION_BACKEND", "auto")
+    FILTER_SQL_BACKEND_MIN_BYTES: int = int(os.getenv("FILTER_SQL_BACKEND_MIN_BYTES", 1024 * 1024 * 1024))
+    FILTER_CHUNK_ROWS: int = int(os.getenv("FILTER_CHUNK_ROWS", 100_000))
+    # DuckDB per-query memory limit, spill directory for what does not fit, and worker threads
+    DUCKDB_MEMORY_LIMIT: str = os.getenv("DUCKDB_MEMORY_LIMIT", "1GB")
+    DUCKDB_TEMP_DIR: str = os.getenv("DUCKDB_TEMP_DIR", "data/duckdb_tmp")
+    DUCKDB_THREADS: int = int(os.getenv("DUCKDB_THREADS", 2))
+    # Rows per NDJSON line when /query streams its result
+    QUERY_STREAM_BATCH_ROWS: int = int(os.getenv("QUERY_STREAM_BATCH_ROWS", 5000))
+    # /query stores the filtered result as Parquet and returns it page by page
+    QUERY_RESULT_PAGE_ROWS: int = int(os.getenv("QUERY_RESULT_PAGE_ROWS", 500))
+    QUERY_RESULT_MAX_PAGE_ROWS: int = int(os.getenv("QUERY_RESULT_MAX_PAGE_ROWS", 5000))
+    QUERY_RESULT_ROW_GROUP_ROWS: int = int(os.getenv("QUERY_RESULT_ROW_GROUP_ROWS", 10000))
+    # Rows per sheet (header included) before /download continues on a new sheet; 1048576 is Excel's limit
+    XLSX_MAX_SHEET_ROWS: int = int(os.getenv("XLSX_MAX_SHEET_ROWS", 1048576))
+    # Memory budget of the in-process DataFrame cache (measured with memory_usage(deep=True))
+    DATAFRAME_CACHE_MAX_BYTES: int = int(os.getenv("DATAFRAME_CACHE_MAX_BYTES", 512 * 1024 * 1024))
     class Config:
         env_file = ".env"
         env_file_encoding = 'utf-8'
@@ -1,4 +1,4 @@
-from sqlmodel import SQLModel, Field, Relationship
+from sqlmodel import SQLModel, Field, Relationship, Column, Text
 from typing import Optional, List
 from datetime import datetime
 
@@ -35,6 +35,13 @@ class UploadedExcelFile(SQLModel, table=True):
     mime_type: Optional[str] = Field(default=None, max_length=100)
     upload_timestamp: datetime = Field(default_factory=datetime.utcnow)
 
+    # Columnar copy written at ingest (normalized column names); re-created if missing or stale
+    columnar_file_path: Optional[str] = Field(default=None, max_length=512)
+    columnar_format_version: Optional[int] = None
+    # Column profile (columns_info) computed at ingest; recomputed when the profiler version changes
+    columns_info_json: Optional[str] = Field(default=None, sa_column=Column(Text))
+    columns_info_version: Optional[int] = None
+
     uploader_id: int = Field(foreign_key="app_users.id", index=True)
     uploader: User = Relationship(back_populates="uploaded_files")
 
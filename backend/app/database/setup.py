@@ -1,4 +1,5 @@
 from sqlmodel import create_engine, Session, SQLModel
+from sqlalchemy import inspect, text
 from app.core.config import settings
 
 DATABASE_URL = settings.DATABASE_URL
@@ -10,6 +11,7 @@ def create_db_and_tables():
     print("Attempting to create database tables...")
     try:
         SQLModel.metadata.create_all(engine)
+        add_missing_columns()
         print("Database tables created successfully (or already exist).")
     except Exception as e:
         print(f"!!!!!!!! ERROR DURING create_db_and_tables !!!!!!!!")
@@ -17,6 +19,26 @@ def create_db_and_tables():
         traceback.print_exc()
         print(f"Error details: {e}")
 
+def add_missing_columns():
+    # create_all never alters an existing table: columns added to a model later (columnar copy,
+    # stored column profile) are added here. Idempotent, so it runs on every startup.
+    inspector = inspect(engine)
+    quote = engine.dialect.identifier_preparer.quote
+    with engine.begin() as connection:
+        for table in SQLModel.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                if not column.nullable:
+                    print(f"Cannot add NOT NULL column '{column.name}' to existing table '{table.name}'; migrate it manually.")
+                    continue
+                column_type = column.type.compile(dialect=engine.dialect)
+                connection.execute(text(f"ALTER TABLE {quote(table.name)} ADD COLUMN {quote(column.name)} {column_type}"))
+                print(f"Added column '{column.name}' to table '{table.name}'.")
+
 def get_db():
     with Session(engine) as session:
         yield session
\ No newline at end of file
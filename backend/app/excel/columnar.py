@@ -0,0 +1,140 @@
+# app/excel/columnar.py
+import logging
+import os
+import uuid
+from pathlib import Path
+from typing import Optional
+import pandas as pd
+import pyarrow as pa
+import pyarrow.ipc
+from app.core.config import settings
+
+# --- Configuration ---
+COLUMNAR_FILES_DIR = Path(settings.COLUMNAR_FILES_DIR)
+COLUMNAR_FILES_DIR.mkdir(parents=True, exist_ok=True)
+
+# Bump when the on-disk layout or the column normalization changes, so existing copies are rebuilt.
+# v2: uncompressed Arrow IPC file, so every worker can memory-map it and share the page cache.
+COLUMNAR_FORMAT_VERSION = 2
+COLUMNAR_SUFFIX = ".arrow"
+
+logger = logging.getLogger(__name__)
+
+
+def columnar_path_for(original_file_path: Path) -> Path:
+    """Path of the columnar copy for an original upload (stored file names are already unique)."""
+    return COLUMNAR_FILES_DIR / f"{original_file_path.stem}{COLUMNAR_SUFFIX}"
+
+
+def _arrow_safe_column(series: pd.Series) -> pd.Series:
+    # Excel columns often mix numbers and text; Arrow needs one type per column,
+    # so fall back to strings for the non-null cells of such object columns.
+    try:
+        pa.array(series, from_pandas=True)
+        return series
+    except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError):
+        logger.debug(f"Column '{series.name}' has mixed types, storing its values as strings.")
+        return series.map(lambda v: None if pd.isna(v) else str(v)).astype(object)
+
+
+def dataframe_to_arrow_table(df: pd.DataFrame) -> pa.Table:
+    """Converts a prepared DataFrame to an Arrow table, coercing mixed-type object columns to strings."""
+    if df.columns.duplicated().any():
+        raise ValueError(f"Duplicate column names after normalization: {sorted(set(df.columns[df.columns.duplicated()]))}")
+    safe_df = df.copy(deep=False)
+    for col in safe_df.columns:
+        if safe_df[col].dtype == object:
+            safe_df[col] = _arrow_safe_column(safe_df[col])
+    return pa.Table.from_pandas(safe_df, preserve_index=False)
+
+
+def write_columnar_copy(df: pd.DataFrame, original_file_path: Path) -> Path:
+    """Writes the columnar copy next to the other copies. The write is atomic (temp file + rename)."""
+    target_path = columnar_path_for(original_file_path)
+    tmp_path = target_path.with_name(f".{target_path.name}.{uuid.uuid4().hex[:8]}.tmp")
+    try:
+        table = dataframe_to_arrow_table(df)
+        # No compression: compressed buffers would have to be decoded into private memory on read.
+        with pa.OSFile(str(tmp_path), "wb") as sink:
+            with pa.ipc.new_file(sink, table.schema, options=pa.ipc.IpcWriteOptions(compression=None)) as writer:
+                writer.write_table(table)
+        os.replace(tmp_path, target_path)
+    finally:
+        if tmp_path.exists():
+            try:
+                tmp_path.unlink()
+            except OSError:
+                logger.error(f"Could not remove partial columnar file {tmp_path}", exc_info=True)
+    logger.info(f"Wrote columnar copy of '{original_file_path.name}' to '{target_path}', shape: {df.shape}")
+    return target_path
+
+
+def is_columnar_copy_fresh(columnar_file_path: Optional[str], format_version: Optional[int], original_file_path: Path) -> bool:
+    """A copy is usable if it exists, has the current format version and is not older than the original."""
+    if not columnar_file_path or format_version != COLUMNAR_FORMAT_VERSION:
+        return False
+    columnar_path = Path(columnar_file_path)
+    try:
+        columnar_mtime = columnar_path.stat().st_mtime_ns
+    except OSError:
+        return False
+    try:
+        return columnar_mtime >= original_file_path.stat().st_mtime_ns
+    except OSError:
+        # Original is gone but the copy is intact: the copy is all we have.
+        return True
+
+
+def open_columnar_table(columnar_file_path: str) -> pa.Table:
+    """
+    Memory-maps a columnar copy and returns an Arrow table backed by the mapping (zero-copy).
+    The mapping stays alive as long as any buffer of the table is referenced.
+    """
+    source = pa.memory_map(str(columnar_file_path), "r")
+    return pa.ipc.open_file(source).read_all()
+
+
+def read_columnar_copy(columnar_file_path: str, arrow_backed: bool = False) -> pd.DataFrame:
+    """
+    Reads a columnar copy into a DataFrame (column names are already normalized).
+    With arrow_backed=True every column is an ArrowDtype view on the memory map, so workers
+    share one copy of the data through the page cache. Otherwise numeric columns without
+    nulls are still zero-copy (read-only) views and the rest is converted to pandas types.
+    """
+    table = open_columnar_table(columnar_file_path)
+    if arrow_backed:
+        return table.to_pandas(types_mapper=pd.ArrowDtype)
+    return table.to_pandas(split_blocks=True)
+
+
+def numpy_dtype_name(series: pd.Series) -> str:
+    """
+    The dtype name series would have as a NumPy-backed column (what read_columnar_copy gives without
+    arrow_backed), so column profiles and prompts do not depend on COLUMNAR_ARROW_BACKED_DATAFRAMES.
+    """
+    dtype = series.dtype
+    if not isinstance(dtype, pd.ArrowDtype):
+        return str(dtype)
+    arrow_type = dtype.pyarrow_dtype
+    if pa.types.is_timestamp(arrow_type):
+        return f"datetime64[ns, {arrow_type.tz}]" if arrow_type.tz else "datetime64[ns]"
+    has_nulls = bool(series.hasnans)
+    if pa.types.is_integer(arrow_type) and has_nulls:
+        return "float64"
+    if pa.types.is_boolean(arrow_type) and has_nulls:
+        return "object"
+    if pa.types.is_integer(arrow_type) or pa.types.is_floating(arrow_type) or pa.types.is_boolean(arrow_type):
+        return str(dtype.numpy_dtype)
+    return "object"
+
+
+def remove_columnar_copy(columnar_file_path: Optional[str]) -> None:
+    if not columnar_file_path:
+        return
+    path = Path(columnar_file_path)
+    if path.exists():
+        try:
+            path.unlink()
+            logger.info(f"Removed columnar copy {path}")
+        except OSError as e:
+            logger.error(f"Could not delete columnar copy {path}: {e}")
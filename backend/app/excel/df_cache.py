@@ -0,0 +1,180 @@
+# app/excel/df_cache.py
+import logging
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Any, Optional, Tuple
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+from app.core.config import settings
+from app.excel import filter_plan
+
+logger = logging.getLogger(__name__)
+
+# (file record id, file mtime in ns, file size in bytes)
+CacheKey = Tuple[int, int, int]
+
+
+def make_cache_key(file_record_id: int, file_path: Path) -> CacheKey:
+    """Keys a cached frame by record and by the exact file version it was read from."""
+    stat = file_path.stat()
+    return (file_record_id, stat.st_mtime_ns, stat.st_size)
+
+
+def dataframe_nbytes(df: pd.DataFrame) -> int:
+    return int(df.memory_usage(deep=True, index=True).sum())
+
+
+def immutable_columns(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    df with its pandas extension columns (tz-aware datetimes, nullable integers and booleans, ...)
+    converted to Arrow-backed ones, whose data cannot be changed in place. Extension columns Arrow
+    cannot hold as a plain type (categoricals, intervals) stay as they are; read_only_view copies them.
+    """
+    converted = None
+    for position in range(df.shape[1]):
+        series = df.iloc[:, position]
+        if isinstance(series.dtype, (np.dtype, pd.ArrowDtype)):
+            continue
+        try:
+            arrow_array = pa.array(series.array, from_pandas=True)
+        except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError):
+            continue
+        if pa.types.is_dictionary(arrow_array.type) or isinstance(arrow_array.type, pa.ExtensionType):
+            continue
+        if converted is None:
+            converted = df.copy(deep=False)
+        converted.isetitem(position, pd.Series(pd.arrays.ArrowExtensionArray(arrow_array), index=df.index, copy=False))
+    return df if converted is None else converted
+
+
+def read_only_view(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    A new frame over df's data: NumPy columns are read-only views (writing to them, or to a Series
+    taken from them, raises), Arrow columns are new array objects (Arrow data is immutable; a write
+    only swaps the array of the frame written to). Any other extension column is copied, so the
+    cache stores frames through immutable_columns to keep that rare.
+    """
+    columns = {}
+    for position in range(df.shape[1]):
+        series = df.iloc[:, position]
+        if isinstance(series.dtype, np.dtype):
+            values = series.to_numpy().view()
+            values.flags.writeable = False
+        elif isinstance(series.dtype, pd.ArrowDtype):
+            values = series.array.copy() # Shallow: same Arrow buffers
+        else:
+            values = series.array.copy() # Writable in place (categorical codes, ...): a private copy
+        columns[position] = values
+    view = pd.DataFrame(columns, index=df.index, copy=False)
+    view.columns = df.columns
+    return view
+
+
+class DataFrameCache:
+    """
+    Process-wide LRU cache of prepared DataFrames with a memory budget in bytes. Each entry owns
+    the filter artifacts (typed views, indexes) built for its frame, and their size is charged to
+    the entry as they are built, so indexes count against the budget like the frame does.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        # key -> (frame, frame bytes, bytes of the artifacts built so far, filter artifacts)
+        self._entries: "OrderedDict[CacheKey, Tuple[pd.DataFrame, int, int, filter_plan.DatasetArtifacts]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._current_bytes = 0
+        self._artifact_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: CacheKey) -> Optional[pd.DataFrame]:
+        """
+        Returns a read-only view (read_only_view) of the cached frame for key, or None. Views of the
+        same entry share its filter artifacts.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            df, _, _, artifacts = entry
+        view = read_only_view(df)
+        filter_plan.register_dataset_artifacts(view, artifacts)
+        return view
+
+    def put(self, key: CacheKey, df: pd.DataFrame) -> pd.DataFrame:
+        """Caches df (the cache owns it from now on) and returns a read-only view of it, like get(); df itself if it does not fit."""
+        nbytes = dataframe_nbytes(df)
+        if nbytes > self.max_bytes:
+            logger.info(f"DataFrame for record ID {key[0]} ({nbytes} bytes) exceeds the cache budget of {self.max_bytes} bytes, not caching.")
+            return df
+        df = immutable_columns(df)
+        nbytes = dataframe_nbytes(df)
+        artifacts = filter_plan.DatasetArtifacts(df, on_view_built=lambda view_bytes: self._charge(key, artifacts, view_bytes))
+        with self._lock:
+            # Older versions of the same record can never be hit again.
+            for stale_key in [k for k in self._entries if k[0] == key[0] and k != key]:
+                self._remove(stale_key)
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (df, nbytes, 0, artifacts)
+            self._current_bytes += nbytes
+            self._evict_over_budget()
+        view = read_only_view(df)
+        filter_plan.register_dataset_artifacts(view, artifacts)
+        return view
+
+    def _charge(self, key: CacheKey, artifacts: "filter_plan.DatasetArtifacts", view_bytes: int) -> None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[3] is not artifacts:
+                return # Evicted or replaced: the views die with the last request using them
+            self._entries[key] = (entry[0], entry[1], entry[2] + view_bytes, artifacts)
+            self._current_bytes += view_bytes
+            self._artifact_bytes += view_bytes
+            self._evict_over_budget()
+
+    def _evict_over_budget(self) -> None:
+        # Caller holds the lock.
+        while self._current_bytes > self.max_bytes and self._entries:
+            evicted_key = next(iter(self._entries))
+            self._remove(evicted_key)
+            self.evictions += 1
+            logger.debug(f"Evicted DataFrame for record ID {evicted_key[0]} from cache.")
+
+    def invalidate(self, file_record_id: int) -> None:
+        with self._lock:
+            for key in [k for k in self._entries if k[0] == file_record_id]:
+                self._remove(key)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._current_bytes = 0
+            self._artifact_bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "current_bytes": self._current_bytes,
+                "artifact_bytes": self._artifact_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+    def _remove(self, key: CacheKey) -> None:
+        # Caller holds the lock.
+        _, frame_bytes, artifact_bytes, _ = self._entries.pop(key)
+        self._current_bytes -= frame_bytes + artifact_bytes
+        self._artifact_bytes -= artifact_bytes
+
+
+dataframe_cache = DataFrameCache(max_bytes=settings.DATAFRAME_CACHE_MAX_BYTES)
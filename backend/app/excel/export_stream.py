@@ -0,0 +1,291 @@
+# app/excel/export_stream.py
+import logging
+import zipfile
+from typing import Dict, Iterator, List, Optional
+from xml.sax.saxutils import escape as xml_escape
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+from app.core.config import settings
+from app.excel import columnar
+from app.excel.result_serializer import concatenated_bytes
+from app.excel.result_stream import ChunkSink
+
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+XLSX_MEDIA_TYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+DOWNLOAD_FORMATS = {
+    "xlsx": XLSX_MEDIA_TYPE,
+    "csv": "text/csv; charset=utf-8",
+    "parquet": "application/vnd.apache.parquet",
+}
+XLSX_MAX_SHEET_ROWS = settings.XLSX_MAX_SHEET_ROWS # Excel's limit (1,048,576) including the header row
+XLSX_SHEET_NAME = "Query_Results"
+# Sheet XML is very repetitive, so the fastest level still compresses it well
+_ZIP_COMPRESSLEVEL = 1
+_ZIP64_LIMIT = (1 << 31) - 1
+_EXCEL_EPOCH_OFFSET_DAYS = 25569 # 1970-01-01 as an Excel serial date (1900 date system)
+_FIRST_EXACT_SERIAL = 61 # Excel serials before 1900-03-01 are off by its fake 1900-02-29
+_NS_PER_DAY = 86_400 * 1_000_000_000
+_STYLE_DATETIME, _STYLE_DATE = 1, 2 # Indexes into cellXfs below
+_XML_ILLEGAL_CHARS = r'[\x00-\x08\x0b\x0c\x0e-\x1f]'
+_EMPTY_CELL = "<c/>"
+
+_MAIN_NS = "http://schemas.openxmlformats.org/spreadsheetml/2006/main"
+_REL_NS = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+_XML_DECLARATION = '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+_STYLES_XML = (
+    _XML_DECLARATION + f'<styleSheet xmlns="{_MAIN_NS}">'
+    '<numFmts count="2"><numFmt numFmtId="164" formatCode="yyyy-mm-dd hh:mm:ss"/><numFmt numFmtId="165" formatCode="yyyy-mm-dd"/></numFmts>'
+    '<fonts count="1"><font><sz val="11"/><name val="Calibri"/><family val="2"/></font></fonts>'
+    '<fills count="2"><fill><patternFill patternType="none"/></fill><fill><patternFill patternType="gray125"/></fill></fills>'
+    '<borders count="1"><border><left/><right/><top/><bottom/><diagonal/></border></borders>'
+    '<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>'
+    '<cellXfs count="3"><xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/>'
+    '<xf numFmtId="164" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/>'
+    '<xf numFmtId="165" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/></cellXfs>'
+    '<cellStyles count="1"><cellStyle name="Normal" xfId="0" builtinId="0"/></cellStyles>'
+    '</styleSheet>'
+)
+_ROOT_RELS_XML = (
+    _XML_DECLARATION + '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    f'<Relationship Id="rId1" Type="{_REL_NS}/officeDocument" Target="xl/workbook.xml"/></Relationships>'
+)
+
+
+def _sheet_name(index: int) -> str:
+    return XLSX_SHEET_NAME if index == 1 else f"{XLSX_SHEET_NAME}_{index}"
+
+
+def _workbook_parts(sheet_count: int) -> Dict[str, str]:
+    """The package parts that list the sheets; written last, once the number of sheets is known."""
+    sheets = "".join(f'<sheet name="{_sheet_name(i)}" sheetId="{i}" r:id="rId{i}"/>' for i in range(1, sheet_count + 1))
+    sheet_rels = "".join(
+        f'<Relationship Id="rId{i}" Type="{_REL_NS}/worksheet" Target="worksheets/sheet{i}.xml"/>' for i in range(1, sheet_count + 1)
+    )
+    sheet_types = "".join(
+        f'<Override PartName="/xl/worksheets/sheet{i}.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        for i in range(1, sheet_count + 1)
+    )
+    return {
+        "xl/workbook.xml": _XML_DECLARATION + f'<workbook xmlns="{_MAIN_NS}" xmlns:r="{_REL_NS}"><sheets>{sheets}</sheets></workbook>',
+        "xl/_rels/workbook.xml.rels": (
+            _XML_DECLARATION + '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+            f'{sheet_rels}<Relationship Id="rId{sheet_count + 1}" Type="{_REL_NS}/styles" Target="styles.xml"/></Relationships>'
+        ),
+        "xl/styles.xml": _STYLES_XML,
+        "_rels/.rels": _ROOT_RELS_XML,
+        "[Content_Types].xml": (
+            _XML_DECLARATION + '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+            '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+            '<Default Extension="xml" ContentType="application/xml"/>'
+            '<Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+            '<Override PartName="/xl/styles.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>'
+            f'{sheet_types}</Types>'
+        ),
+    }
+
+
+def _inline_string_cells(array: pa.Array) -> pa.Array:
+    escaped = pc.replace_substring_regex(array, _XML_ILLEGAL_CHARS, "")
+    escaped = pc.replace_substring(escaped, "&", "&amp;")
+    escaped = pc.replace_substring(escaped, "<", "&lt;")
+    escaped = pc.replace_substring(escaped, ">", "&gt;")
+    return pc.binary_join_element_wise('<c t="inlineStr"><is><t xml:space="preserve">', escaped, "</t></is></c>", "")
+
+
+def _string_cells(array: pa.Array) -> pa.Array:
+    # Escape each distinct value once when the column repeats values
+    encoded = pc.dictionary_encode(array)
+    if len(encoded.dictionary) * 2 <= len(array):
+        return pc.take(_inline_string_cells(encoded.dictionary), encoded.indices)
+    return _inline_string_cells(array)
+
+
+def _number_cells(values: pa.Array, style: Optional[int] = None) -> pa.Array:
+    opening = "<c>" if style is None else f'<c s="{style}">'
+    text = pc.cast(values, pa.string())
+    if pa.types.is_floating(values.type):
+        text = pc.if_else(pc.is_finite(values), text, pa.scalar(None, pa.string())) # NaN/inf: empty cell
+    return pc.binary_join_element_wise(opening + "<v>", text, "</v></c>", "")
+
+
+def _timestamp_cells(array: pa.Array) -> pa.Array:
+    """Excel serial numbers with a date format; tz-aware values are written as wall time (Excel has no zones)."""
+    local = pc.local_timestamp(array) if array.type.tz is not None else array
+    epoch_ns = pc.cast(pc.cast(local, pa.timestamp("ns")), pa.int64())
+    serials = pc.add(pc.divide(pc.cast(epoch_ns, pa.float64(), safe=False), float(_NS_PER_DAY)), float(_EXCEL_EPOCH_OFFSET_DAYS))
+    cells = _number_cells(serials, _STYLE_DATETIME)
+    early = pc.fill_null(pc.less(serials, float(_FIRST_EXACT_SERIAL)), False)
+    if pc.any(early).as_py():
+        # Before 1900-03-01 Excel cannot hold the date as a number: write it as text
+        cells = pc.if_else(early, _string_cells(pc.strftime(pc.cast(local, pa.timestamp("s"), safe=False), format="%Y-%m-%d %H:%M:%S")), cells)
+    return cells
+
+
+def _column_cells(array: pa.Array) -> pa.Array:
+    """One <c> element per value; nulls become empty cells so the columns stay aligned."""
+    value_type = array.type
+    if pa.types.is_dictionary(value_type):
+        return _column_cells(array.dictionary_decode())
+    if pa.types.is_null(value_type):
+        return pa.array([_EMPTY_CELL] * len(array), pa.string())
+    if pa.types.is_boolean(value_type):
+        cells = pc.if_else(array, '<c t="b"><v>1</v></c>', '<c t="b"><v>0</v></c>')
+    elif pa.types.is_integer(value_type) or pa.types.is_floating(value_type):
+        cells = _number_cells(array)
+    elif pa.types.is_timestamp(value_type):
+        cells = _timestamp_cells(array)
+    elif pa.types.is_date(value_type):
+        days = pc.cast(pc.cast(array, pa.date32()), pa.int32())
+        cells = _number_cells(pc.add(days, _EXCEL_EPOCH_OFFSET_DAYS), _STYLE_DATE)
+    elif pa.types.is_string(value_type) or pa.types.is_large_string(value_type):
+        cells = _string_cells(array)
+    else:
+        cells = _string_cells(pa.array([None if v is None else str(v) for v in array.to_pylist()], pa.string()))
+    return pc.fill_null(cells, _EMPTY_CELL)
+
+
+def _rows_xml(table: pa.Table) -> bytes:
+    columns = [_column_cells(column.combine_chunks()) for column in table.columns]
+    rows = pc.binary_join_element_wise("<row>", *columns, "</row>", "") if columns else pa.array(["<row/>"] * table.num_rows, pa.string())
+    return concatenated_bytes(rows)
+
+
+def _header_row_xml(column_names: List[str]) -> bytes:
+    cells = "".join(f'<c t="inlineStr"><is><t xml:space="preserve">{xml_escape(str(name))}</t></is></c>' for name in column_names)
+    return f"<row>{cells}</row>".encode("utf-8")
+
+
+def _batch_tables(batches: Iterator[pd.DataFrame]) -> Iterator[pa.Table]:
+    for batch in batches:
+        if not batch.empty:
+            yield columnar.dataframe_to_arrow_table(batch)
+
+
+def xlsx_stream(column_names: List[str], batches: Iterator[pd.DataFrame], max_sheet_rows: int = XLSX_MAX_SHEET_ROWS) -> Iterator[bytes]:
+    """
+    XLSX workbook of the batches, produced as a zip stream: each batch becomes rows of sheet XML
+    (inline strings, no shared-string table) and is compressed and handed out before the next one is
+    read, so memory is bounded by one batch. A new sheet (with the header row again) starts when a
+    sheet reaches max_sheet_rows rows. The zip has no seekable target, so entries carry data
+    descriptors; the workbook parts that list the sheets are written at the end.
+    """
+    data_rows_per_sheet = max_sheet_rows - 1 # The header takes one row
+    header = _header_row_xml(column_names)
+    sink = ChunkSink()
+    with zipfile.ZipFile(sink, "w", compression=zipfile.ZIP_DEFLATED, compresslevel=_ZIP_COMPRESSLEVEL) as archive:
+        sheet_count, sheet, sheet_rows = 0, None, 0
+
+        def open_sheet(rows_xml_bytes_per_row: float):
+            nonlocal sheet_count, sheet, sheet_rows
+            sheet_count += 1
+            # Entry sizes are not known up front; use zip64 only when a full sheet could pass 2 GiB
+            force_zip64 = rows_xml_bytes_per_row * data_rows_per_sheet * 1.5 > _ZIP64_LIMIT
+            sheet = archive.open(f"xl/worksheets/sheet{sheet_count}.xml", "w", force_zip64=force_zip64)
+            sheet.write(f'{_XML_DECLARATION}<worksheet xmlns="{_MAIN_NS}"><sheetData>'.encode("utf-8") + header)
+            sheet_rows = 0
+
+        def close_sheet():
+            sheet.write(b"</sheetData></worksheet>")
+            sheet.close()
+
+        for table in _batch_tables(batches):
+            start = 0
+            while start < table.num_rows:
+                if sheet is not None and sheet_rows >= data_rows_per_sheet:
+                    close_sheet()
+                    sheet = None
+                    yield sink.take()
+                part = table.slice(start, data_rows_per_sheet - sheet_rows if sheet is not None else data_rows_per_sheet)
+                rows_xml = _rows_xml(part)
+                if sheet is None:
+                    open_sheet(len(rows_xml) / part.num_rows)
+                sheet.write(rows_xml)
+                sheet_rows += part.num_rows
+                start += part.num_rows
+                yield sink.take()
+        if sheet is None: # No rows at all: a sheet with just the header
+            open_sheet(0)
+        close_sheet()
+        for name, xml in _workbook_parts(sheet_count).items():
+            archive.writestr(name, xml)
+    yield sink.take() # Central directory
+    logger.info(f"XLSX download written: {sheet_count} sheet(s), {sink.tell()} bytes")
+
+
+def csv_stream(column_names: List[str], batches: Iterator[pd.DataFrame]) -> Iterator[bytes]:
+    """CSV of the batches, one batch at a time. UTF-8 with a BOM so Excel detects the encoding of Chinese text."""
+    yield "\ufeff".encode("utf-8") + pd.DataFrame(columns=column_names).to_csv(index=False).encode("utf-8")
+    for batch in batches:
+        if not batch.empty:
+            yield batch.to_csv(index=False, header=False).encode("utf-8")
+
+
+# Arrow types of object columns whose values are all of one kind (infer_dtype over the whole column)
+_OBJECT_KIND_TYPES = {"integer": pa.int64(), "floating": pa.float64(), "mixed-integer-float": pa.float64(), "boolean": pa.bool_()}
+
+
+def object_column_types(df: pd.DataFrame) -> Dict[str, pa.DataType]:
+    """
+    Parquet types of df's object columns, decided over all rows before the first row group is
+    written: a column that is only numbers or only booleans keeps that type, anything else (text,
+    numbers mixed with text, all null) is written as strings.
+    """
+    return {str(col): _OBJECT_KIND_TYPES.get(pd.api.types.infer_dtype(df[col], skipna=True), pa.string())
+            for col in df.columns if df[col].dtype == object}
+
+
+def text_column_types(columns_info: Optional[Dict]) -> Dict[str, pa.DataType]:
+    """Parquet types from the whole-file column profile: columns profiled as object are written as strings."""
+    return {str(col): pa.string() for col, info in (columns_info or {}).items() if str(info.get('dtype', 'object')) == "object"}
+
+
+def _cast_to_schema(table: pa.Table, schema: pa.Schema) -> pa.Table:
+    columns = []
+    for column, target in zip(table.columns, schema):
+        try:
+            columns.append(column.cast(target.type))
+        except (pa.ArrowInvalid, pa.ArrowNotImplementedError):
+            if not pa.types.is_string(target.type):
+                raise
+            # Values the cast kernel cannot turn into text (nested, binary): as str() would write them
+            columns.append(pa.array([None if v is None else str(v) for v in column.to_pylist()], pa.string()))
+    return pa.Table.from_arrays(columns, schema=schema)
+
+
+def parquet_download_stream(column_names: List[str], batches: Iterator[pd.DataFrame], column_types: Optional[Dict[str, pa.DataType]] = None,
+                            row_group_rows: int = settings.QUERY_RESULT_ROW_GROUP_ROWS) -> Iterator[bytes]:
+    """
+    Parquet file of the batches, written row group by row group. column_types (object_column_types
+    of the full frame, or text_column_types of the file profile) fixes the types of columns whose
+    values may change kind from one batch to the next; the other columns take their type from the
+    first batch (strings if all null there). Later batches are cast to that schema.
+    """
+    column_types = column_types or {}
+    sink = ChunkSink()
+    writer, schema = None, None
+    try:
+        for table in _batch_tables(batches):
+            if writer is None:
+                fields = []
+                for field in table.schema:
+                    if field.name in column_types:
+                        field = field.with_type(column_types[field.name])
+                    elif pa.types.is_null(field.type):
+                        field = field.with_type(pa.string())
+                    fields.append(field)
+                schema = pa.schema(fields, metadata=table.schema.metadata)
+                writer = pq.ParquetWriter(sink, schema)
+            table = _cast_to_schema(table, schema)
+            for start in range(0, table.num_rows, row_group_rows):
+                writer.write_table(table.slice(start, row_group_rows))
+                yield sink.take()
+    finally:
+        if writer is not None:
+            writer.close()
+    if writer is None: # No rows: an empty file that still has the columns
+        pq.write_table(pa.table({str(name): pa.array([], pa.string()) for name in column_names}), sink)
+    yield sink.take()
@@ -0,0 +1,222 @@
+# app/excel/fast_parser.py
+import logging
+import re
+import unicodedata
+from typing import Dict, List, Any, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+# --- Vocabulary ---
+# Checked in order at the start of the text after a column name, so longer phrases come first.
+_OPERATOR_PATTERNS: List[Tuple[str, str, float]] = [
+    # (operator, regex, confidence of the phrase itself)
+    ("is_not_null", r'is\s+not\s+null\b|不为空|非空|不是空值?', 1.0),
+    ("is_null", r'is\s+null\b|为空|是空值?', 1.0),
+    ("not_between", r'not\s+between\b|不介于|不在', 1.0),
+    ("between", r'between\b|介于|在', 1.0),
+    ("not_in", r'not\s+in\b|不属于|不在', 1.0),
+    ("in", r'in\b|属于|在', 1.0),
+    ("not_contains", r'does\s+not\s+contain\b|not\s+contains?\b|不包含|不含', 1.0),
+    ("contains", r'contains?\b|包含|含有', 1.0),
+    ("greater_than_or_equal_to", r'>=|≥|大于等于|大于或等于|不小于|不低于|至少', 1.0),
+    ("less_than_or_equal_to", r'<=|≤|小于等于|小于或等于|不大于|不高于|不超过|至多', 1.0),
+    ("not_equals", r'!=|<>|≠|不等于|不是', 1.0),
+    ("greater_than", r'>|大于|超过|高于|多于|greater\s+than\b', 1.0),
+    ("less_than", r'<|小于|低于|少于|less\s+than\b', 1.0),
+    ("equals", r'==|=|等于|equals?\b', 1.0),
+    ("equals", r'是|为|is\b', 0.85), # Weak verbs: trusted only when the value is a known column value
+]
+# A text literal that is none of the column's known values may be a phrase the rules misread
+# ("city = 北京的客户"): left to the LLM (below FAST_PARSER_MIN_CONFIDENCE) instead of matching nothing
+_UNKNOWN_TEXT_VALUE_CONFIDENCE = 0.5
+_OPERATOR_RES = [(op, re.compile(rf'\s*(?:{pattern})\s*', re.IGNORECASE), conf) for op, pattern, conf in _OPERATOR_PATTERNS]
+
+_AND_SPLIT_RE = re.compile(r'\s+and\s+|\s*(?:并且|而且|同时|且|&&|;|；)\s*', re.IGNORECASE)
+_OR_SPLIT_RE = re.compile(r'\s+or\s+|\s*(?:或者|或|\|\|)\s*', re.IGNORECASE)
+_LEADING_FILLER_RE = re.compile(r'^\s*(?:请|帮我)?\s*(?:查找|查询|筛选|找出|找到|显示|列出|给我|show|find|list|select|filter|where)\s*', re.IGNORECASE)
+_TRAILING_FILLER_RE = re.compile(r'\s*(?:的)?\s*(?:所有)?\s*(?:记录|数据|行|条目|records?|rows?)?\s*[。.!！?？]*\s*$', re.IGNORECASE)
+_RANGE_SUFFIX_RE = re.compile(r'\s*(?:之间|之内|范围内)\s*$')
+_RANGE_SEPARATOR_RES = [re.compile(sep, re.IGNORECASE) for sep in (r'\s+and\s+', r'\s+to\s+', r'\s*和\s*', r'\s*与\s*', r'\s*到\s*', r'\s*至\s*', r'\s*~\s*')]
+_NUMERIC_DASH_RANGE_RE = re.compile(r'^(-?\d+(?:\.\d+)?)\s*-\s*(-?\d+(?:\.\d+)?)$')
+_LIST_MEMBERSHIP_SUFFIX_RE = re.compile(r'\s*(?:之中|中|里|内|之一)\s*$')
+_LIST_SPLIT_RE = re.compile(r'\s*[,，、|]\s*|\s+or\s+', re.IGNORECASE)
+_NUMBER_RE = re.compile(r'^-?\d+(?:\.\d+)?$')
+_DATE_RE = re.compile(r'^(\d{4})\s*(?:[-/.]|年)\s*(\d{1,2})\s*(?:[-/.]|月)\s*(\d{1,2})\s*日?$')
+
+_RANGE_OPERATORS = {"greater_than", "less_than", "greater_than_or_equal_to", "less_than_or_equal_to", "between", "not_between"}
+
+
+def _column_matchers(columns_info: Dict) -> List[Tuple[str, re.Pattern]]:
+    matchers = []
+    # Longest names first, so "order_date" wins over "order"
+    for col in sorted(columns_info.keys(), key=len, reverse=True):
+        if not col:
+            continue
+        pattern = r'[\s_]*'.join(re.escape(part) for part in col.split('_'))
+        matchers.append((col, re.compile(rf'^\s*[`"\'“]?{pattern}[`"\'”]?', re.IGNORECASE)))
+    return matchers
+
+
+def _strip_quotes(text: str) -> str:
+    text = text.strip()
+    if len(text) >= 2 and text[0] in '"\'“‘「`' and text[-1] in '"\'”’」`':
+        return text[1:-1]
+    return text
+
+
+def _column_kind(info: Dict) -> str:
+    dtype = str(info.get('dtype', '')).lower()
+    if 'datetime' in dtype or 'timestamp' in dtype or dtype.startswith('date'):
+        return "datetime"
+    if any(t in dtype for t in ('int', 'float', 'double', 'decimal')):
+        return "numeric"
+    samples = info.get('sample_values') or []
+    if samples and all(_DATE_RE.match(str(s)[:10]) for s in samples):
+        return "datetime" # Text column holding ISO dates, as apply_dynamic_filters detects them
+    return "text"
+
+
+def _typed_value(raw: str, kind: str) -> Optional[Any]:
+    """Converts a literal for the column kind, or None if it does not fit."""
+    text = _strip_quotes(raw)
+    if not text:
+        return None
+    if kind == "numeric":
+        if not _NUMBER_RE.match(text):
+            return None
+        return float(text) if '.' in text else int(text)
+    if kind == "datetime":
+        match = _DATE_RE.match(text)
+        if not match:
+            return None
+        year, month, day = match.groups()
+        return f"{int(year):04d}-{int(month):02d}-{int(day):02d}"
+    return text
+
+
+def _known_values(info: Dict) -> Set[str]:
+    known = {str(v) for v in info.get('sample_values') or []}
+    known.update(str(item.get('value')) for item in info.get('top_values') or [])
+    return known
+
+
+def _known_value(value: Any, info: Dict) -> bool:
+    return str(value) in _known_values(info)
+
+
+def _condition_values_known(condition: Dict, info: Dict) -> bool:
+    """Whether every literal of the condition is a known value of the column (a part of one, for contains)."""
+    if "value" not in condition:
+        return True
+    values = condition["value"] if isinstance(condition["value"], list) else [condition["value"]]
+    known = _known_values(info)
+    if condition["operator"] in ("contains", "not_contains"):
+        known_folded = [k.casefold() for k in known]
+        return all(any(str(v).casefold() in k for k in known_folded) for v in values)
+    return all(str(v) in known for v in values)
+
+
+def _parse_clause(clause: str, columns_info: Dict, matchers: List[Tuple[str, re.Pattern]]) -> Optional[Tuple[Dict, float]]:
+    for col, matcher in matchers:
+        col_match = matcher.match(clause)
+        if not col_match:
+            continue
+        rest = clause[col_match.end():]
+        info = columns_info[col]
+        kind = _column_kind(info)
+        for op, op_re, confidence in _OPERATOR_RES:
+            op_match = op_re.match(rest)
+            if not op_match:
+                continue
+            raw_value = rest[op_match.end():].strip()
+            condition = _build_condition(col, op, raw_value, kind)
+            if condition is None:
+                continue
+            if kind == "text" and not _condition_values_known(condition, info):
+                confidence = min(confidence, _UNKNOWN_TEXT_VALUE_CONFIDENCE)
+            elif confidence < 1.0 and _known_value(condition.get("value"), info):
+                confidence = 0.95
+            return condition, confidence
+        return None # The column matched but nothing after it did
+    return None
+
+
+def _split_range(raw_value: str) -> Optional[Tuple[str, str]]:
+    raw_value = _RANGE_SUFFIX_RE.sub('', raw_value)
+    for separator_re in _RANGE_SEPARATOR_RES:
+        parts = separator_re.split(raw_value, maxsplit=1)
+        if len(parts) == 2 and parts[0].strip() and parts[1].strip():
+            return parts[0], parts[1]
+    dash_match = _NUMERIC_DASH_RANGE_RE.match(raw_value.strip()) # "10-20"; dates contain dashes themselves
+    return (dash_match.group(1), dash_match.group(2)) if dash_match else None
+
+
+def _build_condition(col: str, op: str, raw_value: str, kind: str) -> Optional[Dict]:
+    if op in ("is_null", "is_not_null"):
+        return {"column": col, "operator": op} if not raw_value else None
+    if not raw_value:
+        return None
+
+    if op in ("between", "not_between"):
+        bounds = _split_range(raw_value) if kind != "text" else None
+        if bounds is None:
+            return None
+        low, high = _typed_value(bounds[0], kind), _typed_value(bounds[1], kind)
+        if low is None or high is None:
+            return None
+        return {"column": col, "operator": op, "value": [low, high]}
+
+    if op in ("in", "not_in"):
+        inner = _LIST_MEMBERSHIP_SUFFIX_RE.sub('', raw_value).strip()
+        if inner[:1] in '([（【' and inner[-1:] in ')]）】':
+            inner = inner[1:-1]
+        items = [item for item in _LIST_SPLIT_RE.split(inner) if item.strip()]
+        values = [_typed_value(item, kind) for item in items]
+        if not values or any(v is None for v in values):
+            return None
+        return {"column": col, "operator": op, "value": values}
+
+    if op in _RANGE_OPERATORS and kind == "text":
+        return None # Ordering text is the LLM's call (it may be a date or a number in disguise)
+    if op in ("contains", "not_contains"):
+        value = _strip_quotes(raw_value)
+    else:
+        value = _typed_value(raw_value, kind)
+    if value is None or value == "":
+        return None
+    return {"column": col, "operator": op, "value": value}
+
+
+def parse_query_locally(query: str, columns_info: Dict) -> Tuple[Optional[Dict], float]:
+    """
+    Rule-based parser for simple structured queries ("city = 北京", "amount > 1000",
+    "status in (A,B)", "日期 介于 2024-01-01 和 2024-03-31 之间"). Returns (parsed_conditions, confidence)
+    in the same shape as the LLM parsers, or (None, 0.0) if any part of the query is not understood.
+    """
+    if not query or not columns_info:
+        return None, 0.0
+    text = unicodedata.normalize("NFKC", query).strip()
+    text = _LEADING_FILLER_RE.sub('', text)
+    text = _TRAILING_FILLER_RE.sub('', text)
+    if not text:
+        return None, 0.0
+
+    # "between X and Y" uses "and" itself, so protect ranges before splitting on conjunctions
+    protected = re.sub(r'(between|介于|在)(\s*\S+?\s*)(and|和|与|到|至)(\s*\S+)', lambda m: m.group(0).replace(m.group(3), f'\x00{m.group(3)}\x00'), text, flags=re.IGNORECASE)
+    and_parts = [p for p in _AND_SPLIT_RE.split(protected) if p.strip()]
+    or_parts = [p for p in _OR_SPLIT_RE.split(protected) if p.strip()]
+    if len(and_parts) > 1 and len(or_parts) > 1:
+        return None, 0.0 # Mixed AND/OR needs precedence rules; leave it to the LLM
+    logical_operator, clauses = ("OR", or_parts) if len(or_parts) > 1 else ("AND", and_parts)
+
+    matchers = _column_matchers(columns_info)
+    filters = []
+    confidence = 1.0
+    for clause in clauses:
+        parsed = _parse_clause(clause.replace('\x00', ''), columns_info, matchers)
+        if parsed is None:
+            return None, 0.0
+        condition, clause_confidence = parsed
+        filters.append(condition)
+        confidence = min(confidence, clause_confidence)
+    return {"filters": filters, "logical_operator": logical_operator}, confidence
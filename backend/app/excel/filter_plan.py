@@ -0,0 +1,849 @@
+# app/excel/filter_plan.py
+import logging
+import re
+import sys
+import threading
+import weakref
+from dataclasses import dataclass, field
+from typing import Dict, List, Any, Optional, Callable, Tuple
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+SORTED_INDEX_MIN_ROWS = settings.FILTER_SORTED_INDEX_MIN_ROWS
+BITMAP_INDEX_MIN_ROWS = settings.FILTER_BITMAP_INDEX_MIN_ROWS
+BITMAP_INDEX_MAX_CARDINALITY = settings.FILTER_BITMAP_INDEX_MAX_CARDINALITY
+TRIGRAM_INDEX_MIN_ROWS = settings.FILTER_TRIGRAM_INDEX_MIN_ROWS
+
+RANGE_OPERATORS = {"greater_than", "less_than", "greater_than_or_equal_to", "less_than_or_equal_to", "between", "not_between"}
+NULL_OPERATORS = {"is_null", "is_not_null"}
+_COMPARATORS = {
+    "greater_than": np.greater,
+    "less_than": np.less,
+    "greater_than_or_equal_to": np.greater_equal,
+    "less_than_or_equal_to": np.less_equal,
+}
+_DATE_PREFIX_PATTERN = r'^\d{4}-\d{2}-\d{2}'
+
+# A kernel answers its predicate for the given row positions (None = all rows) as a bool array.
+Kernel = Callable[[Optional[np.ndarray]], np.ndarray]
+
+_NOT_INDEXED = False # Cached in place of an index a column does not qualify for
+
+
+def _nbytes(value: Any) -> int:
+    """Memory held by a built view: arrays (with their Python objects), indexes, tuples and dicts of them."""
+    if isinstance(value, np.ndarray):
+        if not value.flags.owndata and not value.flags.writeable:
+            return 0 # A read-only view of the frame's own data (or of the memory map), already counted
+        if value.dtype == object:
+            return int(pd.Series(value, copy=False).memory_usage(index=False, deep=True))
+        return int(value.nbytes)
+    if isinstance(value, pd.Index):
+        return int(value.memory_usage(deep=True))
+    if isinstance(value, tuple):
+        return sum(_nbytes(item) for item in value)
+    if isinstance(value, dict):
+        return sum(sys.getsizeof(key) + _nbytes(item) for key, item in value.items())
+    return 0
+
+
+def _arrow_zero_copy(series: pd.Series) -> Optional[np.ndarray]:
+    """
+    A NumPy view of an Arrow-backed column's own buffer (the shared memory map for columnar copies),
+    or None where NumPy needs a copy: nulls, several chunks, bit-packed booleans, strings.
+    """
+    if not isinstance(series.dtype, pd.ArrowDtype):
+        return None
+    chunked = series.array.__arrow_array__()
+    if chunked.num_chunks != 1 or chunked.null_count:
+        return None
+    try:
+        return chunked.chunk(0).to_numpy(zero_copy_only=True)
+    except (pa.ArrowInvalid, NotImplementedError):
+        return None
+
+
+class ColumnArtifacts:
+    """
+    Typed views of one column (NumPy arrays), each built on first use and then reused by every
+    query on the same frame, so no query casts the whole column again. on_view_built, if given,
+    is told the size in bytes of every view built (the DataFrame cache charges it to the frame).
+    Numeric and datetime views of null-free Arrow-backed columns are zero-copy views of the Arrow
+    buffers; other views of Arrow-backed columns (nulls, text) are private copies in each worker.
+    """
+
+    def __init__(self, series: pd.Series, indexed: bool = True, looks_like_dates: Optional[bool] = None,
+                 on_view_built: Optional[Callable[[int], None]] = None):
+        self.series = series
+        self.indexed = indexed # False for frames queried once (chunks), where building an index never pays off
+        self.on_view_built = on_view_built
+        self._views: Dict[str, Any] = {}
+        if looks_like_dates is not None:
+            self._views["looks_like_dates"] = looks_like_dates # Decided over the whole file, not this chunk
+        self._lock = threading.Lock()
+
+    def _view(self, name: str, build: Callable[[], Any]) -> Any:
+        # Views are never None; an ineligible index is cached as _NOT_INDEXED
+        view = self._views.get(name)
+        if view is None:
+            with self._lock:
+                view = self._views.get(name)
+                if view is None:
+                    view = build()
+                    self._views[name] = view
+                    if self.on_view_built is not None:
+                        self.on_view_built(_nbytes(view))
+        return view
+
+    @property
+    def kind(self) -> str:
+        """"datetime", "numeric" or "other" (text, mixed objects)."""
+        def build():
+            dtype = self.series.dtype
+            if pd.api.types.is_datetime64_any_dtype(dtype):
+                return "datetime"
+            if pd.api.types.is_numeric_dtype(dtype):
+                return "numeric"
+            return "other"
+        return self._view("kind", build)
+
+    @property
+    def tz(self) -> Optional[Any]:
+        dtype = self.series.dtype
+        if isinstance(dtype, pd.ArrowDtype):
+            return getattr(dtype.pyarrow_dtype, "tz", None) # timestamp[ns, tz=...][pyarrow] has no .tz of its own
+        return getattr(dtype, "tz", None)
+
+    def raw(self) -> np.ndarray:
+        def build():
+            if isinstance(self.series.dtype, pd.ArrowDtype):
+                # Nulls as None, as in frames converted from Arrow to NumPy types (not pd.NA, which isin([None]) misses)
+                return self.series.to_numpy(dtype=object, na_value=None)
+            return self.series.to_numpy()
+        return self._view("raw", build)
+
+    def null_mask(self) -> np.ndarray:
+        return self._view("null_mask", lambda: self.series.isna().to_numpy())
+
+    def numeric(self) -> np.ndarray:
+        """int64 for null-free integer columns, float64 with NaN for nulls otherwise."""
+        def build():
+            shared = _arrow_zero_copy(self.series)
+            if shared is not None and shared.dtype in (np.int64, np.float64):
+                return shared
+            # Nullable (Int64, Arrow) integer columns with NA cannot become int64
+            if self.series.dtype.kind in "iu" and not self.series.hasnans:
+                return self.series.to_numpy(dtype=np.int64)
+            converted = pd.to_numeric(self.series, errors='coerce')
+            return converted.to_numpy(dtype=np.float64, na_value=np.nan)
+        return self._view("numeric", build)
+
+    def datetime(self) -> np.ndarray:
+        """datetime64[ns] (UTC for tz-aware columns) with NaT for nulls and unparsable text."""
+        def build():
+            shared = _arrow_zero_copy(self.series) if self.kind == "datetime" else None
+            if shared is not None and shared.dtype == np.dtype("datetime64[ns]"):
+                return shared # Arrow stores tz-aware timestamps in UTC already
+            converted = self.series if self.kind == "datetime" else pd.to_datetime(self.series, errors='coerce')
+            if getattr(converted.dtype, "tz", None) is not None:
+                converted = converted.dt.tz_convert(None)
+            return converted.to_numpy(dtype="datetime64[ns]")
+        return self._view("datetime", build)
+
+    def sorted_index(self, view_name: str) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        (permutation, sorted non-null values) of the "numeric" or "datetime" view: row positions in
+        ascending value order, nulls (NaN/NaT sort last) cut off the sorted values.
+        """
+        def build():
+            values = self.numeric() if view_name == "numeric" else self.datetime()
+            order = np.argsort(values, kind="stable")
+            missing = np.isnat(values) if view_name == "datetime" else (np.isnan(values) if values.dtype.kind == "f" else np.zeros(len(values), dtype=bool))
+            return order, values[order][:len(values) - int(np.count_nonzero(missing))]
+        return self._view(f"sorted_{view_name}", build)
+
+    def _values(self, view_name: str) -> np.ndarray:
+        return {"numeric": self.numeric, "datetime": self.datetime, "strings": self.strings, "raw": self.raw}[view_name]()
+
+    def dictionary(self, view_name: str) -> Optional[Tuple[np.ndarray, pd.Index]]:
+        """
+        (codes, distinct values) of a view: int32 codes per row (-1 for nulls) into the distinct values.
+        None for frames under BITMAP_INDEX_MIN_ROWS rows or columns above BITMAP_INDEX_MAX_CARDINALITY.
+        """
+        def build():
+            values = self._values(view_name)
+            if not self.indexed or len(values) < BITMAP_INDEX_MIN_ROWS or BITMAP_INDEX_MAX_CARDINALITY <= 0:
+                return _NOT_INDEXED
+            codes, uniques = pd.factorize(values, use_na_sentinel=True)
+            if len(uniques) > BITMAP_INDEX_MAX_CARDINALITY:
+                return _NOT_INDEXED
+            return codes.astype(np.int32, copy=False), pd.Index(uniques)
+        dictionary = self._view(f"dictionary_{view_name}", build)
+        return dictionary if dictionary is not _NOT_INDEXED else None
+
+    def bitmap(self, view_name: str, code: int) -> np.ndarray:
+        """Packed bitset (np.packbits) of the rows holding distinct value number code; built when first asked for."""
+        codes, _ = self.dictionary(view_name)
+        return self._view(f"bitmap_{view_name}_{code}", lambda: np.packbits(codes == code))
+
+    def text_store(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        (codes, distinct values as str, casefolded distinct values): each distinct non-null value once,
+        so text predicates are evaluated per distinct value and mapped back to rows through the codes.
+        """
+        def build():
+            codes, uniques = pd.factorize(self.series, use_na_sentinel=True)
+            as_text = np.array([str(value) for value in uniques], dtype=object)
+            folded = np.array([text.casefold() for text in as_text], dtype=object)
+            return codes.astype(np.int32, copy=False), as_text, folded
+        return self._view("text_store", build)
+
+    def trigram_index(self) -> Optional[Dict[str, np.ndarray]]:
+        """Inverted index trigram -> sorted ids of the casefolded distinct values containing it (None for small frames)."""
+        def build():
+            if not self.indexed or len(self.series) < TRIGRAM_INDEX_MIN_ROWS or TRIGRAM_INDEX_MIN_ROWS <= 0:
+                return _NOT_INDEXED
+            _, _, folded = self.text_store()
+            postings: Dict[str, List[int]] = {}
+            for value_id, text in enumerate(folded):
+                for gram in {text[i:i + 3] for i in range(len(text) - 2)}:
+                    postings.setdefault(gram, []).append(value_id)
+            return {gram: np.array(ids, dtype=np.int32) for gram, ids in postings.items()}
+        index = self._view("trigram_index", build)
+        return index if index is not _NOT_INDEXED else None
+
+    def has_view(self, name: str) -> bool:
+        return name in self._views
+
+    def code_counts(self, name: str, codes: np.ndarray, n_values: int) -> np.ndarray:
+        """Rows per code of a coded view (dictionary or text store), for exact selectivity estimates."""
+        return self._view(f"counts_{name}", lambda: np.bincount(codes[codes >= 0], minlength=n_values))
+
+    def strings(self) -> np.ndarray:
+        """The column as str objects (as astype(str) renders them, nulls included)."""
+        return self._view("strings", lambda: self.series.astype(str).to_numpy(dtype=object))
+
+    def looks_like_dates(self) -> bool:
+        """Whether any non-null value starts with a YYYY-MM-DD date, for text columns holding dates."""
+        def build():
+            non_null = self.series.dropna()
+            return bool(non_null.astype(str).str.match(_DATE_PREFIX_PATTERN).any()) if not non_null.empty else False
+        return self._view("looks_like_dates", build)
+
+
+class DatasetArtifacts:
+    """
+    Per-frame cache of ColumnArtifacts, shared by all queries that run against the same frame object.
+    Chunks of a larger file are built with indexed=False and text_date_columns, the file-wide answer
+    to looks_like_dates, so every chunk coerces the same way. Artifacts owned by a DataFrame cache
+    entry (on_view_built given) keep their frame alive and report the size of each view they build.
+    """
+
+    def __init__(self, df: pd.DataFrame, indexed: bool = True, text_date_columns: Optional[Dict[str, bool]] = None,
+                 on_view_built: Optional[Callable[[int], None]] = None):
+        # The registry below only holds artifacts while their frame is referenced elsewhere
+        self._df_ref = (lambda frame=df: frame) if on_view_built is not None else weakref.ref(df)
+        self.n_rows = len(df)
+        self.indexed = indexed
+        self.text_date_columns = text_date_columns or {}
+        self.on_view_built = on_view_built
+        self._columns: Dict[str, ColumnArtifacts] = {}
+        self._lock = threading.Lock()
+
+    def has_column(self, col: str) -> bool:
+        df = self._df_ref()
+        return df is not None and col in df.columns
+
+    def column(self, col: str) -> ColumnArtifacts:
+        artifacts = self._columns.get(col)
+        if artifacts is None:
+            with self._lock:
+                artifacts = self._columns.get(col)
+                if artifacts is None:
+                    artifacts = ColumnArtifacts(self._df_ref()[col], self.indexed, self.text_date_columns.get(col), self.on_view_built)
+                    self._columns[col] = artifacts
+        return artifacts
+
+
+# id(df) -> (weak reference to df, artifacts). The weak reference guards against a reused id
+# and drops the entry once the frame is garbage collected (e.g. evicted from the DataFrame cache).
+_artifacts_registry: Dict[int, tuple] = {}
+_registry_lock = threading.RLock() # Reentrant: a weakref callback can fire while it is held
+
+
+def get_dataset_artifacts(df: pd.DataFrame) -> DatasetArtifacts:
+    key = id(df)
+    with _registry_lock:
+        entry = _artifacts_registry.get(key)
+        if entry is not None and entry[0]() is df:
+            return entry[1]
+        artifacts = DatasetArtifacts(df)
+        _artifacts_registry[key] = (weakref.ref(df, lambda _ref, key=key: _forget_artifacts(key, _ref)), artifacts)
+        return artifacts
+
+
+def register_dataset_artifacts(df: pd.DataFrame, artifacts: DatasetArtifacts) -> None:
+    """Makes get_dataset_artifacts(df) return artifacts built for another frame over the same data (a cache view)."""
+    key = id(df)
+    with _registry_lock:
+        _artifacts_registry[key] = (weakref.ref(df, lambda _ref, key=key: _forget_artifacts(key, _ref)), artifacts)
+
+
+def _forget_artifacts(key: int, dead_ref: weakref.ref) -> None:
+    with _registry_lock:
+        entry = _artifacts_registry.get(key)
+        if entry is not None and entry[0] is dead_ref:
+            del _artifacts_registry[key]
+
+
+@dataclass
+class CompiledPredicate:
+    index: int # Position of the condition in parsed_conditions["filters"]
+    column: str
+    operator: str
+    value_type: str # How the condition is evaluated: "numeric", "datetime", "string", "regex", "raw", "null" or "failed"
+    kernel: Kernel
+    selectivity: float = 1.0 # Estimated fraction of rows that match
+    selectivity_source: str = "default" # "exact" (from an index), "profile" (column statistics) or "default"
+    evaluated_rows: Optional[int] = None # Filled in by execute_filter_plan; None if short-circuited away
+
+    def describe(self) -> Dict[str, Any]:
+        return {
+            "index": self.index, "column": self.column, "operator": self.operator, "value_type": self.value_type,
+            "estimated_selectivity": round(self.selectivity, 6), "selectivity_source": self.selectivity_source,
+            "evaluated_rows": self.evaluated_rows,
+        }
+
+
+@dataclass
+class FilterPlan:
+    logical_operator: str
+    predicates: List[CompiledPredicate] = field(default_factory=list) # In evaluation order
+    skipped: List[int] = field(default_factory=list) # Indexes of conditions left out (incomplete or unknown column/operator)
+    failed: List[int] = field(default_factory=list) # Indexes of conditions whose value could not be coerced: they match no rows
+    short_circuited: bool = False # Stopped early: no rows left under AND, or all rows matched under OR
+    matched_rows: Optional[int] = None
+
+    def describe(self) -> Dict[str, Any]:
+        """The chosen evaluation order and what each step did, for debugging (the explain flag of /query)."""
+        return {
+            "logical_operator": self.logical_operator,
+            "order": [predicate.describe() for predicate in self.predicates],
+            "skipped": self.skipped,
+            "failed": self.failed,
+            "short_circuited": self.short_circuited,
+            "matched_rows": self.matched_rows,
+        }
+
+
+def _take(values: np.ndarray, rows: Optional[np.ndarray]) -> np.ndarray:
+    return values if rows is None else values[rows]
+
+
+def _to_datetime64(value: Any, column_tz: Optional[Any]) -> np.datetime64:
+    timestamp = pd.to_datetime(value, errors='coerce')
+    if pd.isna(timestamp):
+        raise ValueError(f"日期值解析失败: {value}")
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.tz_convert(None)
+    elif column_tz is not None:
+        timestamp = timestamp.tz_localize(column_tz).tz_convert(None) # Naive values are in the column's zone
+    return timestamp.to_datetime64().astype("datetime64[ns]")
+
+
+def _to_number(value: Any) -> float:
+    number = pd.to_numeric(value, errors='coerce')
+    if pd.isna(number):
+        raise ValueError(f"数字值解析失败: {value}")
+    return number
+
+
+def _looks_numeric(value: Any) -> bool:
+    return isinstance(value, (int, float, str)) and str(value).replace('.', '', 1).isdigit()
+
+
+def _range_kernel(values: np.ndarray, op: str, val: Any) -> Kernel:
+    if op in ("between", "not_between"):
+        low, high = val
+        negate = op == "not_between"
+        def kernel(rows):
+            arr = _take(values, rows)
+            inside = (arr >= low) & (arr <= high)
+            return ~inside if negate else inside # not_between keeps nulls, as ~Series.between did
+        return kernel
+    comparator = _COMPARATORS[op]
+    return lambda rows: comparator(_take(values, rows), val)
+
+
+class SortedRangeKernel:
+    """
+    Range predicate answered from the column's sorted index with two binary searches; the index is
+    built on first use and shared by all later queries on the frame. Row subsets fall back to a scan.
+    """
+
+    def __init__(self, column: ColumnArtifacts, view_name: str, op: str, val: Any, scan_kernel: Kernel):
+        self.column = column
+        self.view_name = view_name
+        self.op = op
+        self.val = val
+        self.scan_kernel = scan_kernel
+
+    def _bounds(self, sorted_values: np.ndarray) -> Tuple[int, int]:
+        op, val = self.op, self.val
+        lo, hi = 0, len(sorted_values)
+        if op in ("between", "not_between"):
+            lo, hi = np.searchsorted(sorted_values, val[0], side="left"), np.searchsorted(sorted_values, val[1], side="right")
+        elif op == "greater_than":
+            lo = np.searchsorted(sorted_values, val, side="right")
+        elif op == "greater_than_or_equal_to":
+            lo = np.searchsorted(sorted_values, val, side="left")
+        elif op == "less_than":
+            hi = np.searchsorted(sorted_values, val, side="left")
+        elif op == "less_than_or_equal_to":
+            hi = np.searchsorted(sorted_values, val, side="right")
+        return int(lo), int(max(lo, hi))
+
+    def __call__(self, rows: Optional[np.ndarray]) -> np.ndarray:
+        if rows is not None:
+            return self.scan_kernel(rows)
+        order, sorted_values = self.column.sorted_index(self.view_name)
+        lo, hi = self._bounds(sorted_values)
+        mask = np.zeros(len(order), dtype=bool)
+        mask[order[lo:hi]] = True
+        return ~mask if self.op == "not_between" else mask
+
+    def matched_fraction(self) -> Optional[float]:
+        # Exact, but only once some query has paid for the index
+        if not self.column.has_view(f"sorted_{self.view_name}"):
+            return None
+        order, sorted_values = self.column.sorted_index(self.view_name)
+        lo, hi = self._bounds(sorted_values)
+        fraction = (hi - lo) / max(len(order), 1)
+        return 1.0 - fraction if self.op == "not_between" else fraction
+
+
+def _typed_range_kernel(column: ColumnArtifacts, view_name: str, op: str, val: Any) -> Kernel:
+    values = column.numeric() if view_name == "numeric" else column.datetime()
+    scan_kernel = _range_kernel(values, op, val)
+    if column.indexed and len(values) >= SORTED_INDEX_MIN_ROWS > 0:
+        return SortedRangeKernel(column, view_name, op, val, scan_kernel)
+    return scan_kernel
+
+
+def _raw_range_kernel(column: ColumnArtifacts, op: str, val: Any) -> Kernel:
+    # Uncoerced comparison (e.g. text against text); nulls never match, type errors surface at execution
+    values, nulls = column.raw(), column.null_mask()
+    def kernel(rows):
+        arr, null = _take(values, rows), _take(nulls, rows)
+        mask = np.zeros(len(arr), dtype=bool)
+        present = ~null
+        mask[present] = _range_kernel(arr[present], op, val)(None)
+        return mask
+    return kernel
+
+
+def _isin_kernel(values: np.ndarray, candidates: List[Any], negate: bool) -> Kernel:
+    def kernel(rows):
+        matched = pd.Series(_take(values, rows), copy=False).isin(candidates).to_numpy()
+        return ~matched if negate else matched
+    return kernel
+
+
+class CodeLookupKernel:
+    """Predicate over a coded column (codes into distinct values, -1 for nulls), given the matching codes."""
+
+    def __init__(self, codes: np.ndarray, n_values: int, matched_codes: np.ndarray, negate: bool, counts: Callable[[], np.ndarray]):
+        self.codes = codes
+        self.matched_codes = matched_codes
+        self.negate = negate
+        self.counts = counts # Rows per code, computed once per column on first use
+        # Lookup table indexed by code + 1, so the null code -1 lands on a False slot
+        self.lookup = np.zeros(n_values + 1, dtype=bool)
+        self.lookup[matched_codes + 1] = True
+
+    def __call__(self, rows: Optional[np.ndarray]) -> np.ndarray:
+        matched = self.lookup[_take(self.codes, rows) + 1]
+        return ~matched if self.negate else matched
+
+    def matched_fraction(self) -> Optional[float]:
+        fraction = int(self.counts()[self.matched_codes].sum()) / max(len(self.codes), 1)
+        return 1.0 - fraction if self.negate else fraction # Negations keep the null rows
+
+
+class DictionaryKernel(CodeLookupKernel):
+    """
+    equals / not_equals / in / not_in on a dictionary-encoded column. Over all rows the answer is the
+    OR of the matching values' packed bitmaps (bitmap()); row subsets are answered from the codes.
+    """
+
+    def __init__(self, column: ColumnArtifacts, view_name: str, codes: np.ndarray, n_values: int, matched_codes: np.ndarray, negate: bool):
+        super().__init__(codes, n_values, matched_codes, negate, lambda: column.code_counts(f"dictionary_{view_name}", codes, n_values))
+        self.column = column
+        self.view_name = view_name
+
+    def bitmap(self) -> np.ndarray:
+        packed = np.zeros((len(self.codes) + 7) // 8, dtype=np.uint8)
+        for code in self.matched_codes:
+            packed |= self.column.bitmap(self.view_name, int(code))
+        return ~packed if self.negate else packed # Padding bits past the last row are ignored on unpack
+
+
+def _membership_kernel(column: ColumnArtifacts, view_name: str, candidates: List[Any], negate: bool, scan_kernel: Kernel) -> Kernel:
+    """A DictionaryKernel when the column is low-cardinality, else scan_kernel."""
+    if any(pd.isna(candidate) for candidate in candidates):
+        return scan_kernel # Null candidates follow isin's null matching; keep the scan for them
+    dictionary = column.dictionary(view_name)
+    if dictionary is None:
+        return scan_kernel
+    codes, uniques = dictionary
+    # isin over the distinct values, so candidates match exactly as the scan's isin would match them
+    # (get_indexer would miss True against the 1.0 of a bool column's numeric view)
+    positions = np.flatnonzero(uniques.isin(candidates)) if candidates else np.array([], dtype=np.intp)
+    return DictionaryKernel(column, view_name, codes, len(uniques), positions, negate)
+
+
+def _compile_range(column: ColumnArtifacts, op: str, val: Any) -> tuple:
+    if op in ("between", "not_between"):
+        if not (isinstance(val, list) and len(val) == 2):
+            raise ValueError("'between' 值应为列表[min, max]")
+        bounds = val
+    else:
+        bounds = [val]
+
+    text_dates = column.kind == "other" and all(isinstance(b, str) for b in bounds) and column.looks_like_dates()
+    if column.kind == "datetime" or text_dates:
+        typed = [_to_datetime64(b, column.tz) for b in bounds]
+        return "datetime", _typed_range_kernel(column, "datetime", op, typed if len(typed) == 2 else typed[0])
+    if column.kind == "numeric" or all(_looks_numeric(b) for b in bounds):
+        typed = [_to_number(b) for b in bounds]
+        return "numeric", _typed_range_kernel(column, "numeric", op, typed if len(typed) == 2 else typed[0])
+    return "raw", _raw_range_kernel(column, op, val)
+
+
+def _equality_kernel(column: ColumnArtifacts, view_name: str, val: Any, negate: bool) -> Kernel:
+    values = column._values(view_name)
+    scan_kernel = (lambda rows: _take(values, rows) != val) if negate else (lambda rows: _take(values, rows) == val)
+    return _membership_kernel(column, view_name, [val], negate, scan_kernel)
+
+
+def _compile_equality(column: ColumnArtifacts, op: str, val: Any) -> tuple:
+    negate = op == "not_equals"
+    if column.kind == "numeric" and not isinstance(val, bool):
+        try:
+            return "numeric", _equality_kernel(column, "numeric", _to_number(val), negate)
+        except ValueError:
+            pass # Not a number: compare as text below, which matches nothing but keeps not_equals correct
+    if column.kind == "datetime":
+        try:
+            return "datetime", _equality_kernel(column, "datetime", _to_datetime64(val, column.tz), negate)
+        except ValueError:
+            pass
+    if isinstance(val, str) or column.kind != "other":
+        return "string", _equality_kernel(column, "strings", str(val), negate)
+    return "raw", _equality_kernel(column, "raw", val, negate)
+
+
+def _compile_membership(column: ColumnArtifacts, op: str, val: Any) -> tuple:
+    candidates = val if isinstance(val, list) else [val]
+    negate = op == "not_in"
+    if column.kind == "numeric":
+        numbers = []
+        for candidate in candidates:
+            try:
+                numbers.append(_to_number(candidate))
+            except ValueError:
+                pass # Cannot equal any value of a numeric column
+        return "numeric", _membership_kernel(column, "numeric", numbers, negate, _isin_kernel(column.numeric(), numbers, negate))
+    if column.kind == "datetime":
+        moments = []
+        for candidate in candidates:
+            try:
+                moments.append(_to_datetime64(candidate, column.tz))
+            except ValueError:
+                pass
+        return "datetime", _membership_kernel(column, "datetime", moments, negate, _isin_kernel(column.datetime(), moments, negate))
+    return "raw", _membership_kernel(column, "raw", candidates, negate, _isin_kernel(column.raw(), candidates, negate))
+
+
+def _literal_match_ids(column: ColumnArtifacts, needle: str) -> np.ndarray:
+    """Ids of the distinct values containing needle (casefolded, literal)."""
+    _, _, folded = column.text_store()
+    candidate_ids = None
+    index = column.trigram_index() if len(needle) >= 3 else None
+    if index is not None:
+        # Every trigram of the needle must occur in a match: intersect the postings, rarest first
+        postings = sorted((index.get(needle[i:i + 3]) for i in range(len(needle) - 2)), key=lambda ids: -1 if ids is None else len(ids))
+        if postings[0] is None:
+            return np.array([], dtype=np.int64)
+        candidate_ids = postings[0]
+        for ids in postings[1:]:
+            candidate_ids = np.intersect1d(candidate_ids, ids, assume_unique=True)
+            if candidate_ids.size == 0:
+                return candidate_ids
+    if candidate_ids is None:
+        candidate_ids = np.arange(len(folded))
+    return np.array([value_id for value_id in candidate_ids if needle in folded[value_id]], dtype=np.int64)
+
+
+def _compile_contains(column: ColumnArtifacts, op: str, val: Any, use_regex: bool = False) -> tuple:
+    """
+    contains / not_contains: case-insensitive literal substring match by default, a regular expression
+    only when the condition asks for it ("regex": true). Nulls never contain anything.
+    """
+    codes, as_text, _ = column.text_store()
+    negate = op == "not_contains"
+    counts = lambda: column.code_counts("text_store", codes, len(as_text))
+    if use_regex:
+        try:
+            pattern = re.compile(str(val), re.IGNORECASE)
+        except re.error as e:
+            raise ValueError(f"无效的正则表达式: {e}")
+        matched_ids = np.array([value_id for value_id, text in enumerate(as_text) if pattern.search(text)], dtype=np.int64)
+        return "regex", CodeLookupKernel(codes, len(as_text), matched_ids, negate, counts)
+    return "string", CodeLookupKernel(codes, len(as_text), _literal_match_ids(column, str(val).casefold()), negate, counts)
+
+
+class FailedKernel:
+    """A condition that could not be compiled: it matches no rows, so it fails an AND and adds nothing to an OR."""
+
+    def __init__(self, n_rows: int):
+        self.n_rows = n_rows
+
+    def __call__(self, rows: Optional[np.ndarray]) -> np.ndarray:
+        return np.zeros(self.n_rows if rows is None else len(rows), dtype=bool)
+
+    def matched_fraction(self) -> Optional[float]:
+        return 0.0
+
+
+class NullKernel:
+    def __init__(self, nulls: np.ndarray, negate: bool):
+        self.nulls = nulls
+        self.negate = negate
+
+    def __call__(self, rows: Optional[np.ndarray]) -> np.ndarray:
+        nulls = _take(self.nulls, rows)
+        return ~nulls if self.negate else nulls.copy()
+
+    def matched_fraction(self) -> Optional[float]:
+        fraction = int(np.count_nonzero(self.nulls)) / max(len(self.nulls), 1)
+        return 1.0 - fraction if self.negate else fraction
+
+
+def _compile_null(column: ColumnArtifacts, op: str) -> tuple:
+    return "null", NullKernel(column.null_mask(), negate=op == "is_not_null")
+
+
+# Fallback selectivities when neither an index nor the column profile can tell
+_DEFAULT_SELECTIVITY = {
+    "equals": 0.05, "in": 0.15, "contains": 0.2, "is_null": 0.05,
+    "greater_than": 0.33, "less_than": 0.33, "greater_than_or_equal_to": 0.33, "less_than_or_equal_to": 0.33,
+    "between": 0.25,
+}
+_NEGATED = {"not_equals": "equals", "not_in": "in", "not_contains": "contains", "is_not_null": "is_null", "not_between": "between"}
+
+
+def _profile_selectivity(op: str, val: Any, info: Optional[Dict]) -> Optional[float]:
+    """Selectivity from the stored column profile (unique count, top values, min/max, null count)."""
+    if not info:
+        return None
+    if op in _NEGATED:
+        positive = _profile_selectivity(_NEGATED[op], val, info)
+        return None if positive is None else 1.0 - positive
+    row_count = info.get('row_count')
+    null_fraction = info['null_count'] / row_count if row_count and info.get('null_count') is not None else 0.0
+    if op == "is_null":
+        return null_fraction if row_count else None
+    if op in ("equals", "in"):
+        unique_count = info.get('unique_count')
+        if not unique_count:
+            return None
+        top_counts = {str(item.get('value')): item.get('count', 0) for item in info.get('top_values') or []}
+        total = 0.0
+        for value in (val if isinstance(val, list) else [val]):
+            if row_count and str(value) in top_counts:
+                total += top_counts[str(value)] / row_count
+            else:
+                total += (1.0 - null_fraction) / unique_count
+        return min(total, 1.0)
+    if op in RANGE_OPERATORS and info.get('min') is not None and info.get('max') is not None:
+        try:
+            low, high = float(info['min']), float(info['max'])
+            bounds = [float(v) for v in val] if op == "between" else [float(val)]
+        except (TypeError, ValueError):
+            return None # Dates and text: not worth parsing for an estimate
+        if high <= low:
+            return None
+        def below(x):
+            return min(max((x - low) / (high - low), 0.0), 1.0)
+        if op == "between":
+            fraction = below(bounds[1]) - below(bounds[0])
+        elif op in ("less_than", "less_than_or_equal_to"):
+            fraction = below(bounds[0])
+        else:
+            fraction = 1.0 - below(bounds[0])
+        return max(fraction, 0.0) * (1.0 - null_fraction)
+    return None
+
+
+def _estimate_selectivity(kernel: Kernel, op: str, val: Any, info: Optional[Dict]) -> Tuple[float, str]:
+    matched_fraction = getattr(kernel, "matched_fraction", None)
+    if matched_fraction is not None:
+        try:
+            exact = matched_fraction()
+        except Exception: # An estimate must never break the query
+            exact = None
+        if exact is not None:
+            return exact, "exact"
+    estimate = _profile_selectivity(op, val, info)
+    if estimate is not None:
+        return estimate, "profile"
+    if op in _NEGATED:
+        return 1.0 - _DEFAULT_SELECTIVITY[_NEGATED[op]], "default"
+    return _DEFAULT_SELECTIVITY.get(op, 0.5), "default"
+
+
+def compile_filter_plan(parsed_conditions: Dict, artifacts: DatasetArtifacts, columns_info: Optional[Dict] = None) -> FilterPlan:
+    """
+    Validates parsed conditions against the frame's typed columns once and turns each into a NumPy
+    kernel. Conditions that are incomplete or reference unknown columns/operators are skipped, as
+    apply_dynamic_filters always did. A condition whose value cannot be coerced to the column type
+    (or that fails to compile at all) is never dropped: it becomes a predicate matching no rows.
+    Predicates are ordered by estimated selectivity: most selective first under AND, least under OR.
+    """
+    logical_op = str(parsed_conditions.get("logical_operator", "AND")).upper()
+    if logical_op not in ("AND", "OR"):
+        logger.warning(f"Unknown logical operator '{logical_op}', defaulting to AND.")
+        logical_op = "AND"
+    plan = FilterPlan(logical_operator=logical_op)
+
+    for condition_idx, condition in enumerate(parsed_conditions.get("filters", [])):
+        col, op, val = condition.get("column"), condition.get("operator"), condition.get("value")
+        if not col or not op or not artifacts.has_column(col):
+            logger.warning(f"跳过无效或不完整的筛选条件 (索引 {condition_idx}): {condition}")
+            plan.skipped.append(condition_idx)
+            continue
+        if op not in NULL_OPERATORS and val is None:
+            logger.warning(f"Skipping filter condition (索引 {condition_idx}) due to missing 'value' for operator '{op}': {condition}")
+            plan.skipped.append(condition_idx)
+            continue
+        # A list for a scalar equality is the LLM's way of writing a membership test
+        if op in ("equals", "not_equals") and isinstance(val, list):
+            op = "in" if op == "equals" else "not_in"
+
+        column = artifacts.column(col)
+        try:
+            if op in RANGE_OPERATORS:
+                value_type, kernel = _compile_range(column, op, val)
+            elif op in ("equals", "not_equals"):
+                value_type, kernel = _compile_equality(column, op, val)
+            elif op in ("in", "not_in"):
+                value_type, kernel = _compile_membership(column, op, val)
+            elif op in ("contains", "not_contains"):
+                value_type, kernel = _compile_contains(column, op, val, use_regex=condition.get("regex") is True)
+            elif op in NULL_OPERATORS:
+                value_type, kernel = _compile_null(column, op)
+            else:
+                logger.warning(f"未知操作符 (索引 {condition_idx}) '{op}'，跳过条件。")
+                plan.skipped.append(condition_idx)
+                continue
+        except (ValueError, TypeError) as e:
+            logger.warning(f"筛选值或列类型不匹配 (索引 {condition_idx}, 列 '{col}', 操作 '{op}', 值 '{val}'): {e}. This condition matches no rows.")
+            plan.failed.append(condition_idx)
+            value_type, kernel = "failed", FailedKernel(artifacts.n_rows)
+        except Exception as e:
+            logger.error(f"处理筛选条件时发生意外错误 (索引 {condition_idx}, 列 '{col}', 操作 '{op}'): {str(e)}", exc_info=True)
+            plan.failed.append(condition_idx)
+            value_type, kernel = "failed", FailedKernel(artifacts.n_rows)
+        selectivity, source = _estimate_selectivity(kernel, op, val, (columns_info or {}).get(col))
+        plan.predicates.append(CompiledPredicate(condition_idx, col, op, value_type, kernel, selectivity, source))
+
+    # Stable sort, so equal estimates keep the LLM's order
+    plan.predicates.sort(key=lambda predicate: predicate.selectivity if logical_op == "AND" else -predicate.selectivity)
+    return plan
+
+
+def _log_failure(predicate: CompiledPredicate, error: Exception) -> None:
+    logger.error(f"处理筛选条件时发生意外错误 (索引 {predicate.index}, 列 '{predicate.column}', 操作 '{predicate.operator}'): {str(error)}", exc_info=True)
+
+
+def _execute_and(plan: FilterPlan, n_rows: int) -> np.ndarray:
+    # Full-frame bitmaps while predicates can produce them cheaply, then only the surviving rows
+    total_bitmap: Optional[np.ndarray] = None
+    survivors: Optional[np.ndarray] = None
+    for predicate in plan.predicates:
+        try:
+            if survivors is None and hasattr(predicate.kernel, "bitmap"):
+                predicate.evaluated_rows = n_rows
+                current_bitmap = predicate.kernel.bitmap()
+                total_bitmap = current_bitmap if total_bitmap is None else total_bitmap & current_bitmap
+                if not total_bitmap.any():
+                    survivors = np.array([], dtype=np.intp)
+            elif survivors is None and total_bitmap is None:
+                predicate.evaluated_rows = n_rows
+                survivors = np.flatnonzero(np.asarray(predicate.kernel(None), dtype=bool))
+            else:
+                if survivors is None:
+                    survivors = np.flatnonzero(np.unpackbits(total_bitmap, count=n_rows))
+                predicate.evaluated_rows = int(survivors.size)
+                survivors = survivors[np.asarray(predicate.kernel(survivors), dtype=bool)]
+        except Exception as e:
+            _log_failure(predicate, e) # A failed condition fails the whole AND
+            survivors = np.array([], dtype=np.intp)
+        if survivors is not None and survivors.size == 0:
+            plan.short_circuited = predicate is not plan.predicates[-1]
+            break
+
+    mask = np.zeros(n_rows, dtype=bool)
+    if survivors is not None:
+        mask[survivors] = True
+    elif total_bitmap is not None:
+        mask = np.unpackbits(total_bitmap, count=n_rows).view(bool)
+    else:
+        mask[:] = True # Nothing to evaluate
+    return mask
+
+
+def _execute_or(plan: FilterPlan, n_rows: int) -> np.ndarray:
+    # Each predicate only looks at rows no earlier predicate has matched
+    mask = np.zeros(n_rows, dtype=bool)
+    for position, predicate in enumerate(plan.predicates):
+        try:
+            if hasattr(predicate.kernel, "bitmap"):
+                predicate.evaluated_rows = n_rows
+                mask |= np.unpackbits(predicate.kernel.bitmap(), count=n_rows).view(bool)
+            elif position == 0:
+                predicate.evaluated_rows = n_rows
+                mask |= np.asarray(predicate.kernel(None), dtype=bool)
+            else:
+                remaining = np.flatnonzero(~mask)
+                predicate.evaluated_rows = int(remaining.size)
+                mask[remaining[np.asarray(predicate.kernel(remaining), dtype=bool)]] = True
+        except Exception as e:
+            _log_failure(predicate, e) # A failed condition just adds nothing to the OR
+        if mask.all():
+            plan.short_circuited = predicate is not plan.predicates[-1]
+            break
+    return mask
+
+
+def execute_filter_plan(plan: FilterPlan, artifacts: DatasetArtifacts) -> np.ndarray:
+    """
+    Runs the plan's predicates in order and returns the row mask. Under AND each predicate after the
+    first only sees the rows that survived so far, and evaluation stops once none are left; under OR
+    each one only sees rows not matched yet, stopping once all rows match. Dictionary-encoded
+    predicates over the full frame combine as packed bitsets. A predicate that fails at run time
+    fails the whole AND.
+    """
+    if plan.logical_operator == "AND":
+        mask = _execute_and(plan, artifacts.n_rows)
+    else:
+        mask = _execute_or(plan, artifacts.n_rows)
+    plan.matched_rows = int(np.count_nonzero(mask))
+    logger.debug(f"Filter plan: {plan.describe()}")
+    return mask
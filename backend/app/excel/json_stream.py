@@ -0,0 +1,63 @@
+# app/excel/json_stream.py
+import json
+import logging
+from typing import Dict, Any, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class JSONObjectStreamParser:
+    """
+    Incremental scanner for streamed LLM output: fed text fragments as they arrive, it tracks brace
+    depth (ignoring braces inside strings) and returns the first complete top-level JSON object that
+    has required_key. Text around the object (code fences, prose, trailing tokens) is skipped.
+    """
+
+    def __init__(self, required_key: Optional[str] = "filters"):
+        self.required_key = required_key
+        self._buffer: list = [] # Fragments of the object being scanned
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+
+    def feed(self, text: str) -> Optional[Dict[str, Any]]:
+        start = 0
+        for i, char in enumerate(text):
+            if self._depth == 0:
+                if char == '{':
+                    self._depth = 1
+                    start = i
+                continue
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == '\\':
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                self._in_string = True
+            elif char == '{':
+                self._depth += 1
+            elif char == '}':
+                self._depth -= 1
+                if self._depth == 0:
+                    self._buffer.append(text[start:i + 1])
+                    candidate = self._take_candidate()
+                    if candidate is not None:
+                        return candidate
+        if self._depth > 0:
+            self._buffer.append(text[start:])
+        return None
+
+    def _take_candidate(self) -> Optional[Dict[str, Any]]:
+        object_text = "".join(self._buffer)
+        self._buffer = []
+        try:
+            parsed = json.loads(object_text)
+        except json.JSONDecodeError:
+            logger.debug(f"Skipping unparsable streamed object: {object_text[:200]}")
+            return None
+        if isinstance(parsed, dict) and (self.required_key is None or self.required_key in parsed):
+            return parsed
+        return None
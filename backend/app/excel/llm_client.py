@@ -0,0 +1,109 @@
+# app/excel/llm_client.py
+import asyncio
+import logging
+from typing import Dict, Any, Optional, AsyncIterator
+import httpx
+from fastapi import HTTPException, status
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+PROVIDER_CONCURRENCY = {
+    "siliconflow": settings.LLM_SILICONFLOW_MAX_CONCURRENCY,
+    "ollama": settings.LLM_OLLAMA_MAX_CONCURRENCY,
+}
+PROVIDER_TIMEOUT_SECONDS = {
+    "siliconflow": settings.LLM_SILICONFLOW_TIMEOUT_SECONDS,
+    "ollama": settings.LLM_OLLAMA_TIMEOUT_SECONDS, # Local models can be slow to answer
+}
+
+
+class AsyncLLMClient:
+    """
+    Shared async HTTP client for LLM providers: one keep-alive connection pool for the process,
+    a concurrency limit per provider and per-provider timeouts. Waiting for a provider slot is
+    bounded too, so a saturated provider fails fast with a 503 instead of queueing forever.
+    """
+
+    def __init__(self):
+        self._client: Optional[httpx.AsyncClient] = None
+        self._semaphores: Dict[str, asyncio.Semaphore] = {}
+
+    def _get_client(self) -> httpx.AsyncClient:
+        # Created lazily so it binds to the running event loop
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=settings.LLM_HTTP_MAX_CONNECTIONS,
+                    max_keepalive_connections=settings.LLM_HTTP_MAX_KEEPALIVE_CONNECTIONS,
+                    keepalive_expiry=settings.LLM_HTTP_KEEPALIVE_EXPIRY_SECONDS,
+                ),
+                timeout=httpx.Timeout(settings.LLM_SILICONFLOW_TIMEOUT_SECONDS, connect=settings.LLM_CONNECT_TIMEOUT_SECONDS),
+            )
+        return self._client
+
+    def _get_semaphore(self, provider: str) -> asyncio.Semaphore:
+        if provider not in self._semaphores:
+            self._semaphores[provider] = asyncio.Semaphore(PROVIDER_CONCURRENCY.get(provider, 4))
+        return self._semaphores[provider]
+
+    def timeout_for(self, provider: str, timeout: Optional[float] = None) -> httpx.Timeout:
+        total = timeout if timeout is not None else PROVIDER_TIMEOUT_SECONDS.get(provider, settings.LLM_SILICONFLOW_TIMEOUT_SECONDS)
+        return httpx.Timeout(total, connect=min(settings.LLM_CONNECT_TIMEOUT_SECONDS, total))
+
+    async def _acquire_slot(self, provider: str) -> asyncio.Semaphore:
+        semaphore = self._get_semaphore(provider)
+        try:
+            await asyncio.wait_for(semaphore.acquire(), timeout=settings.LLM_QUEUE_TIMEOUT_SECONDS)
+        except asyncio.TimeoutError:
+            logger.warning(f"Timed out waiting for a free {provider} slot ({PROVIDER_CONCURRENCY.get(provider)} in use).")
+            raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=f"{provider} is busy, please retry later.")
+        return semaphore
+
+    async def post_json(
+        self,
+        provider: str,
+        url: str,
+        payload: Dict[str, Any],
+        headers: Optional[Dict[str, str]] = None,
+        timeout: Optional[float] = None,
+    ) -> httpx.Response:
+        """POSTs a JSON payload to a provider and returns the response (raises httpx.HTTPStatusError on 4xx/5xx)."""
+        semaphore = await self._acquire_slot(provider)
+        try:
+            response = await self._get_client().post(url, json=payload, headers=headers, timeout=self.timeout_for(provider, timeout))
+            response.raise_for_status()
+            return response
+        finally:
+            semaphore.release()
+
+    async def stream_lines(
+        self,
+        provider: str,
+        url: str,
+        payload: Dict[str, Any],
+        headers: Optional[Dict[str, str]] = None,
+        timeout: Optional[float] = None,
+    ) -> AsyncIterator[str]:
+        """
+        POSTs a JSON payload and yields the streamed response line by line (SSE or NDJSON).
+        Closing the generator early (contextlib.aclosing) closes the connection, which stops the generation.
+        """
+        semaphore = await self._acquire_slot(provider)
+        try:
+            async with self._get_client().stream("POST", url, json=payload, headers=headers, timeout=self.timeout_for(provider, timeout)) as response:
+                response.raise_for_status()
+                async for line in response.aiter_lines():
+                    if line:
+                        yield line
+        finally:
+            semaphore.release()
+
+    async def aclose(self) -> None:
+        if self._client is not None and not self._client.is_closed:
+            await self._client.aclose()
+        self._client = None
+
+
+llm_client = AsyncLLMClient()
@@ -0,0 +1,212 @@
+# app/excel/llm_dispatch.py
+import asyncio
+import logging
+import threading
+import time
+from collections import deque
+from typing import Dict, List, Any, Optional, Set, Tuple, Callable, Awaitable
+import numpy as np
+from fastapi import HTTPException, status
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+HEDGING_ENABLED = settings.LLM_HEDGING_ENABLED
+FAILOVER_ENABLED = settings.LLM_FAILOVER_ENABLED
+HEDGE_PERCENTILE = settings.LLM_HEDGE_PERCENTILE
+HEDGE_MIN_SAMPLES = settings.LLM_HEDGE_MIN_SAMPLES
+HEDGE_DEFAULT_DELAY_SECONDS = settings.LLM_HEDGE_DEFAULT_DELAY_SECONDS
+HEDGE_MIN_DELAY_SECONDS = settings.LLM_HEDGE_MIN_DELAY_SECONDS
+LATENCY_WINDOW = 200 # Recent successful calls per provider used for the percentile
+CIRCUIT_FAILURE_THRESHOLD = settings.LLM_CIRCUIT_FAILURE_THRESHOLD
+CIRCUIT_COOLDOWN_SECONDS = settings.LLM_CIRCUIT_COOLDOWN_SECONDS
+
+ProviderCall = Callable[[], Awaitable[Dict[str, Any]]]
+
+
+class LLMReplyError(HTTPException):
+    """
+    The provider answered, but not with usable conditions (malformed JSON, unexpected structure).
+    Says nothing about the provider's health, so it never counts toward its circuit breaker.
+    """
+
+    def __init__(self, detail: str):
+        super().__init__(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=detail)
+
+
+class CircuitBreaker:
+    """
+    Consecutive-failure circuit breaker for one provider. Open after failure_threshold failures in a
+    row; after cooldown_seconds one trial call is let through (half-open), whose outcome closes or
+    re-opens the circuit.
+    """
+
+    def __init__(self, failure_threshold: int = CIRCUIT_FAILURE_THRESHOLD, cooldown_seconds: float = CIRCUIT_COOLDOWN_SECONDS):
+        self.failure_threshold = failure_threshold
+        self.cooldown_seconds = cooldown_seconds
+        self.consecutive_failures = 0
+        self.opened_at: Optional[float] = None
+        self.trial_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        return "half_open" if time.monotonic() - self.opened_at >= self.cooldown_seconds else "open"
+
+    def allow(self) -> bool:
+        with self._lock:
+            state = self.state
+            if state == "closed":
+                return True
+            if state == "half_open" and not self.trial_in_flight:
+                self.trial_in_flight = True
+                return True
+            return False
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.consecutive_failures = 0
+            self.opened_at = None
+            self.trial_in_flight = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.consecutive_failures += 1
+            if self.trial_in_flight or self.consecutive_failures >= self.failure_threshold:
+                if self.opened_at is None or self.trial_in_flight:
+                    logger.warning(f"Circuit opened after {self.consecutive_failures} consecutive failures.")
+                self.opened_at = time.monotonic()
+            self.trial_in_flight = False
+
+    def release_trial(self) -> None:
+        """A half-open trial that was cancelled (lost a hedge race) says nothing about the provider."""
+        with self._lock:
+            self.trial_in_flight = False
+
+
+class LLMDispatcher:
+    """
+    Runs a parse against an ordered list of providers: hedges to the next provider when the current
+    one is slower than its latency percentile, fails over on errors and skips providers whose
+    circuit is open. The first successful answer wins and the rest are cancelled.
+    """
+
+    def __init__(self):
+        self.breakers: Dict[str, CircuitBreaker] = {}
+        self.latencies: Dict[str, deque] = {}
+        self.healthy: Set[str] = set() # Providers that answered (or passed a health check) in this worker
+
+    def _breaker(self, provider: str) -> CircuitBreaker:
+        if provider not in self.breakers:
+            self.breakers[provider] = CircuitBreaker()
+        return self.breakers[provider]
+
+    def hedge_delay(self, provider: str) -> float:
+        samples = self.latencies.get(provider)
+        if not samples or len(samples) < HEDGE_MIN_SAMPLES:
+            return HEDGE_DEFAULT_DELAY_SECONDS
+        return max(HEDGE_MIN_DELAY_SECONDS, float(np.percentile(samples, HEDGE_PERCENTILE)))
+
+    def _record_latency(self, provider: str, seconds: float) -> None:
+        self.latencies.setdefault(provider, deque(maxlen=LATENCY_WINDOW)).append(seconds)
+
+    def mark_healthy(self, provider: str) -> None:
+        self.healthy.add(provider)
+
+    def is_healthy(self, provider: str) -> bool:
+        return provider in self.healthy
+
+    @staticmethod
+    def _is_client_error(error: BaseException) -> bool:
+        # Client-side problems (4xx) would fail the same way on any provider
+        return isinstance(error, HTTPException) and error.status_code < 500
+
+    async def dispatch(self, calls: Dict[str, ProviderCall], order: List[str]) -> Tuple[Dict[str, Any], str, float]:
+        """
+        Returns (parsed_conditions, provider, latency_ms) from the first provider to answer.
+        calls maps provider name to a zero-argument coroutine function; order is the preference order.
+        """
+        if not FAILOVER_ENABLED and not HEDGING_ENABLED:
+            order = order[:1]
+        pending_providers = [p for p in order if p in calls]
+        running: Dict[asyncio.Task, Tuple[str, float]] = {}
+        last_error: Optional[BaseException] = None
+        client_error: Optional[BaseException] = None # Raised only once no other attempt is in flight
+        skipped_open = []
+
+        def start_next() -> bool:
+            while pending_providers:
+                provider = pending_providers.pop(0)
+                if not self._breaker(provider).allow():
+                    skipped_open.append(provider)
+                    continue
+                running[asyncio.ensure_future(calls[provider]())] = (provider, time.monotonic())
+                return True
+            return False
+
+        start_next()
+        try:
+            while running:
+                hedge_timeout = None
+                if HEDGING_ENABLED and pending_providers and len(running) == 1:
+                    provider, started = next(iter(running.values()))
+                    hedge_timeout = max(0.0, self.hedge_delay(provider) - (time.monotonic() - started))
+                done, _ = await asyncio.wait(running.keys(), timeout=hedge_timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    hedged_from = next(iter(running.values()))[0]
+                    if start_next():
+                        logger.info(f"{hedged_from} slower than its p{HEDGE_PERCENTILE:g} latency, hedging to {list(running.values())[-1][0]}.")
+                    continue
+                for task in done:
+                    provider, started = running.pop(task)
+                    elapsed = time.monotonic() - started
+                    error = task.exception()
+                    if error is None:
+                        self._breaker(provider).record_success()
+                        self._record_latency(provider, elapsed)
+                        self.mark_healthy(provider)
+                        return task.result(), provider, round(elapsed * 1000, 1)
+                    last_error = error
+                    if self._is_client_error(error):
+                        # Another provider would fail the same way; a hedge still running may yet answer
+                        self._breaker(provider).release_trial()
+                        client_error = client_error or error
+                        pending_providers.clear()
+                        continue
+                    if isinstance(error, LLMReplyError):
+                        self._breaker(provider).release_trial()
+                    else:
+                        self._breaker(provider).record_failure()
+                    logger.warning(f"LLM provider {provider} failed after {elapsed:.2f}s: {error}")
+                    if FAILOVER_ENABLED and not running:
+                        start_next()
+        finally:
+            for task, (provider, _) in running.items():
+                task.cancel()
+                self._breaker(provider).release_trial()
+
+        if client_error is not None:
+            raise client_error
+        if last_error is not None:
+            raise last_error
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=f"LLM providers temporarily unavailable (circuit open: {', '.join(skipped_open)}).",
+        )
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            provider: {
+                "circuit": self._breaker(provider).state,
+                "consecutive_failures": self._breaker(provider).consecutive_failures,
+                "hedge_delay_seconds": round(self.hedge_delay(provider), 3),
+                "latency_samples": len(self.latencies.get(provider) or ()),
+            }
+            for provider in sorted(set(self.breakers) | set(self.latencies))
+        }
+
+
+llm_dispatcher = LLMDispatcher()
@@ -12,6 +12,7 @@ class LLMProviderConfig(BaseModel):
     temperature: Optional[float] = None
     maxTokens: Optional[int] = None
     topP: Optional[float] = None
+    schemaTokenBudget: Optional[int] = None # Token budget for the column schema in the prompt (0 = unlimited)
 
 class LLMConfig(BaseModel):
     apiType: str
@@ -22,12 +23,16 @@ class LLMConfig(BaseModel):
 class ExcelQueryRequest(BaseModel):
     query: str
     config: Optional[LLMConfig] = None
+    explain: bool = False # Include the executed filter plan (condition order, selectivity estimates) in the response
+    format: Optional[str] = None # "json" (default), "ndjson" (streamed), "arrow" (IPC stream) or "parquet"; overrides the Accept header
+    page_size: Optional[int] = None # Rows in the first page of a JSON response (default QUERY_RESULT_PAGE_ROWS)
     # file_id_to_query: Optional[int] = None # Optional: To specify which uploaded file
 
 class ExcelDownloadRequest(BaseModel):
     query: Optional[str] = None
     parsed_conditions: Optional[Dict[str, Any]] = None
     config: Optional[LLMConfig] = None
+    format: str = "xlsx" # "xlsx", "csv" or "parquet"
     # file_id_to_download: Optional[int] = None # Optional
 
 # --- CORRECTED FileUploadResponse for "save original file metadata" strategy ---
@@ -52,8 +57,22 @@ class FileUploadResponse(BaseModel):
 class QueryExecutionResponse(BaseModel):
     query: str
     parsed_conditions: Dict[str, Any]
-    results: List[Dict[str, Any]]
+    results: List[Dict[str, Any]] # First page only; the rest comes from GET /results/{result_id}
     source_files: List[str] # Original filenames of the file(s) used for this query
+    result_id: Optional[str] = None # Handle of the stored result, valid for the temp store TTL
+    total_rows: Optional[int] = None
+    parsed_from_cache: bool = False # True if parsed_conditions came from the parse cache instead of the LLM
+    parse_source: str = "llm" # "llm", "fast_path" (local rules), "cache" (same query) or "template" (same query with different literals)
+    llm_provider: Optional[str] = None # Provider that answered, when parse_source is "llm" (may be a failover/hedge target)
+    llm_latency_ms: Optional[float] = None
+    filter_plan: Optional[Dict[str, Any]] = None # Only when the request set explain
+
+class QueryResultPageResponse(BaseModel):
+    result_id: str
+    offset: int
+    limit: int
+    total_rows: int
+    results: List[Dict[str, Any]]
 
 # For listing files associated with a group
 class UploadedExcelFileResponse(BaseModel): # Pydantic model for API response when listing files
@@ -0,0 +1,114 @@
+# app/excel/parse_cache.py
+import hashlib
+import json
+import logging
+import re
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Any, Optional
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+PARSE_CACHE_PATH = Path(settings.LLM_PARSE_CACHE_PATH)
+PARSE_CACHE_TTL_SECONDS = settings.LLM_PARSE_CACHE_TTL_SECONDS
+PARSE_CACHE_MAX_ENTRIES = settings.LLM_PARSE_CACHE_MAX_ENTRIES
+
+
+# Bump when normalize_query_text changes, so entries stored under the old keys are never hit
+# v2: case and width are kept; they can belong to a literal ("Shanghai" vs "shanghai")
+PARSE_CACHE_KEY_VERSION = 2
+
+
+def normalize_query_text(query: str) -> str:
+    """Collapses whitespace, so queries that differ only in spacing share an entry."""
+    return re.sub(r'\s+', ' ', query).strip()
+
+
+def schema_fingerprint(columns_info: Dict) -> str:
+    """Hash of the column names and dtypes (not the samples), in column order."""
+    schema = [[col, str(info.get('dtype', ''))] for col, info in columns_info.items()]
+    return hashlib.sha256(json.dumps(schema, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+def make_parse_cache_key(query: str, columns_info: Dict, provider: str, model: str, temperature: float) -> str:
+    key_material = [PARSE_CACHE_KEY_VERSION, normalize_query_text(query), schema_fingerprint(columns_info), provider, model, float(temperature)]
+    return hashlib.sha256(json.dumps(key_material, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+class ParsedConditionsCache:
+    """
+    SQLite-backed cache of LLM-parsed conditions with a TTL and LRU eviction.
+    Entries survive restarts and are shared by all workers on the host. The database is opened
+    (and created) on first use, not at import.
+    """
+
+    def __init__(self, db_path: Path, ttl_seconds: float, max_entries: int):
+        self.db_path = db_path
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+
+    def _connection(self) -> sqlite3.Connection:
+        # Caller holds the lock.
+        if self._conn is None:
+            self.db_path.parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(str(self.db_path), check_same_thread=False, timeout=5)
+            conn.execute("PRAGMA journal_mode=WAL") # Readers in other workers do not block writers
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS parsed_conditions_cache ("
+                " cache_key TEXT PRIMARY KEY, parsed_conditions TEXT NOT NULL,"
+                " created_at REAL NOT NULL, last_access REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS ix_parsed_conditions_cache_last_access ON parsed_conditions_cache (last_access)")
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    def get(self, cache_key: str) -> Optional[Dict[str, Any]]:
+        now = time.time()
+        try:
+            with self._lock:
+                conn = self._connection()
+                row = conn.execute(
+                    "SELECT parsed_conditions, created_at FROM parsed_conditions_cache WHERE cache_key = ?", (cache_key,)
+                ).fetchone()
+                if row is None:
+                    return None
+                if now - row[1] >= self.ttl_seconds:
+                    conn.execute("DELETE FROM parsed_conditions_cache WHERE cache_key = ?", (cache_key,))
+                    conn.commit()
+                    return None
+                conn.execute("UPDATE parsed_conditions_cache SET last_access = ? WHERE cache_key = ?", (now, cache_key))
+                conn.commit()
+            return json.loads(row[0])
+        except (sqlite3.Error, OSError, json.JSONDecodeError) as e:
+            logger.error(f"Parse cache read failed: {e}")
+            return None
+
+    def put(self, cache_key: str, parsed_conditions: Dict[str, Any]) -> None:
+        now = time.time()
+        try:
+            with self._lock:
+                conn = self._connection()
+                conn.execute(
+                    "INSERT OR REPLACE INTO parsed_conditions_cache (cache_key, parsed_conditions, created_at, last_access) VALUES (?, ?, ?, ?)",
+                    (cache_key, json.dumps(parsed_conditions, ensure_ascii=False), now, now),
+                )
+                # Drop expired entries, then the least recently used ones above the size limit
+                conn.execute("DELETE FROM parsed_conditions_cache WHERE created_at <= ?", (now - self.ttl_seconds,))
+                conn.execute(
+                    "DELETE FROM parsed_conditions_cache WHERE cache_key IN ("
+                    " SELECT cache_key FROM parsed_conditions_cache ORDER BY last_access DESC LIMIT -1 OFFSET ?)",
+                    (self.max_entries,),
+                )
+                conn.commit()
+        except (sqlite3.Error, OSError) as e:
+            logger.error(f"Parse cache write failed: {e}")
+
+
+parsed_conditions_cache = ParsedConditionsCache(PARSE_CACHE_PATH, PARSE_CACHE_TTL_SECONDS, PARSE_CACHE_MAX_ENTRIES)
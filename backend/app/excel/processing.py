@@ -3,18 +3,29 @@ import numpy as np
 import re
 import json
 import logging
-import requests
-from typing import Dict, List, Any, Optional, Tuple
+import httpx
+from typing import Dict, List, Any, Optional, Tuple, Iterator, Iterable
 from fastapi import HTTPException, status, UploadFile
+from fastapi.concurrency import run_in_threadpool
 from io import BytesIO
 from pathlib import Path
 import uuid # For unique session names
+from contextlib import aclosing
 from datetime import datetime
 from sqlmodel import Session
 import pyarrow
 from app.core.config import settings # If you have LLM API keys here
 # Assuming User and UploadedExcelFile DB models are imported where needed (e.g., from app.database.models)
 from app.database.models import User as DBUser, UploadedExcelFile as DBUploadedExcelFile
+from app.excel import columnar, profiler, filter_plan, sql_backend
+from app.excel.df_cache import dataframe_cache, make_cache_key
+from app.excel.llm_client import llm_client
+from app.excel.llm_dispatch import llm_dispatcher, LLMReplyError
+from app.excel.json_stream import JSONObjectStreamParser
+from app.excel.parse_cache import parsed_conditions_cache, make_parse_cache_key
+from app.excel import query_template
+from app.excel.fast_parser import parse_query_locally
+from app.excel.prompt_schema import serialize_schema_for_prompt, schema_supplement_for_query, schema_token_budget, SCHEMA_KEY_LEGEND
 
 
 logger = logging.getLogger(__name__)
@@ -55,15 +66,42 @@ def normalize_column_name(col_name: Any) -> str:
     col_name = col_name.strip('_')
     return col_name
 
+def normalize_column_names(col_names: Iterable[Any]) -> List[str]:
+    """
+    normalize_column_name for a whole header. Headers that normalize to the same name ("Amount" and
+    "amount ") get a suffix from the second one on (amount, amount_2, ...), so names stay unique.
+    """
+    normalized = [normalize_column_name(col) for col in col_names]
+    taken = set(normalized)
+    seen = set()
+    unique_names = []
+    for name in normalized:
+        if name in seen:
+            suffix = 2
+            while f"{name}_{suffix}" in taken:
+                suffix += 1
+            name = f"{name}_{suffix}"
+            taken.add(name)
+        seen.add(name)
+        unique_names.append(name)
+    return unique_names
+
+# Bump when generate_columns_info changes, so stored profiles are recomputed on next use.
+COLUMNS_INFO_VERSION = 2
+
 def generate_columns_info(df: pd.DataFrame) -> Dict:
     columns_info = {}
     if df is None or df.empty:
         return columns_info
     for col in df.columns:
-        dtype = str(df[col].dtype)
+        dtype = columnar.numpy_dtype_name(df[col])
         unique_count = df[col].nunique()
         # Ensure sample_values are JSON serializable (strings)
-        sample_values = df[col].dropna().sample(min(5, len(df[col].dropna()))).astype(str).tolist()
+        # Fixed seed: the same file always yields the same samples, so the prompt prefix stays cacheable
+        samples = df[col].dropna().sample(min(5, len(df[col].dropna())), random_state=0)
+        if isinstance(samples.dtype, pd.ArrowDtype):
+            samples = pyarrow.array(samples).to_pandas() # Printed as in NumPy-backed frames ('2024-03-29', not ...T00:00:00.000000000)
+        sample_values = samples.astype(str).tolist()
         columns_info[col] = {
             'dtype': dtype,
             'unique_count': int(unique_count),
@@ -127,6 +165,13 @@ async def save_original_files_and_create_records(
                 upload_timestamp=datetime.utcnow() # Or use a common timestamp for the batch
             )
 
+            # Parse once now so queries read the columnar copy instead of re-parsing the original.
+            # A failed ingest is not fatal: queries fall back to the original file.
+            try:
+                await run_in_threadpool(ingest_file_record, db_file_record)
+            except Exception as ingest_err:
+                logger.warning(f"Columnar ingest failed for '{original_filename}', queries will read the original: {ingest_err}")
+
             db.add(db_file_record)
             created_db_records.append(db_file_record) # Add to list before commit
 
@@ -155,6 +200,7 @@ async def save_original_files_and_create_records(
             # Critical: if commit fails, the files are on disk but records are not in DB.
             # Need a strategy for this: either delete files or log for manual cleanup.
             for record_data in created_db_records: # 'record_data' here is the uncommitted DBUploadedExcelFile instance
+                columnar.remove_columnar_copy(record_data.columnar_file_path)
                 failed_path = Path(record_data.stored_file_path)
                 if failed_path.exists():
                     try:
@@ -169,14 +215,27 @@ async def save_original_files_and_create_records(
     return created_db_records, processing_errors
 
 
-def read_and_prepare_dataframe_from_file(file_path_str: str) -> pd.DataFrame:
-    """Reads a DataFrame from a given path (original Excel/CSV)."""
+def read_and_prepare_dataframe_from_file(file_path_str: str, arrow_backed: Optional[bool] = None) -> pd.DataFrame:
+    """
+    Reads a DataFrame from a given path (original Excel/CSV, or a columnar Arrow copy).
+    Columnar copies are memory-mapped; with arrow_backed=True (default: settings) the returned
+    frame is a view backed by that mapping.
+    """
     file_path = Path(file_path_str)
 
     if not file_path.exists():
         logger.error(f"Data file not found at path: {file_path_str}")
         raise FileNotFoundError(f"Data file not found: {file_path_str}")
 
+    if file_path.suffix.lower() == columnar.COLUMNAR_SUFFIX:
+        if arrow_backed is None:
+            arrow_backed = settings.COLUMNAR_ARROW_BACKED_DATAFRAMES
+        try:
+            return columnar.read_columnar_copy(file_path_str, arrow_backed=arrow_backed)
+        except Exception as e:
+            logger.error(f"Error reading columnar copy {file_path_str}: {e}", exc_info=True)
+            raise ValueError(f"Could not read columnar data file '{file_path.name}': {str(e)}")
+
     try:
         logger.info(f"Attempting to read file: {file_path_str} with suffix: {file_path.suffix}")
         if file_path.suffix.lower() in [".xlsx", ".xls"]:
@@ -188,7 +247,7 @@ def read_and_prepare_dataframe_from_file(file_path_str: str) -> pd.DataFrame:
             raise ValueError(f"Unsupported file type for data: {file_path.suffix}")
 
         # Normalize column names for consistency if you plan to use generate_columns_info
-        df.columns = [normalize_column_name(col) for col in df.columns]
+        df.columns = normalize_column_names(df.columns)
 
         logger.info(f"Successfully read dataframe from {file_path_str}, shape: {df.shape}")
         return df
@@ -197,6 +256,254 @@ def read_and_prepare_dataframe_from_file(file_path_str: str) -> pd.DataFrame:
         raise ValueError(f"Could not read or prepare data from file '{file_path.name}': {str(e)}")
 
 
+def chunk_dtypes_from_columns_info(columns_info: Optional[Dict]) -> Dict[str, str]:
+    """Column types to pin while reading a file in chunks: the profiled numeric, bool and datetime dtypes, text otherwise."""
+    dtypes = {}
+    for col, info in (columns_info or {}).items():
+        dtype = str(info.get('dtype', 'object'))
+        dtypes[col] = dtype if dtype.startswith(("int", "uint", "float", "bool", "datetime64")) else "object"
+    return dtypes
+
+
+def iter_prepared_dataframe_chunks(file_path_str: str, columns_info: Optional[Dict] = None, chunk_rows: Optional[int] = None) -> Iterator[pd.DataFrame]:
+    """
+    Generator counterpart of read_and_prepare_dataframe_from_file: the same normalized column names,
+    chunk_rows (default FILTER_CHUNK_ROWS) rows at a time. Column types come from columns_info (the
+    whole-file profile; profiled in a streaming pass first if not given), so a column does not change
+    type from one chunk to the next.
+    """
+    file_path = Path(file_path_str)
+    if not file_path.exists():
+        logger.error(f"Data file not found at path: {file_path_str}")
+        raise FileNotFoundError(f"Data file not found: {file_path_str}")
+    dtypes = None
+    if file_path.suffix.lower() in (".csv", ".xlsx"): # Columnar copies and Parquet carry a schema
+        if columns_info is None:
+            columns_info = profiler.profile_file_streaming(file_path_str)
+        dtypes = chunk_dtypes_from_columns_info(columns_info)
+    yield from profiler.iter_file_chunks(file_path_str, chunk_rows or settings.FILTER_CHUNK_ROWS, dtypes)
+
+
+def _text_date_columns(file_path_str: str, parsed_conditions: Dict, columns_info: Optional[Dict], chunk_rows: Optional[int]) -> Dict[str, bool]:
+    """
+    looks_like_dates for the text columns that range conditions with text bounds compare, decided
+    over the whole file (one extra pass, stopping once every such column has shown a date).
+    """
+    candidates = set()
+    for condition in parsed_conditions.get("filters", []):
+        val = condition.get("value")
+        bounds = val if isinstance(val, list) else [val]
+        if condition.get("operator") in filter_plan.RANGE_OPERATORS and condition.get("column") and all(isinstance(b, str) for b in bounds):
+            candidates.add(condition["column"])
+    found = {col: False for col in candidates}
+    if not candidates:
+        return found
+    for chunk in iter_prepared_dataframe_chunks(file_path_str, columns_info, chunk_rows):
+        for col in candidates:
+            if not found[col] and col in chunk.columns and filter_plan.ColumnArtifacts(chunk[col], indexed=False).looks_like_dates():
+                found[col] = True
+        if all(found.values()):
+            break
+    return found
+
+
+def iter_dynamic_filter_chunks_with_plan(file_path_str: str, parsed_conditions: Dict, columns_info: Optional[Dict] = None, chunk_rows: Optional[int] = None) -> Iterator[Tuple[pd.DataFrame, Dict[str, Any]]]:
+    """
+    Generator counterpart of apply_dynamic_filters_with_plan: reads the file chunk by chunk and
+    yields (matching rows, executed plan) per chunk, so memory is bounded by the chunk size plus
+    what the caller keeps. Text-date detection is decided once for the file, not per chunk.
+    """
+    if columns_info is None and Path(file_path_str).suffix.lower() in (".csv", ".xlsx"):
+        columns_info = profiler.profile_file_streaming(file_path_str) # Shared by the passes below
+    has_filters = bool(parsed_conditions and parsed_conditions.get("filters"))
+    text_dates = _text_date_columns(file_path_str, parsed_conditions, columns_info, chunk_rows) if has_filters else {}
+    for chunk in iter_prepared_dataframe_chunks(file_path_str, columns_info, chunk_rows):
+        if not has_filters:
+            yield chunk, None
+            continue
+        artifacts = filter_plan.DatasetArtifacts(chunk, indexed=False, text_date_columns=text_dates)
+        plan = filter_plan.compile_filter_plan(parsed_conditions, artifacts, columns_info)
+        yield chunk[filter_plan.execute_filter_plan(plan, artifacts)], plan.describe()
+
+
+def iter_dynamic_filter_chunks(file_path_str: str, parsed_conditions: Dict, columns_info: Optional[Dict] = None, chunk_rows: Optional[int] = None) -> Iterator[pd.DataFrame]:
+    """Generator counterpart of apply_dynamic_filters: the matching rows of each chunk."""
+    for filtered_chunk, _ in iter_dynamic_filter_chunks_with_plan(file_path_str, parsed_conditions, columns_info, chunk_rows):
+        yield filtered_chunk
+
+
+def filter_file_chunked_with_plan(file_path_str: str, parsed_conditions: Dict, columns_info: Optional[Dict] = None) -> Tuple[pd.DataFrame, Optional[Dict[str, Any]]]:
+    """Out-of-core apply_dynamic_filters_with_plan: only the matching rows are ever held together."""
+    matched: List[pd.DataFrame] = []
+    first_plan = None
+    chunks = 0
+    for filtered_chunk, plan in iter_dynamic_filter_chunks_with_plan(file_path_str, parsed_conditions, columns_info):
+        chunks += 1
+        first_plan = first_plan or plan
+        matched.append(filtered_chunk)
+    df = pd.concat(matched, ignore_index=True) if matched else pd.DataFrame()
+    plan_info = {"backend": "chunked", "chunks": chunks, "matched_rows": len(df), "first_chunk_plan": first_plan}
+    return df, plan_info
+
+
+def _record_columnar_copy(file_record: DBUploadedExcelFile, df: pd.DataFrame) -> None:
+    columnar_path = columnar.write_columnar_copy(df, Path(file_record.stored_file_path))
+    if file_record.columnar_file_path and Path(file_record.columnar_file_path) != columnar_path.resolve():
+        columnar.remove_columnar_copy(file_record.columnar_file_path) # Copy in an older format
+    file_record.columnar_file_path = str(columnar_path.resolve())
+    file_record.columnar_format_version = columnar.COLUMNAR_FORMAT_VERSION
+
+
+def _record_columns_info(file_record: DBUploadedExcelFile, df: Optional[pd.DataFrame]) -> Dict:
+    columns_info = None
+    if df is None or profiler.use_streaming_profiler(file_record.file_size_bytes):
+        # Large files: one chunked pass over the memory-mapped copy (or the original) with
+        # approximate distinct counts, instead of exact nunique() over the whole frame.
+        source_path = file_record.columnar_file_path or file_record.stored_file_path
+        try:
+            columns_info = profiler.profile_file_streaming(source_path)
+        except Exception as e:
+            if df is None:
+                raise
+            logger.warning(f"Streaming profile failed for record ID {file_record.id}, using the exact profiler: {e}")
+    if columns_info is None:
+        columns_info = generate_columns_info(df)
+    file_record.columns_info_json = json.dumps(columns_info, ensure_ascii=False)
+    file_record.columns_info_version = COLUMNS_INFO_VERSION
+    return columns_info
+
+
+def ingest_file_record(file_record: DBUploadedExcelFile) -> Optional[pd.DataFrame]:
+    """
+    Parses the original file once, writes its columnar copy and profiles its columns,
+    recording both on the file record. Returns the prepared DataFrame.
+    Files the SQL backend filters in place (see sql_backend.is_large_file) are only profiled,
+    in one streaming pass, and None is returned. The caller is responsible for committing the record.
+    """
+    if sql_backend.is_large_file(file_record.file_size_bytes) and filter_backend_for_record(file_record)[0] != "pandas":
+        _record_columns_info(file_record, None)
+        logger.info(f"'{file_record.original_filename}' is filtered from disk; no columnar copy written.")
+        return None
+    df = read_and_prepare_dataframe_from_file(file_record.stored_file_path)
+    try:
+        _record_columnar_copy(file_record, df)
+    except Exception as e:
+        logger.warning(f"Could not write columnar copy for '{file_record.original_filename}', queries will read the original: {e}")
+    _record_columns_info(file_record, df)
+    return df
+
+
+def get_columns_info_for_record(db: Session, file_record: DBUploadedExcelFile, df: Optional[pd.DataFrame]) -> Dict:
+    """
+    Returns the column profile stored at ingest. It is recomputed from df, or by streaming the
+    file when df is None (and stored again), only when it is missing or was produced by an older
+    profiler version.
+    """
+    if file_record.columns_info_json and file_record.columns_info_version == COLUMNS_INFO_VERSION:
+        try:
+            return json.loads(file_record.columns_info_json)
+        except json.JSONDecodeError:
+            logger.warning(f"Stored columns_info for record ID {file_record.id} is corrupt, recomputing.")
+
+    columns_info = _record_columns_info(file_record, df)
+    try:
+        db.add(file_record)
+        db.commit()
+        db.refresh(file_record)
+    except Exception as e:
+        logger.error(f"Could not store columns_info for record ID {file_record.id}: {e}", exc_info=True)
+        db.rollback()
+    return columns_info
+
+
+def _cache_dataframe(file_record: DBUploadedExcelFile, source_path: Path, df: pd.DataFrame) -> pd.DataFrame:
+    """Caches df and returns the frame to serve: the cache's read-only view of it, or df if it could not be cached."""
+    try:
+        return dataframe_cache.put(make_cache_key(file_record.id, source_path), df)
+    except OSError as e:
+        logger.warning(f"Could not cache DataFrame for record ID {file_record.id}: {e}")
+        return df
+
+
+def load_dataframe_for_record(db: Session, file_record: DBUploadedExcelFile) -> pd.DataFrame:
+    """
+    Returns the prepared DataFrame for a file record, reading the columnar copy when it is fresh.
+    The original is re-parsed (and the copy rebuilt) only if the copy is missing or stale.
+    Frames are served from the process-wide cache when possible, as read-only views (df_cache.read_only_view).
+    """
+    if columnar.is_columnar_copy_fresh(file_record.columnar_file_path, file_record.columnar_format_version, Path(file_record.stored_file_path)):
+        columnar_path = Path(file_record.columnar_file_path)
+        try:
+            cached_df = dataframe_cache.get(make_cache_key(file_record.id, columnar_path))
+            if cached_df is not None:
+                logger.info(f"DataFrame cache hit for record ID {file_record.id}, shape: {cached_df.shape}")
+                return cached_df
+            df = read_and_prepare_dataframe_from_file(file_record.columnar_file_path)
+            logger.info(f"Memory-mapped columnar copy for record ID {file_record.id}, shape: {df.shape}")
+            return _cache_dataframe(file_record, columnar_path, df)
+        except Exception as e:
+            logger.warning(f"Columnar copy for record ID {file_record.id} is unreadable, re-parsing the original: {e}")
+
+    original_path = Path(file_record.stored_file_path)
+    if original_path.exists():
+        cached_df = dataframe_cache.get(make_cache_key(file_record.id, original_path))
+        if cached_df is not None:
+            logger.info(f"DataFrame cache hit for record ID {file_record.id} (original file), shape: {cached_df.shape}")
+            return cached_df
+
+    df = read_and_prepare_dataframe_from_file(file_record.stored_file_path)
+    try:
+        _record_columnar_copy(file_record, df)
+        _record_columns_info(file_record, df) # The original changed, so the stored profile did too
+        db.add(file_record)
+        db.commit()
+        db.refresh(file_record)
+        return _cache_dataframe(file_record, Path(file_record.columnar_file_path), df)
+    except Exception as e:
+        # The original parsed fine, so serve it even if the copy could not be rebuilt.
+        logger.warning(f"Could not rebuild columnar copy for record ID {file_record.id}: {e}")
+        db.rollback()
+        return _cache_dataframe(file_record, original_path, df)
+
+
+CHUNKED_SOURCE_SUFFIXES = (columnar.COLUMNAR_SUFFIX, ".csv", ".xlsx", ".xls", ".parquet")
+
+
+def filter_backend_for_record(file_record: DBUploadedExcelFile) -> Tuple[str, Optional[str]]:
+    """
+    How a record is filtered: ("duckdb", path) or ("chunked", path) for files read from disk (the
+    fresh columnar copy, else the original), ("pandas", None) for files loaded into memory.
+    """
+    source_path = file_record.stored_file_path
+    if columnar.is_columnar_copy_fresh(file_record.columnar_file_path, file_record.columnar_format_version, Path(file_record.stored_file_path)):
+        source_path = file_record.columnar_file_path
+    if sql_backend.use_sql_backend(file_record.file_size_bytes, source_path):
+        return "duckdb", source_path
+    if sql_backend.is_large_file(file_record.file_size_bytes) and Path(source_path).suffix.lower() in CHUNKED_SOURCE_SUFFIXES:
+        return "chunked", source_path
+    return "pandas", None
+
+
+def filter_with_backend(backend: str, source_path: Optional[str], df: Optional[pd.DataFrame], parsed_conditions: Dict, columns_info: Optional[Dict] = None) -> Tuple[pd.DataFrame, Optional[Dict[str, Any]]]:
+    """Runs the filter on the backend filter_backend_for_record chose; df is only needed for "pandas"."""
+    if backend == "duckdb":
+        return sql_backend.filter_file_with_plan(source_path, parsed_conditions)
+    if backend == "chunked":
+        return filter_file_chunked_with_plan(source_path, parsed_conditions, columns_info)
+    return apply_dynamic_filters_with_plan(df, parsed_conditions, columns_info)
+
+
+def iter_filter_with_backend(backend: str, source_path: Optional[str], parsed_conditions: Dict, columns_info: Optional[Dict] = None, batch_rows: Optional[int] = None) -> Iterator[pd.DataFrame]:
+    """
+    Matching rows of a file filtered from disk ("duckdb" or "chunked"), yielded as they are found,
+    so the first rows can be sent before the whole file has been scanned.
+    """
+    if backend == "duckdb":
+        yield from sql_backend.iter_filter_file(source_path, parsed_conditions, batch_rows or settings.QUERY_STREAM_BATCH_ROWS)
+    else:
+        yield from iter_dynamic_filter_chunks(source_path, parsed_conditions, columns_info)
+
+
 def get_excel_files_for_group(db: Session, group_id: int, limit: Optional[int] = None) -> List[DBUploadedExcelFile]:
     # This function remains largely the same, but now returns individual file records
     query = db.query(DBUploadedExcelFile).filter(DBUploadedExcelFile.user_group_id == group_id).order_by(DBUploadedExcelFile.upload_timestamp.desc())
@@ -204,12 +511,51 @@ def get_excel_files_for_group(db: Session, group_id: int, limit: Optional[int] =
         query = query.limit(limit)
     return query.all()
 
-# --- LLM Parsing Functions (parse_with_siliconflow, parse_with_ollama) ---
+# --- LLM Parsing Functions (async_parse_with_siliconflow, async_parse_with_ollama) ---
 # These are almost identical to your Flask app's versions.
 # Make sure to handle API keys securely, e.g., from settings.
+# Each provider is split into building the request and interpreting the response, so the
+# plain and the streamed replies share the same logic.
+
+def _validate_parsed_conditions(parsed_conditions: Any, columns_info_dict: Dict) -> Dict:
+    # Validation
+    if not isinstance(parsed_conditions, dict) or "filters" not in parsed_conditions or not isinstance(parsed_conditions["filters"], list):
+        logger.error(f"LLM返回的JSON结构不符合预期: {parsed_conditions}")
+        raise ValueError("LLM返回的JSON结构不符合预期")
+
+    valid_columns = set(columns_info_dict.keys())
+    # Filter out invalid conditions more gracefully or log them
+    validated_filters = []
+    for item in parsed_conditions.get("filters", []):
+        if isinstance(item, dict) and item.get("column") in valid_columns and "operator" in item:
+             # 'value' can be legitimately missing for "is_null", "is_not_null"
+            if item["operator"] in ["is_null", "is_not_null"] or "value" in item:
+                validated_filters.append(item)
+            else:
+                logger.warning(f"Skipping filter due to missing 'value' for operator '{item['operator']}': {item}")
+        else:
+            logger.warning(f"Skipping invalid filter item from LLM: {item}")
 
-def parse_with_siliconflow(query: str, columns_info_dict: Dict, config: Dict) -> Dict:
-    logger.info(f"开始使用硅基流动API解析自然语言查询: {query}")
+    parsed_conditions["filters"] = validated_filters
+    if "logical_operator" not in parsed_conditions or parsed_conditions["logical_operator"] not in ["AND", "OR"]:
+        parsed_conditions["logical_operator"] = "AND" # Default or correct
+    return parsed_conditions
+
+
+def _query_prompt_section(query: str, columns_info_dict: Dict, schema_text: str) -> str:
+    """The query-specific tail of the user message: samples trimmed from the schema for relevant columns, then the query."""
+    section = ""
+    supplement = schema_supplement_for_query(columns_info_dict, schema_text, query)
+    if supplement:
+        section += f"与查询相关的列的示例值: {supplement}\n"
+    section += f"""请将以下自然语言查询转换为结构化的JSON筛选条件对象:
+"{query}"
+"""
+    return section
+
+
+def _build_siliconflow_request(query: str, columns_info_dict: Dict, config: Dict) -> Tuple[str, Dict, Dict]:
+    """Returns (api_url, headers, payload) for a SiliconFlow chat completion."""
     api_key = config.get('apiKey', DEFAULT_LLM_CONFIG['siliconflow']['apiKey'])
     api_url = config.get('apiUrl', DEFAULT_LLM_CONFIG['siliconflow']['apiUrl'])
     model = config.get('model', DEFAULT_LLM_CONFIG['siliconflow']['model'])
@@ -219,6 +565,7 @@ def parse_with_siliconflow(query: str, columns_info_dict: Dict, config: Dict) ->
     if not api_key or api_key == "YOUR_SILICONFLOW_KEY": # Basic check
         logger.error("硅基流动API密钥未配置或无效。")
         raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="硅基流动API密钥未配置。")
+    schema_text = serialize_schema_for_prompt(columns_info_dict, schema_token_budget("siliconflow", model, config))
 
     system_prompt = f"""你是一个专业的数据分析助手。
 你的任务是将用户的自然语言查询转换为一个结构化的JSON筛选条件对象。
@@ -228,7 +575,7 @@ def parse_with_siliconflow(query: str, columns_info_dict: Dict, config: Dict) ->
 - "operator": 筛选操作符，可以是:
     - "equals": 等于 (用于精确匹配文本或数字)
     - "not_equals": 不等于
-    - "contains": 包含 (用于文本部分匹配，大小写不敏感)
+    - "contains": 包含 (用于文本部分匹配，大小写不敏感，按字面匹配；仅当用户明确要求正则时加 "regex": true)
     - "not_contains": 不包含
     - "greater_than": 大于 (用于数字或日期)
     - "less_than": 小于 (用于数字或日期)
@@ -242,18 +589,17 @@ def parse_with_siliconflow(query: str, columns_info_dict: Dict, config: Dict) ->
     - "is_not_null": 值不为空
 - "value": 筛选的值。对于 "between", "in", "not_in" 操作符，value应该是一个列表。对于 "is_null", "is_not_null", value可以省略或为null。
 
-用户数据表的列信息如下 (列名已规范化为小写和下划线)：
-{json.dumps(columns_info_dict, ensure_ascii=False, indent=2)}
+用户数据表的列信息如下 (列名已规范化为小写和下划线; {SCHEMA_KEY_LEGEND})：
+{schema_text}
 
 请确保 "column" 字段的值严格匹配上述列信息中的列名。
 如果查询涉及到日期，请尝试将日期转换为 "YYYY-MM-DD" 格式。
 如果查询意图不明确或无法转换为筛选条件，请返回一个空的 "filters" 列表。
 只返回JSON对象，不要包含任何其他解释或说明。
 """
-    user_prompt = f"""请将以下自然语言查询转换为结构化的JSON筛选条件对象:
-"{query}"
-
-请根据我上面提供的数据列信息，确保JSON中的"column"字段使用的是列信息中的实际列名。
+    # The system prompt depends only on the file's schema, so providers can reuse its cached prefix;
+    # everything query-specific goes at the end of the user message.
+    user_prompt = f"""请根据我上面提供的数据列信息，确保JSON中的"column"字段使用的是列信息中的实际列名。
 例如，如果列信息中有 "product_name"，则JSON中应使用 "product_name"，而不是 "产品名称"。
 返回的JSON对象格式应为：
 {{
@@ -265,7 +611,7 @@ def parse_with_siliconflow(query: str, columns_info_dict: Dict, config: Dict) ->
 }}
 如果查询中没有明确的逻辑操作符（如"和"、"或"），默认为 "AND"。
 只返回JSON对象。
-"""
+{_query_prompt_section(query, columns_info_dict, schema_text)}"""
 
     headers = {"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"}
     payload = {
@@ -275,64 +621,108 @@ def parse_with_siliconflow(query: str, columns_info_dict: Dict, config: Dict) ->
         "max_tokens": max_tokens,
         "response_format": {"type": "json_object"} # Ensure LLM provides JSON
     }
+    return api_url, headers, payload
+
+
+def _conditions_from_siliconflow_response(result: Dict, columns_info_dict: Dict) -> Dict:
+    assistant_message_content = result.get('choices', [{}])[0].get('message', {}).get('content', '')
+    if not assistant_message_content:
+        logger.warning("硅基流动API响应中未找到 'content'。")
+        return {"filters": [], "logical_operator": "AND"}
+
+    # Attempt to parse the content as JSON
     try:
-        response = requests.post(api_url, headers=headers, json=payload, timeout=30)
-        response.raise_for_status()
-        result = response.json()
-        assistant_message_content = result.get('choices', [{}])[0].get('message', {}).get('content', '')
-        if not assistant_message_content:
-            logger.warning("硅基流动API响应中未找到 'content'。")
-            return {"filters": [], "logical_operator": "AND"}
-
-        # Attempt to parse the content as JSON
-        try:
-            parsed_conditions = json.loads(assistant_message_content)
-        except json.JSONDecodeError as jde:
-            logger.error(f"硅基流动API返回的不是有效的JSON: {assistant_message_content}. Error: {jde}")
-            raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="LLM返回的不是有效的JSON")
-
-
-        # Validation
-        if not isinstance(parsed_conditions, dict) or "filters" not in parsed_conditions or not isinstance(parsed_conditions["filters"], list):
-            logger.error(f"LLM返回的JSON结构不符合预期: {parsed_conditions}")
-            raise ValueError("LLM返回的JSON结构不符合预期")
-
-        valid_columns = set(columns_info_dict.keys())
-        # Filter out invalid conditions more gracefully or log them
-        validated_filters = []
-        for item in parsed_conditions.get("filters", []):
-            if isinstance(item, dict) and item.get("column") in valid_columns and "operator" in item:
-                 # 'value' can be legitimately missing for "is_null", "is_not_null"
-                if item["operator"] in ["is_null", "is_not_null"] or "value" in item:
-                    validated_filters.append(item)
-                else:
-                    logger.warning(f"Skipping filter due to missing 'value' for operator '{item['operator']}': {item}")
-            else:
-                logger.warning(f"Skipping invalid filter item from LLM: {item}")
+        parsed_conditions = json.loads(assistant_message_content)
+    except json.JSONDecodeError as jde:
+        logger.error(f"硅基流动API返回的不是有效的JSON: {assistant_message_content}. Error: {jde}")
+        raise LLMReplyError("LLM返回的不是有效的JSON")
+
+    parsed_conditions = _validate_parsed_conditions(parsed_conditions, columns_info_dict)
+    logger.info(f"硅基流动LLM解析后的筛选条件: {json.dumps(parsed_conditions, ensure_ascii=False)}")
+    return parsed_conditions
+
+
+def _siliconflow_stream_delta(line: str) -> Optional[str]:
+    # SSE: "data: {chunk}" lines, ending with "data: [DONE]"; reasoning tokens come in a separate field
+    if not line.startswith("data:"):
+        return None
+    data = line[len("data:"):].strip()
+    if data == "[DONE]":
+        return None
+    try:
+        chunk = json.loads(data)
+    except json.JSONDecodeError:
+        return None
+    choices = chunk.get('choices') or [{}]
+    return (choices[0].get('delta') or {}).get('content')
+
+
+def _ollama_stream_delta(line: str) -> Optional[str]:
+    # NDJSON: one {"message": {"content": ...}, "done": false} object per line
+    try:
+        chunk = json.loads(line)
+    except json.JSONDecodeError:
+        return None
+    return (chunk.get('message') or {}).get('content')
+
 
-        parsed_conditions["filters"] = validated_filters
-        if "logical_operator" not in parsed_conditions or parsed_conditions["logical_operator"] not in ["AND", "OR"]:
-            parsed_conditions["logical_operator"] = "AND" # Default or correct
+async def _stream_llm_json(provider: str, api_url: str, payload: Dict, headers: Optional[Dict], delta_from_line) -> Tuple[Optional[Dict], str]:
+    """
+    Streams a completion and returns (first complete JSON object with "filters", content so far) as
+    soon as that object has arrived, closing the connection so the provider stops generating.
+    If the stream ends without one, returns (None, full content) for the regular extraction.
+    """
+    stream_parser = JSONObjectStreamParser(required_key="filters")
+    content_parts: List[str] = []
+    async with aclosing(llm_client.stream_lines(provider, api_url, {**payload, "stream": True}, headers=headers)) as lines:
+        async for line in lines:
+            delta = delta_from_line(line)
+            if not delta:
+                continue
+            content_parts.append(delta)
+            parsed = stream_parser.feed(delta)
+            if parsed is not None:
+                return parsed, "".join(content_parts)
+    return None, "".join(content_parts)
 
-        logger.info(f"硅基流动LLM解析后的筛选条件: {json.dumps(parsed_conditions, ensure_ascii=False)}")
-        return parsed_conditions
-    except requests.exceptions.RequestException as e:
+
+async def async_parse_with_siliconflow(query: str, columns_info_dict: Dict, config: Dict) -> Dict:
+    """
+    Parses the query with SiliconFlow through the shared pooled client, without blocking the event loop.
+    With LLM_STREAM_RESPONSES the completion is streamed and cut off once the JSON object is complete.
+    """
+    logger.info(f"开始使用硅基流动API解析自然语言查询: {query}")
+    api_url, headers, payload = _build_siliconflow_request(query, columns_info_dict, config)
+    try:
+        if settings.LLM_STREAM_RESPONSES:
+            parsed_conditions, content = await _stream_llm_json("siliconflow", api_url, payload, headers, _siliconflow_stream_delta)
+            if parsed_conditions is None:
+                return _conditions_from_siliconflow_response({"choices": [{"message": {"content": content}}]}, columns_info_dict)
+            parsed_conditions = _validate_parsed_conditions(parsed_conditions, columns_info_dict)
+            logger.info(f"硅基流动LLM解析后的筛选条件 (流式提前结束): {json.dumps(parsed_conditions, ensure_ascii=False)}")
+            return parsed_conditions
+        response = await llm_client.post_json("siliconflow", api_url, payload, headers=headers)
+        return _conditions_from_siliconflow_response(response.json(), columns_info_dict)
+    except HTTPException:
+        raise
+    except httpx.HTTPError as e:
         logger.error(f"硅_基流动API请求错误: {str(e)}")
         raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=f"硅基流动API请求错误: {e}")
     except (json.JSONDecodeError, ValueError) as e: # Catch ValueError from validation
         logger.error(f"解析硅基流动LLM返回内容失败或内容无效: {str(e)}")
-        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"解析LLM响应失败或内容无效: {e}")
+        raise LLMReplyError(f"解析LLM响应失败或内容无效: {e}")
     except Exception as e:
         logger.error(f"硅基流动解析查询时发生未知错误: {str(e)}", exc_info=True)
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="LLM解析时发生未知错误")
 
 
-def parse_with_ollama(query: str, columns_info_dict: Dict, config: Dict) -> Dict:
-    logger.info(f"开始使用Ollama API解析自然语言查询: {query}")
+def _build_ollama_request(query: str, columns_info_dict: Dict, config: Dict) -> Tuple[str, Dict]:
+    """Returns (api_url, payload) for an Ollama chat request."""
     api_url = config.get('apiUrl', DEFAULT_LLM_CONFIG['ollama']['apiUrl'])
     model = config.get('model', DEFAULT_LLM_CONFIG['ollama']['model'])
     temperature = float(config.get('temperature', DEFAULT_LLM_CONFIG['ollama']['temperature']))
     top_p = float(config.get('topP', DEFAULT_LLM_CONFIG['ollama']['topP']))
+    schema_text = serialize_schema_for_prompt(columns_info_dict, schema_token_budget("ollama", model, config))
 
     # Use a simplified prompt structure similar to SiliconFlow for consistency
     system_prompt = f"""你是一个专业的数据分析助手。
@@ -340,16 +730,14 @@ def parse_with_ollama(query: str, columns_info_dict: Dict, config: Dict) -> Dict
 这个JSON对象应该包含一个 "filters" 列表和一个可选的 "logical_operator" ("AND" 或 "OR", 默认为 "AND")。
 "filters" 列表中的每个对象代表一个筛选条件，包含: "column", "operator", "value"。
 操作符可以是: "equals", "not_equals", "contains", "not_contains", "greater_than", "less_than", "greater_than_or_equal_to", "less_than_or_equal_to", "between", "not_between", "in", "not_in", "is_null", "is_not_null".
-用户数据表的列信息如下 (列名已规范化为小写和下划线)：
-{json.dumps(columns_info_dict, ensure_ascii=False, indent=2)}
+用户数据表的列信息如下 (列名已规范化为小写和下划线; {SCHEMA_KEY_LEGEND})：
+{schema_text}
 确保 "column" 字段的值严格匹配上述列信息中的列名。
 如果查询涉及到日期，请尝试将日期转换为 "YYYY-MM-DD" 格式。
 如果查询意图不明确或无法转换为筛选条件，请返回一个空的 "filters" 列表。
 只返回JSON对象，不要包含任何其他解释或说明。
 """
-    user_prompt = f"""请将以下自然语言查询转换为结构化的JSON筛选条件对象:
-"{query}"
-返回的JSON对象格式应为：
+    user_prompt = f"""返回的JSON对象格式应为：
 {{
   "filters": [
     {{"column": "column_name_from_schema", "operator": "operator_type", "value": "filter_value"}}
@@ -357,7 +745,7 @@ def parse_with_ollama(query: str, columns_info_dict: Dict, config: Dict) -> Dict
   "logical_operator": "AND"
 }}
 只返回JSON对象。
-"""
+{_query_prompt_section(query, columns_info_dict, schema_text)}"""
     # Ollama settings might come from app.core.settings too
     # system_prompt = settings.SYSTEM_PROMPT
     # user_prompt = settings.USER_PROMPT
@@ -367,207 +755,210 @@ def parse_with_ollama(query: str, columns_info_dict: Dict, config: Dict) -> Dict
         "messages": [{"role": "system", "content": system_prompt}, {"role": "user", "content": user_prompt}],
         "options": {"temperature": temperature, "top_p": top_p},
         "format": "json", # Ollama native JSON mode
-        "stream": False
+        "stream": False,
+        "keep_alive": settings.OLLAMA_KEEP_ALIVE, # Keep the model loaded between queries
     }
-    try:
-        response = requests.post(api_url, json=payload, timeout=60) # Increased timeout for local LLMs
-        response.raise_for_status()
-        result_text = response.text # Get raw text first for debugging
+    return api_url, payload
 
-        try:
-            # Ollama with "format": "json" should return a JSON object where 'message.content' contains the JSON string.
-            # However, sometimes it might directly return the JSON string if the model is fine-tuned for it,
-            # or it might wrap it differently. Let's try to parse the whole response first.
-            full_response_json = json.loads(result_text)
-            assistant_message_content = full_response_json.get('message', {}).get('content', '')
-            if not assistant_message_content: # If message.content is empty, maybe the full response itself is the JSON.
-                 assistant_message_content = result_text # Fallback: try parsing the whole text
-        except json.JSONDecodeError:
-            # If the whole response text isn't JSON, assume it's directly the content string
-            assistant_message_content = result_text
 
-        if not assistant_message_content:
-            logger.warning("Ollama API响应中未找到 'content' 或内容为空。")
-            return {"filters": [], "logical_operator": "AND"}
+def should_preload_ollama() -> bool:
+    """OLLAMA_PRELOAD_ON_STARTUP, where "auto" preloads if queries go to Ollama by default or may fall back to it."""
+    mode = settings.OLLAMA_PRELOAD_ON_STARTUP
+    if mode == "auto":
+        return DEFAULT_LLM_CONFIG["apiType"] == "ollama" or settings.LLM_OLLAMA_FALLBACK_ENABLED
+    return mode in ("1", "true", "yes")
 
-        parsed_conditions: Dict = {}
-        try:
-            # The content itself should be a JSON string
-            parsed_conditions = json.loads(assistant_message_content)
-        except json.JSONDecodeError:
-            # Fallback for content that might be wrapped in ```json ... ```
-            logger.warning(f"Ollama content was not direct JSON: '{assistant_message_content[:200]}...' Trying to extract.")
-            json_match = re.search(r'```json\s*(.*?)\s*```', assistant_message_content, re.DOTALL)
+
+async def preload_ollama_model() -> None:
+    """Loads the default Ollama model at startup (an empty chat loads it) so the first query does not pay for it."""
+    api_url = DEFAULT_LLM_CONFIG['ollama']['apiUrl']
+    model = DEFAULT_LLM_CONFIG['ollama']['model']
+    try:
+        await llm_client.post_json("ollama", api_url, {"model": model, "messages": [], "keep_alive": settings.OLLAMA_KEEP_ALIVE})
+        llm_dispatcher.mark_healthy("ollama") # Answered: usable as a hedge/failover target from now on
+        logger.info(f"Ollama模型已预加载: {model} (keep_alive={settings.OLLAMA_KEEP_ALIVE})")
+    except Exception as e: # Ollama may simply not be running; queries will report it
+        logger.warning(f"Ollama模型预加载失败: {model}: {e}")
+
+
+def _conditions_from_ollama_response_text(result_text: str, columns_info_dict: Dict) -> Dict:
+    try:
+        # Ollama with "format": "json" should return a JSON object where 'message.content' contains the JSON string.
+        # However, sometimes it might directly return the JSON string if the model is fine-tuned for it,
+        # or it might wrap it differently. Let's try to parse the whole response first.
+        full_response_json = json.loads(result_text)
+        assistant_message_content = full_response_json.get('message', {}).get('content', '')
+        if not assistant_message_content: # If message.content is empty, maybe the full response itself is the JSON.
+             assistant_message_content = result_text # Fallback: try parsing the whole text
+    except json.JSONDecodeError:
+        # If the whole response text isn't JSON, assume it's directly the content string
+        assistant_message_content = result_text
+
+    if not assistant_message_content:
+        logger.warning("Ollama API响应中未找到 'content' 或内容为空。")
+        return {"filters": [], "logical_operator": "AND"}
+
+    parsed_conditions: Dict = {}
+    try:
+        # The content itself should be a JSON string
+        parsed_conditions = json.loads(assistant_message_content)
+    except json.JSONDecodeError:
+        # Fallback for content that might be wrapped in ```json ... ```
+        logger.warning(f"Ollama content was not direct JSON: '{assistant_message_content[:200]}...' Trying to extract.")
+        json_match = re.search(r'```json\s*(.*?)\s*```', assistant_message_content, re.DOTALL)
+        if json_match:
+            parsed_conditions = json.loads(json_match.group(1))
+        else:
+            # Last resort: try to find any valid JSON object within the string
+            json_match = re.search(r'\{[\s\S]*\}', assistant_message_content, re.DOTALL)
             if json_match:
-                parsed_conditions = json.loads(json_match.group(1))
-            else:
-                # Last resort: try to find any valid JSON object within the string
-                json_match = re.search(r'\{[\s\S]*\}', assistant_message_content, re.DOTALL)
-                if json_match:
-                    parsed_conditions = json.loads(json_match.group(0))
-                else:
-                    logger.error(f"无法从Ollama API响应中提取有效的JSON: {assistant_message_content}")
-                    raise ValueError("无法从Ollama API响应中提取有效的JSON")
-
-        # Validation
-        if not isinstance(parsed_conditions, dict) or "filters" not in parsed_conditions or not isinstance(parsed_conditions["filters"], list):
-            logger.error(f"LLM返回的JSON结构不符合预期: {parsed_conditions}")
-            raise ValueError("LLM返回的JSON结构不符合预期")
-
-        valid_columns = set(columns_info_dict.keys())
-        validated_filters = []
-        for item in parsed_conditions.get("filters", []):
-            if isinstance(item, dict) and item.get("column") in valid_columns and "operator" in item:
-                if item["operator"] in ["is_null", "is_not_null"] or "value" in item:
-                    validated_filters.append(item)
-                else:
-                    logger.warning(f"Skipping filter due to missing 'value' for operator '{item['operator']}': {item}")
+                parsed_conditions = json.loads(json_match.group(0))
             else:
-                logger.warning(f"Skipping invalid filter item from LLM: {item}")
+                logger.error(f"无法从Ollama API响应中提取有效的JSON: {assistant_message_content}")
+                raise ValueError("无法从Ollama API响应中提取有效的JSON")
 
-        parsed_conditions["filters"] = validated_filters
-        if "logical_operator" not in parsed_conditions or parsed_conditions["logical_operator"] not in ["AND", "OR"]:
-            parsed_conditions["logical_operator"] = "AND"
+    parsed_conditions = _validate_parsed_conditions(parsed_conditions, columns_info_dict)
+    logger.info(f"Ollama LLM解析后的筛选条件: {json.dumps(parsed_conditions, ensure_ascii=False)}")
+    return parsed_conditions
 
-        logger.info(f"Ollama LLM解析后的筛选条件: {json.dumps(parsed_conditions, ensure_ascii=False)}")
-        return parsed_conditions
-    except requests.exceptions.RequestException as e:
+
+async def async_parse_with_ollama(query: str, columns_info_dict: Dict, config: Dict) -> Dict:
+    """
+    Parses the query with Ollama through the shared pooled client, without blocking the event loop.
+    With LLM_STREAM_RESPONSES the reply is streamed and cut off once the JSON object is complete.
+    """
+    logger.info(f"开始使用Ollama API解析自然语言查询: {query}")
+    api_url, payload = _build_ollama_request(query, columns_info_dict, config)
+    try:
+        if settings.LLM_STREAM_RESPONSES:
+            parsed_conditions, content = await _stream_llm_json("ollama", api_url, payload, None, _ollama_stream_delta)
+            if parsed_conditions is None:
+                return _conditions_from_ollama_response_text(content, columns_info_dict)
+            parsed_conditions = _validate_parsed_conditions(parsed_conditions, columns_info_dict)
+            logger.info(f"Ollama LLM解析后的筛选条件 (流式提前结束): {json.dumps(parsed_conditions, ensure_ascii=False)}")
+            return parsed_conditions
+        response = await llm_client.post_json("ollama", api_url, payload)
+        return _conditions_from_ollama_response_text(response.text, columns_info_dict)
+    except HTTPException:
+        raise
+    except httpx.HTTPError as e:
         logger.error(f"Ollama API请求错误: {str(e)}")
         raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=f"Ollama API请求错误: {e}")
     except (json.JSONDecodeError, ValueError) as e:
         logger.error(f"解析Ollama LLM返回内容失败或内容无效: {str(e)}")
-        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"解析LLM响应失败或内容无效: {e}")
+        raise LLMReplyError(f"解析LLM响应失败或内容无效: {e}")
     except Exception as e:
         logger.error(f"Ollama解析查询时发生未知错误: {str(e)}", exc_info=True)
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="LLM解析时发生未知错误")
 
-# --- Pandas Filtering Logic (apply_dynamic_filters) ---
-# This is almost identical to your Flask app's version.
-def apply_dynamic_filters(df: pd.DataFrame, parsed_conditions: Dict) -> pd.DataFrame:
-    if df is None or df.empty: return pd.DataFrame()
-    if not parsed_conditions or not parsed_conditions.get("filters"): return df.copy()
-
-    filters_list = parsed_conditions["filters"]
-    logical_op = parsed_conditions.get("logical_operator", "AND").upper()
 
-    # Initialize total_mask based on logical_op
-    if logical_op == "AND":
-        total_mask = pd.Series([True] * len(df), index=df.index)
-    elif logical_op == "OR":
-        total_mask = pd.Series([False] * len(df), index=df.index)
-    else: # Default to AND if unknown operator
-        total_mask = pd.Series([True] * len(df), index=df.index)
-        logger.warning(f"Unknown logical operator '{logical_op}', defaulting to AND.")
+def build_effective_llm_config(llm_req_config: Optional[Any]) -> Dict:
+    """Merges the request's LLM config (an excel models LLMConfig) over DEFAULT_LLM_CONFIG."""
+    effective_llm_config = json.loads(json.dumps(DEFAULT_LLM_CONFIG))
 
+    if llm_req_config:
+        if llm_req_config.apiType:
+            effective_llm_config["apiType"] = llm_req_config.apiType
+        if llm_req_config.siliconflow:
+            sf_conf_dict = llm_req_config.siliconflow.model_dump(exclude_none=True)
+            effective_llm_config["siliconflow"].update(sf_conf_dict)
+        if llm_req_config.ollama:
+            ol_conf_dict = llm_req_config.ollama.model_dump(exclude_none=True)
+            effective_llm_config["ollama"].update(ol_conf_dict)
+    return effective_llm_config
 
-    for condition_idx, condition in enumerate(filters_list):
-        col, op, val = condition.get("column"), condition.get("operator"), condition.get("value") # val can be None
-
-        if not col or not op or col not in df.columns:
-            logger.warning(f"跳过无效或不完整的筛选条件 (索引 {condition_idx}): {condition}")
-            continue
-
-        # For "is_null" and "is_not_null", value is not needed.
-        if op not in ["is_null", "is_not_null"] and val is None and op not in ["is_null", "is_not_null"]:
-            # If value is required but missing, skip this condition.
-            # Example: "equals" with no value is meaningless.
-            logger.warning(f"Skipping filter condition (索引 {condition_idx}) due to missing 'value' for operator '{op}': {condition}")
-            continue
-
-        current_mask = pd.Series([False] * len(df), index=df.index) # Initialize to False, only True rows pass
-        series_to_filter = df[col]
-
-        try:
-            # Type casting for value based on series dtype and operator
-            # This is complex and needs to be robust
-            original_series_dtype = series_to_filter.dtype
-
-            # String operations: ensure series is string type for contains/equals on strings
-            if op in ["contains", "not_contains"] or \
-               (op in ["equals", "not_equals"] and isinstance(val, str)):
-                series_to_filter = series_to_filter.astype(str)
-                if val is not None: val = str(val)
 
+def _provider_usable(provider: str, effective_llm_config: Dict) -> bool:
+    """
+    Whether a provider can serve as a fallback. SiliconFlow needs an API key; Ollama (a local server
+    that may not be deployed) must be enabled with LLM_OLLAMA_FALLBACK_ENABLED or have answered before.
+    """
+    if provider == "siliconflow":
+        api_key = effective_llm_config.get("siliconflow", {}).get("apiKey")
+        return bool(api_key) and api_key != "YOUR_SILICONFLOW_KEY"
+    if provider == "ollama":
+        return settings.LLM_OLLAMA_FALLBACK_ENABLED or llm_dispatcher.is_healthy("ollama")
+    return False
 
-            is_datetime_col = pd.api.types.is_datetime64_any_dtype(original_series_dtype)
-            is_numeric_col_original = pd.api.types.is_numeric_dtype(original_series_dtype) and not is_datetime_col
 
+async def parse_query_with_llm(query: str, columns_info: Dict, llm_req_config: Optional[Any]) -> Tuple[Dict, Dict[str, Any]]:
+    """
+    Parses a natural-language query into filter conditions with the configured provider, without
+    blocking the event loop. Results are cached by query, schema, provider, model and temperature,
+    and also per query template (literals replaced by slots), so queries that differ only in numbers,
+    dates or quoted values reuse one LLM parse. Simple structured queries ("amount > 1000") are
+    handled by the local rule-based parser and never reach the LLM.
+    LLM calls go through the dispatcher, which hedges, fails over and circuit-breaks across providers.
+    Returns (parsed_conditions, parse_info); parse_info["source"] is "fast_path", "cache", "template" or "llm",
+    and for "llm" parse_info also has the answering "provider" and its "latency_ms".
+    """
+    effective_llm_config = build_effective_llm_config(llm_req_config)
+    api_type_to_use = effective_llm_config["apiType"]
+    provider_specific_config = effective_llm_config.get(api_type_to_use, {})
+    if not provider_specific_config and api_type_to_use in ["siliconflow", "ollama"]:
+        provider_specific_config = effective_llm_config.get(api_type_to_use.lower(), {})
+    if api_type_to_use not in ["siliconflow", "ollama"]:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Unsupported API type: {api_type_to_use}")
+
+    if settings.FAST_PARSER_ENABLED:
+        local_conditions, confidence = parse_query_locally(query, columns_info)
+        if local_conditions is not None and confidence >= settings.FAST_PARSER_MIN_CONFIDENCE:
+            local_conditions = _validate_parsed_conditions(local_conditions, columns_info)
+            logger.info(f"本地规则解析命中 (置信度 {confidence:.2f}): {json.dumps(local_conditions, ensure_ascii=False)}")
+            return local_conditions, {"cache_hit": False, "source": "fast_path"}
+
+    model = str(provider_specific_config.get('model', DEFAULT_LLM_CONFIG[api_type_to_use]['model']))
+    temperature = float(provider_specific_config.get('temperature', DEFAULT_LLM_CONFIG[api_type_to_use]['temperature']))
+    cache_key = make_parse_cache_key(query, columns_info, api_type_to_use, model, temperature)
+    cached_conditions = parsed_conditions_cache.get(cache_key)
+    if cached_conditions is not None:
+        logger.info(f"LLM解析缓存命中: {query}")
+        return cached_conditions, {"cache_hit": True, "source": "cache"}
+
+    template, literals = query_template.extract_query_template(query)
+    template_key = make_parse_cache_key(f"template:{template}", columns_info, api_type_to_use, model, temperature) if literals else None
+    if template_key:
+        template_conditions = parsed_conditions_cache.get(template_key)
+        filled_conditions = query_template.fill_template_conditions(template_conditions, literals) if template_conditions else None
+        if filled_conditions is not None:
+            filled_conditions = _validate_parsed_conditions(filled_conditions, columns_info)
+            logger.info(f"LLM解析模板命中: {template} -> {json.dumps(filled_conditions, ensure_ascii=False)}")
+            parsed_conditions_cache.put(cache_key, filled_conditions)
+            return filled_conditions, {"cache_hit": True, "source": "template"}
+
+    # The configured provider first; the other one is a hedge/failover target if it is usable
+    provider_calls = {
+        "siliconflow": lambda: async_parse_with_siliconflow(query, columns_info, effective_llm_config["siliconflow"]),
+        "ollama": lambda: async_parse_with_ollama(query, columns_info, effective_llm_config["ollama"]),
+    }
+    provider_order = [api_type_to_use] + [p for p in provider_calls if p != api_type_to_use and _provider_usable(p, effective_llm_config)]
+    parsed_conditions, provider, latency_ms = await llm_dispatcher.dispatch(provider_calls, provider_order)
+    if provider != api_type_to_use:
+        logger.info(f"LLM解析由备用提供方 {provider} 完成 ({latency_ms} ms)")
+    parsed_conditions_cache.put(cache_key, parsed_conditions)
+    if template_key:
+        template_conditions = query_template.build_template_conditions(parsed_conditions, literals)
+        if template_conditions is not None:
+            parsed_conditions_cache.put(template_key, template_conditions)
+    return parsed_conditions, {"cache_hit": False, "source": "llm", "provider": provider, "latency_ms": latency_ms}
 
-            # Handle type conversion for 'val' for comparison operators
-            if op in ["greater_than", "less_than", "greater_than_or_equal_to", "less_than_or_equal_to", "between", "not_between"]:
-                temp_series_for_conversion = series_to_filter.dropna() # Use non-null values for type check
+# --- Pandas Filtering Logic (apply_dynamic_filters) ---
+# Conditions are compiled once against the frame's cached typed columns (app/excel/filter_plan.py)
+# and then run as NumPy kernels, so repeated queries on a cached frame do not re-cast columns.
+def apply_dynamic_filters_with_plan(df: pd.DataFrame, parsed_conditions: Dict, columns_info: Optional[Dict] = None) -> Tuple[pd.DataFrame, Optional[Dict[str, Any]]]:
+    """
+    Filters df and also returns the executed plan (evaluation order, selectivity estimates, rows
+    each condition looked at), or None if there was nothing to evaluate. columns_info, the stored
+    column profile, refines the selectivity estimates for columns without an index.
+    """
+    if df is None or df.empty: return pd.DataFrame(), None
+    if not parsed_conditions or not parsed_conditions.get("filters"): return df.copy(), None
 
-                # Try to convert 'val' to the most appropriate type
-                if is_datetime_col or (temp_series_for_conversion.astype(str).str.match(r'^\d{4}-\d{2}-\d{2}').any() and isinstance(val, str)):
-                     # If original column is datetime, or if value looks like a date string
-                    try:
-                        if op in ["between", "not_between"]:
-                            if not (isinstance(val, list) and len(val) == 2): raise ValueError("日期 'between' 值应为列表[min, max]")
-                            val = [pd.to_datetime(v, errors='coerce') for v in val]
-                            if any(pd.isna(v) for v in val): raise ValueError(f"日期 'between' 值解析失败: {condition.get('value')}")
-                        else:
-                            val = pd.to_datetime(val, errors='coerce')
-                            if pd.isna(val): raise ValueError(f"日期值解析失败: {condition.get('value')}")
-                        series_to_filter = pd.to_datetime(series_to_filter, errors='coerce') # Coerce series also
-                    except Exception as date_err:
-                        logger.warning(f"Could not convert value/series to datetime for col '{col}', op '{op}': {date_err}. Skipping filter.")
-                        continue
-                elif is_numeric_col_original or (isinstance(val, (int, float, str)) and str(val).replace('.', '', 1).isdigit()):
-                    # If original column is numeric, or value looks numeric
-                    try:
-                        if op in ["between", "not_between"]:
-                            if not (isinstance(val, list) and len(val) == 2): raise ValueError("数字 'between' 值应为列表[min, max]")
-                            val = [pd.to_numeric(v, errors='coerce') for v in val]
-                            if any(np.isnan(v) for v in val): raise ValueError(f"数字 'between' 值解析失败: {condition.get('value')}")
-                        else:
-                            val = pd.to_numeric(val, errors='coerce')
-                            if np.isnan(val): raise ValueError(f"数字值解析失败: {condition.get('value')}")
-                        series_to_filter = pd.to_numeric(series_to_filter, errors='coerce') # Coerce series also
-                    except Exception as num_err:
-                        logger.warning(f"Could not convert value/series to numeric for col '{col}', op '{op}': {num_err}. Skipping filter.")
-                        continue
-                # else: val remains as is, direct comparison will be attempted.
-
-            # Apply filter logic
-            if op == "equals": current_mask = (series_to_filter == val)
-            elif op == "not_equals": current_mask = (series_to_filter != val)
-            elif op == "contains": current_mask = series_to_filter.str.contains(val, case=False, na=False)
-            elif op == "not_contains": current_mask = ~series_to_filter.str.contains(val, case=False, na=False)
-            elif op == "greater_than": current_mask = (series_to_filter > val)
-            elif op == "less_than": current_mask = (series_to_filter < val)
-            elif op == "greater_than_or_equal_to": current_mask = (series_to_filter >= val)
-            elif op == "less_than_or_equal_to": current_mask = (series_to_filter <= val)
-            elif op == "between": current_mask = series_to_filter.between(val[0], val[1], inclusive="both")
-            elif op == "not_between": current_mask = ~series_to_filter.between(val[0], val[1], inclusive="both")
-            elif op == "in":
-                if not isinstance(val, list): val = [val]
-                # Ensure values in `val` are of compatible type with the series
-                # This can be tricky if `val` contains mixed types or needs conversion.
-                # For simplicity, we assume `val` items are already appropriate or `isin` handles it.
-                current_mask = series_to_filter.isin(val)
-            elif op == "not_in":
-                if not isinstance(val, list): val = [val]
-                current_mask = ~series_to_filter.isin(val)
-            elif op == "is_null": current_mask = series_to_filter.isnull()
-            elif op == "is_not_null": current_mask = series_to_filter.notnull()
-            else:
-                logger.warning(f"未知操作符 (索引 {condition_idx}) '{op}'，跳过条件。")
-                continue
+    artifacts = filter_plan.get_dataset_artifacts(df)
+    plan = filter_plan.compile_filter_plan(parsed_conditions, artifacts, columns_info)
+    total_mask = filter_plan.execute_filter_plan(plan, artifacts)
+    return df[total_mask], plan.describe() # Boolean indexing already builds new arrays; no extra copy needed
 
-            # Combine mask
-            if logical_op == "AND":
-                total_mask &= current_mask
-            elif logical_op == "OR":
-                total_mask |= current_mask
-
-        except ValueError as ve: # Catch type conversion errors from above
-            logger.warning(f"筛选值或列类型不匹配 (索引 {condition_idx}, 列 '{col}', 操作 '{op}', 值 '{condition.get('value')}'): {str(ve)}. Skipping this filter condition.")
-            # If AND, this condition effectively fails. If OR, it doesn't contribute.
-            if logical_op == "AND": total_mask &= pd.Series([False] * len(df), index=df.index) # Make it fail safely for AND
-            # For OR, it's already initialized to False or previous states.
-        except Exception as e:
-            logger.error(f"处理筛选条件时发生意外错误 (索引 {condition_idx}, 列 '{col}', 操作 '{op}'): {str(e)}", exc_info=True)
-            # Decide how to handle: skip condition or error out? For now, skip.
-            if logical_op == "AND": total_mask &= pd.Series([False] * len(df), index=df.index)
 
-    return df[total_mask].copy()
\ No newline at end of file
+def apply_dynamic_filters(df: pd.DataFrame, parsed_conditions: Dict, columns_info: Optional[Dict] = None) -> pd.DataFrame:
+    return apply_dynamic_filters_with_plan(df, parsed_conditions, columns_info)[0]
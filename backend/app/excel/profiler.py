@@ -0,0 +1,285 @@
+# app/excel/profiler.py
+import logging
+import math
+from pathlib import Path
+from typing import Dict, List, Any, Optional, Iterator
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.ipc
+import pyarrow.parquet as pq
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+PROFILE_CHUNK_ROWS = settings.COLUMN_PROFILER_CHUNK_ROWS
+SAMPLE_SIZE = 5 # Same number of sample values as generate_columns_info
+TOP_K = settings.COLUMN_PROFILER_TOP_K
+HLL_PRECISION = 14 # 2**14 registers, ~0.8% standard error
+
+
+class HyperLogLog:
+    """HyperLogLog distinct-count sketch over 64-bit hashes."""
+
+    def __init__(self, precision: int = HLL_PRECISION):
+        self.precision = precision
+        self.num_registers = 1 << precision
+        self.registers = np.zeros(self.num_registers, dtype=np.uint8)
+
+    def add_hashes(self, hashes: np.ndarray) -> None:
+        if hashes.size == 0:
+            return
+        hashes = hashes.astype(np.uint64, copy=False)
+        value_bits = 64 - self.precision
+        register_idx = (hashes >> np.uint64(value_bits)).astype(np.int64)
+        remainder = hashes & np.uint64((1 << value_bits) - 1)
+        # remainder < 2**50 is exact in float64, so frexp's exponent is its bit length
+        bit_length = np.frexp(remainder.astype(np.float64))[1]
+        rank = (value_bits - bit_length + 1).astype(np.uint8)
+        np.maximum.at(self.registers, register_idx, rank)
+
+    def estimate(self) -> int:
+        m = self.num_registers
+        alpha = 0.7213 / (1 + 1.079 / m)
+        raw_estimate = alpha * m * m / np.sum(np.ldexp(1.0, -self.registers.astype(np.int64)))
+        zero_registers = int(np.count_nonzero(self.registers == 0))
+        if raw_estimate <= 2.5 * m and zero_registers:
+            return int(round(m * math.log(m / zero_registers))) # Linear counting for small cardinalities
+        return int(round(raw_estimate))
+
+
+class FrequentItems:
+    """Misra-Gries heavy hitters, updated a chunk at a time. Counts are lower bounds."""
+
+    def __init__(self, k: int = TOP_K):
+        self.k = k
+        self.capacity = 4 * k
+        self.counts: Dict[Any, int] = {}
+
+    def add_value_counts(self, value_counts: pd.Series) -> None:
+        # Reduce the chunk's exact counts to a summary of the same capacity first (vectorized),
+        # then merge; Misra-Gries summaries stay valid under merging.
+        if len(value_counts) > self.capacity:
+            largest = value_counts.nlargest(self.capacity + 1)
+            threshold = int(largest.iloc[-1])
+            largest = largest.iloc[:-1] - threshold
+            value_counts = largest[largest > 0]
+        for value, count in value_counts.items():
+            self.counts[value] = self.counts.get(value, 0) + int(count)
+        if len(self.counts) > self.capacity:
+            # Subtract the (capacity+1)-th largest count from everything and drop what falls to zero
+            threshold = sorted(self.counts.values(), reverse=True)[self.capacity]
+            self.counts = {v: c - threshold for v, c in self.counts.items() if c > threshold}
+
+    def top(self) -> List[Dict[str, Any]]:
+        items = sorted(self.counts.items(), key=lambda item: item[1], reverse=True)[:self.k]
+        return [{"value": str(value), "count": count} for value, count in items]
+
+
+class ColumnSketch:
+    """Single-pass, bounded-memory statistics for one column."""
+
+    def __init__(self, name: str, rng: np.random.Generator):
+        self.name = name
+        self.rng = rng
+        self.dtypes: List[str] = []
+        self.kinds: set = set()
+        self.row_count = 0
+        self.null_count = 0
+        self.hll = HyperLogLog()
+        self.frequent = FrequentItems()
+        self.reservoir: List[Any] = []
+        self.seen_non_null = 0
+        self.min_value: Any = None
+        self.max_value: Any = None
+
+    def update(self, series: pd.Series) -> None:
+        self.row_count += len(series)
+        non_null = series.dropna()
+        self.null_count += len(series) - len(non_null)
+        if non_null.empty:
+            return # An all-null chunk says nothing about the column type (CSV reads it as float64)
+        dtype = str(series.dtype)
+        if dtype not in self.dtypes:
+            self.dtypes.append(dtype)
+
+        is_datetime = pd.api.types.is_datetime64_any_dtype(non_null.dtype)
+        is_numeric = pd.api.types.is_numeric_dtype(non_null.dtype) and not pd.api.types.is_bool_dtype(non_null.dtype)
+        self.kinds.add("numeric" if is_numeric else "datetime" if is_datetime else "other")
+        # Hash numbers as float64 so 1 in one chunk and 1.0 in another count once
+        hash_input = non_null.astype(np.float64) if is_numeric else non_null
+        self.hll.add_hashes(pd.util.hash_pandas_object(hash_input, index=False).to_numpy())
+        self.frequent.add_value_counts(non_null.value_counts(sort=False))
+        if is_numeric or is_datetime:
+            chunk_min, chunk_max = non_null.min(), non_null.max()
+            self.min_value = chunk_min if self.min_value is None else min(self.min_value, chunk_min)
+            self.max_value = chunk_max if self.max_value is None else max(self.max_value, chunk_max)
+        self._update_reservoir(non_null)
+
+    def _update_reservoir(self, non_null: pd.Series) -> None:
+        # Algorithm R: item number t (0-based) replaces a random slot with probability k/(t+1)
+        values = non_null.to_numpy()
+        start = 0
+        if len(self.reservoir) < SAMPLE_SIZE:
+            start = min(SAMPLE_SIZE - len(self.reservoir), len(values))
+            self.reservoir.extend(values[:start])
+        positions = np.arange(self.seen_non_null + start, self.seen_non_null + len(values))
+        if positions.size:
+            slots = (self.rng.random(positions.size) * (positions + 1)).astype(np.int64)
+            for offset in np.flatnonzero(slots < SAMPLE_SIZE):
+                self.reservoir[slots[offset]] = values[start + offset]
+        self.seen_non_null += len(values)
+
+    def merged_dtype(self) -> str:
+        if not self.dtypes:
+            return "float64" # All null: what pandas infers for an empty column
+        if len(self.dtypes) == 1:
+            return self.dtypes[0]
+        if self.kinds == {"numeric"}:
+            return "float64" # e.g. int64 chunks plus chunks where NaNs forced float64
+        return "object"
+
+    def to_column_info(self) -> Dict[str, Any]:
+        unique_count = min(self.hll.estimate(), self.row_count - self.null_count)
+        info = {
+            'dtype': self.merged_dtype(),
+            'unique_count': int(unique_count),
+            'sample_values': [str(v) for v in self.reservoir],
+            # Extra statistics, beyond what generate_columns_info returns
+            'null_count': int(self.null_count),
+            'row_count': int(self.row_count),
+            'top_values': self.frequent.top(),
+            'approximate': True,
+        }
+        if self.min_value is not None:
+            info['min'] = str(self.min_value)
+            info['max'] = str(self.max_value)
+        return info
+
+
+def profile_dataframe_chunks(chunks: Iterator[pd.DataFrame], seed: int = 0) -> Dict:
+    """
+    Builds columns_info from an iterator of DataFrame chunks in one pass, keeping only the
+    per-column sketches in memory. Columns keep the order in which they first appear.
+    """
+    rng = np.random.default_rng(seed)
+    sketches: Dict[str, ColumnSketch] = {}
+    for chunk in chunks:
+        for col in chunk.columns:
+            if col not in sketches:
+                sketches[col] = ColumnSketch(col, rng)
+            sketches[col].update(chunk[col])
+    return {col: sketch.to_column_info() for col, sketch in sketches.items()}
+
+
+def _normalized_chunk(chunk: pd.DataFrame) -> pd.DataFrame:
+    from app.excel.processing import normalize_column_names # processing imports this module
+    chunk.columns = normalize_column_names(chunk.columns)
+    return chunk
+
+
+def _typed_records_chunk(records: List[tuple], header: List[Any], dtypes: Optional[Dict[str, Any]]) -> pd.DataFrame:
+    if not dtypes:
+        return _normalized_chunk(pd.DataFrame.from_records(records, columns=header))
+    # Start from the cell values as they are, so a chunk cannot infer a type of its own
+    chunk = _normalized_chunk(pd.DataFrame(records, columns=header, dtype=object))
+    for col in chunk.columns:
+        if col not in dtypes:
+            chunk[col] = chunk[col].infer_objects()
+        elif str(dtypes[col]) != "object":
+            try:
+                chunk[col] = chunk[col].astype(dtypes[col])
+            except (ValueError, TypeError) as e:
+                logger.warning(f"Chunk column '{col}' does not fit its profiled type {dtypes[col]}, keeping the cell values: {e}")
+    return chunk
+
+
+def _mangled_header(header: List[Any]) -> List[Any]:
+    # Repeated headers become "name.1", "name.2", ... as pd.read_excel names them, so chunks get the same columns
+    seen: Dict[Any, int] = {}
+    mangled = []
+    for name in header:
+        count = seen.get(name, 0)
+        seen[name] = count + 1
+        if count:
+            while f"{name}.{count}" in seen:
+                count += 1
+            name = f"{name}.{count}"
+            seen[name] = 1
+        mangled.append(name)
+    return mangled
+
+
+def _iter_xlsx_chunks(file_path: Path, chunk_rows: int, dtypes: Optional[Dict[str, Any]] = None) -> Iterator[pd.DataFrame]:
+    import openpyxl
+    workbook = openpyxl.load_workbook(file_path, read_only=True, data_only=True)
+    try:
+        rows = workbook.worksheets[0].iter_rows(values_only=True) # First sheet, like pd.read_excel
+        header = next(rows, None)
+        if header is None:
+            return
+        header = _mangled_header([f"Unnamed: {i}" if h is None else h for i, h in enumerate(header)])
+        buffer: List[tuple] = []
+        for row in rows:
+            buffer.append(row)
+            if len(buffer) >= chunk_rows:
+                yield _typed_records_chunk(buffer, header, dtypes)
+                buffer = []
+        if buffer:
+            yield _typed_records_chunk(buffer, header, dtypes)
+    finally:
+        workbook.close()
+
+
+def iter_file_chunks(file_path_str: str, chunk_rows: int = PROFILE_CHUNK_ROWS, dtypes: Optional[Dict[str, Any]] = None) -> Iterator[pd.DataFrame]:
+    """
+    Yields a data file as DataFrame chunks with normalized column names. dtypes (normalized name ->
+    dtype, "object" for text) pins the column types of CSV and Excel chunks, which pandas otherwise
+    infers per chunk; columnar copies are typed by their schema already.
+    """
+    file_path = Path(file_path_str)
+    suffix = file_path.suffix.lower()
+    if suffix == ".csv":
+        read_dtypes = None
+        if dtypes:
+            from app.excel.processing import normalize_column_names # processing imports this module
+            header = pd.read_csv(file_path, nrows=0).columns
+            # read_csv cannot parse into datetime dtypes; CSV profiles never have them anyway
+            read_dtypes = {raw: dtypes[name] for raw, name in zip(header, normalize_column_names(header))
+                           if name in dtypes and not str(dtypes[name]).startswith("datetime")}
+        for chunk in pd.read_csv(file_path, chunksize=chunk_rows, dtype=read_dtypes):
+            yield _normalized_chunk(chunk)
+    elif suffix == ".arrow":
+        # Columnar copy: names are normalized already, and batches come straight off the memory map
+        reader = pa.ipc.open_file(pa.memory_map(str(file_path), "r"))
+        for i in range(reader.num_record_batches):
+            batch = reader.get_batch(i)
+            for offset in range(0, batch.num_rows, chunk_rows):
+                yield batch.slice(offset, chunk_rows).to_pandas()
+    elif suffix == ".parquet":
+        for batch in pq.ParquetFile(file_path).iter_batches(batch_size=chunk_rows):
+            yield batch.to_pandas()
+    elif suffix == ".xlsx":
+        yield from _iter_xlsx_chunks(file_path, chunk_rows, dtypes)
+    elif suffix == ".xls":
+        # xlrd cannot stream; .xls sheets are capped at 65,536 rows anyway
+        yield _normalized_chunk(pd.read_excel(file_path))
+    else:
+        raise ValueError(f"Unsupported file type for profiling: {file_path.suffix}")
+
+
+def profile_file_streaming(file_path_str: str, chunk_rows: int = PROFILE_CHUNK_ROWS) -> Dict:
+    """Streaming column profile of a data file, in the columns_info shape plus extra statistics."""
+    columns_info = profile_dataframe_chunks(iter_file_chunks(file_path_str, chunk_rows))
+    logger.info(f"Streaming profile of {file_path_str}: {len(columns_info)} columns")
+    return columns_info
+
+
+def use_streaming_profiler(file_size_bytes: Optional[int]) -> bool:
+    mode = settings.COLUMN_PROFILER_MODE.lower()
+    if mode == "streaming":
+        return True
+    if mode == "auto":
+        return (file_size_bytes or 0) >= settings.COLUMN_PROFILER_STREAMING_MIN_BYTES
+    return False
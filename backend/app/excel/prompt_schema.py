@@ -0,0 +1,145 @@
+# app/excel/prompt_schema.py
+import json
+import logging
+import re
+import unicodedata
+from typing import Dict, List, Any, Optional, Set
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+SAMPLE_MAX_CHARS = settings.LLM_SCHEMA_SAMPLE_MAX_CHARS
+MAX_SAMPLES_PER_COLUMN = 3
+SUPPLEMENT_MAX_COLUMNS = 5 # Columns whose trimmed samples are restored in the user message
+# Legend for the short keys, for the system prompt
+SCHEMA_KEY_LEGEND = "t=数据类型, u=不同值数量, s=示例值"
+
+_CJK_RE = re.compile(r'[぀-ヿ㐀-䶿一-鿿가-힯]')
+_WORD_RE = re.compile(r'[a-z0-9]+')
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count without a tokenizer: one per CJK character, one per ~4 other characters."""
+    cjk_count = len(_CJK_RE.findall(text))
+    return cjk_count + (len(text) - cjk_count + 3) // 4
+
+
+def _lexical_terms(text: str) -> Set[str]:
+    """ASCII words plus CJK characters and bigrams (Chinese has no spaces to split on)."""
+    text = unicodedata.normalize("NFKC", str(text)).casefold()
+    terms = {word for word in _WORD_RE.findall(text) if len(word) > 1}
+    for run in re.findall(r'[㐀-䶿一-鿿]+', text):
+        terms.update(run)
+        terms.update(run[i:i + 2] for i in range(len(run) - 1))
+    return terms
+
+
+def _relevance(col: str, info: Dict, query_terms: Set[str]) -> float:
+    if not query_terms:
+        return 0.0
+    name_terms = _lexical_terms(col.replace('_', ' '))
+    value_terms: Set[str] = set()
+    for value in info.get('sample_values') or []:
+        value_terms |= _lexical_terms(value)
+    # A query naming the column counts more than one quoting a sample value
+    return 2.0 * len(query_terms & name_terms) + len(query_terms & value_terms)
+
+
+def _truncate(value: Any) -> str:
+    value = str(value)
+    return value if len(value) <= SAMPLE_MAX_CHARS else value[:SAMPLE_MAX_CHARS] + "…"
+
+
+def _dumps(schema: Dict) -> str:
+    return json.dumps(schema, ensure_ascii=False, separators=(',', ':'))
+
+
+def _compact_schema(columns_info: Dict) -> Dict[str, Dict[str, Any]]:
+    schema: Dict[str, Dict[str, Any]] = {}
+    for col, info in columns_info.items():
+        entry: Dict[str, Any] = {'t': str(info.get('dtype', ''))}
+        if info.get('unique_count') is not None:
+            entry['u'] = info['unique_count']
+        samples = [_truncate(v) for v in (info.get('sample_values') or [])[:MAX_SAMPLES_PER_COLUMN]]
+        if samples:
+            entry['s'] = samples
+        schema[col] = entry
+    return schema
+
+
+def serialize_schema_for_prompt(columns_info: Dict, token_budget: Optional[int] = None) -> str:
+    """
+    Compact JSON of columns_info for an LLM system prompt: no indentation, short keys (t/u/s) and
+    truncated sample values. If it does not fit the token budget, sample values are dropped first
+    from the highest-cardinality columns (IDs, free text), then unique counts; every column name and
+    dtype is always kept (the LLM may only use those) and columns stay in file order.
+    Independent of the query, so the system prompt is a stable prefix for a given file version.
+    """
+    schema = _compact_schema(columns_info)
+    text = _dumps(schema)
+    if token_budget is None or estimate_tokens(text) <= token_budget:
+        return text
+
+    positions = {col: i for i, col in enumerate(columns_info)}
+    drop_order: List[str] = sorted(columns_info, key=lambda c: (-int(columns_info[c].get('unique_count') or 0), -positions[c]))
+    tokens = estimate_tokens(text)
+    for key in ('s', 'u'):
+        for col in drop_order:
+            if key not in schema[col]:
+                continue
+            # Track the total per removed fragment and re-measure only once it looks small enough
+            fragment = f',"{key}":' + _dumps(schema[col][key])
+            del schema[col][key]
+            tokens -= estimate_tokens(fragment)
+            if tokens <= token_budget:
+                text = _dumps(schema)
+                tokens = estimate_tokens(text)
+                if tokens <= token_budget:
+                    logger.info(f"Schema for prompt trimmed to ~{tokens} tokens (budget {token_budget}).")
+                    return text
+    text = _dumps(schema)
+    logger.warning(f"Schema for prompt needs ~{estimate_tokens(text)} tokens with names and dtypes only (budget {token_budget}).")
+    return text
+
+
+def schema_supplement_for_query(columns_info: Dict, schema_text: str, query: str, max_columns: int = SUPPLEMENT_MAX_COLUMNS) -> Optional[str]:
+    """
+    Sample values the budget removed from the system prompt schema, for the columns most lexically
+    relevant to the query, as compact JSON ({column: [samples]}) for the user message. None if
+    nothing relevant was trimmed.
+    """
+    query_terms = _lexical_terms(query or "")
+    if not query_terms:
+        return None
+    try:
+        kept = json.loads(schema_text)
+    except json.JSONDecodeError:
+        return None
+    scored = [(score, col) for col, info in columns_info.items()
+              if info.get('sample_values') and 's' not in kept.get(col, {})
+              and (score := _relevance(col, info, query_terms)) > 0]
+    if not scored:
+        return None
+    chosen = {col for _, col in sorted(scored, key=lambda item: -item[0])[:max_columns]}
+    supplement = {col: [_truncate(v) for v in columns_info[col]['sample_values'][:MAX_SAMPLES_PER_COLUMN]]
+                  for col in columns_info if col in chosen}
+    return _dumps(supplement)
+
+
+def schema_token_budget(provider: str, model: Optional[str], config: Optional[Dict] = None) -> Optional[int]:
+    """
+    Token budget for the schema part of the prompt: the request's schemaTokenBudget, else the
+    LLM_SCHEMA_TOKEN_BUDGETS entry for "provider:model" or "provider", else LLM_SCHEMA_TOKEN_BUDGET.
+    0 or less means unlimited.
+    """
+    budget = (config or {}).get('schemaTokenBudget')
+    if budget is None:
+        try:
+            overrides = json.loads(settings.LLM_SCHEMA_TOKEN_BUDGETS or "{}")
+        except json.JSONDecodeError:
+            logger.error("LLM_SCHEMA_TOKEN_BUDGETS is not valid JSON, ignoring it.")
+            overrides = {}
+        budget = overrides.get(f"{provider}:{model}", overrides.get(provider, settings.LLM_SCHEMA_TOKEN_BUDGET))
+    budget = int(budget)
+    return budget if budget > 0 else None
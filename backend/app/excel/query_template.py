@@ -0,0 +1,144 @@
+# app/excel/query_template.py
+import copy
+import logging
+import re
+from datetime import date
+from typing import Dict, List, Any, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Literals are pulled out in this order; earlier kinds win where they overlap.
+_QUOTED_RE = re.compile(r'"([^"]+)"|\'([^\']+)\'|“([^”]+)”|‘([^’]+)’|「([^」]+)」|《([^》]+)》')
+_DATE_RE = re.compile(r'(?<!\d)(\d{4})\s*(?:[-/.]|年)\s*(\d{1,2})\s*(?:[-/.]|月)\s*(\d{1,2})\s*日?(?!\d)')
+# Digits glued to ASCII letters ("q1", "top10") are part of a name, not a literal.
+_NUMBER_RE = re.compile(r'(?<![A-Za-z_\d.])-?\d+(?:\.\d+)?(?![A-Za-z_\d])')
+
+_SLOT_KEY = "$slot"
+
+
+def _normalize_date(year: str, month: str, day: str) -> Optional[str]:
+    try:
+        return date(int(year), int(month), int(day)).isoformat()
+    except ValueError:
+        return None
+
+
+def extract_query_template(query: str) -> Tuple[str, List[Dict[str, Any]]]:
+    """
+    Replaces quoted strings, dates and numbers in a query with numbered placeholders.
+    Returns (template, literals); each literal has "kind" ("quoted", "date" or "number"),
+    the raw "text" and the typed "value" (str, "YYYY-MM-DD" str, or int/float).
+    """
+    literals: List[Dict[str, Any]] = []
+
+    def replace_quoted(match: re.Match) -> str:
+        text = next(group for group in match.groups() if group is not None)
+        literals.append({"kind": "quoted", "text": text, "value": text})
+        return f"<S{len(literals) - 1}>"
+
+    def replace_date(match: re.Match) -> str:
+        normalized = _normalize_date(*match.groups())
+        if normalized is None:
+            return match.group(0)
+        literals.append({"kind": "date", "text": match.group(0), "value": normalized})
+        return f"<D{len(literals) - 1}>"
+
+    def replace_number(match: re.Match) -> str:
+        text = match.group(0)
+        value = float(text) if '.' in text else int(text)
+        literals.append({"kind": "number", "text": text, "value": value})
+        return f"<N{len(literals) - 1}>"
+
+    template = _QUOTED_RE.sub(replace_quoted, query)
+    template = _DATE_RE.sub(replace_date, template)
+    # Placeholders contain digits too, so shield them from the number pass
+    parts = re.split(r'(<[SDN]\d+>)', template)
+    template = "".join(part if re.fullmatch(r'<[SDN]\d+>', part) else _NUMBER_RE.sub(replace_number, part) for part in parts)
+    return template, literals
+
+
+def _literal_matches(literal: Dict[str, Any], value: Any) -> Optional[str]:
+    """How value encodes literal ("number", "string_number", "date", "string"), or None if it does not."""
+    if literal["kind"] == "number":
+        if isinstance(value, bool):
+            return None
+        if isinstance(value, (int, float)) and float(value) == float(literal["value"]):
+            return "number"
+        if isinstance(value, str) and value.strip() == literal["text"]:
+            return "string_number"
+        return None
+    if literal["kind"] == "date":
+        if isinstance(value, str) and value.strip()[:10] == literal["value"]:
+            return "date"
+        return None
+    if isinstance(value, str) and value == literal["value"]:
+        return "string"
+    return None
+
+
+def _value_positions(parsed_conditions: Dict) -> List[Tuple[int, Optional[int], Any]]:
+    """(filter index, list index or None, value) for every scalar filter value."""
+    positions = []
+    for filter_idx, item in enumerate(parsed_conditions.get("filters", [])):
+        value = item.get("value")
+        if isinstance(value, list):
+            positions.extend((filter_idx, list_idx, v) for list_idx, v in enumerate(value))
+        elif value is not None:
+            positions.append((filter_idx, None, value))
+    return positions
+
+
+def build_template_conditions(parsed_conditions: Dict, literals: List[Dict[str, Any]]) -> Optional[Dict]:
+    """
+    Turns parsed conditions into a template by replacing each literal's value with a slot marker.
+    Returns None unless every literal maps to exactly one filter value and no value matches
+    more than one literal; anything else (units, rankings, repeated values) is not safe to reuse.
+    """
+    if not literals or not parsed_conditions.get("filters"):
+        return None
+    positions = _value_positions(parsed_conditions)
+    templated = copy.deepcopy(parsed_conditions)
+    used_positions = set()
+    for slot, literal in enumerate(literals):
+        matches = [(pos_idx, encoding) for pos_idx, (_, _, value) in enumerate(positions)
+                   if (encoding := _literal_matches(literal, value)) is not None]
+        if len(matches) != 1 or matches[0][0] in used_positions:
+            return None
+        pos_idx, encoding = matches[0]
+        used_positions.add(pos_idx)
+        filter_idx, list_idx, _ = positions[pos_idx]
+        marker = {_SLOT_KEY: slot, "encoding": encoding}
+        if list_idx is None:
+            templated["filters"][filter_idx]["value"] = marker
+        else:
+            templated["filters"][filter_idx]["value"][list_idx] = marker
+    return templated
+
+
+def _fill_value(marker: Dict[str, Any], literals: List[Dict[str, Any]]) -> Any:
+    literal = literals[marker[_SLOT_KEY]]
+    if marker["encoding"] == "string_number":
+        return literal["text"]
+    return literal["value"]
+
+
+def fill_template_conditions(template_conditions: Dict, literals: List[Dict[str, Any]]) -> Optional[Dict]:
+    """Fills slot markers with a new query's literals. Returns None if the literals do not fit the slots."""
+    slots = []
+    for item in template_conditions.get("filters", []):
+        values = item.get("value") if isinstance(item.get("value"), list) else [item.get("value")]
+        slots.extend(v for v in values if isinstance(v, dict) and _SLOT_KEY in v)
+    if len(slots) != len(literals):
+        return None
+    kind_for_encoding = {"number": "number", "string_number": "number", "date": "date", "string": "quoted"}
+    if any(literals[m[_SLOT_KEY]]["kind"] != kind_for_encoding[m["encoding"]] for m in slots):
+        return None
+
+    filled = copy.deepcopy(template_conditions)
+    for item in filled.get("filters", []):
+        value = item.get("value")
+        if isinstance(value, dict) and _SLOT_KEY in value:
+            item["value"] = _fill_value(value, literals)
+        elif isinstance(value, list):
+            item["value"] = [_fill_value(v, literals) if isinstance(v, dict) and _SLOT_KEY in v else v for v in value]
+    return filled
@@ -0,0 +1,177 @@
+# app/excel/result_serializer.py
+import json
+import logging
+from functools import lru_cache
+from typing import Iterator, Union
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+from pydantic import BaseModel
+from app.core.config import settings
+from app.excel import columnar
+
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+SERIALIZE_BATCH_ROWS = settings.QUERY_STREAM_BATCH_ROWS
+_NULL = "null"
+# JSON escapes besides \\ and \" (applied first); other control characters take the slow path
+_SIMPLE_ESCAPES = [("\n", "\\n"), ("\r", "\\r"), ("\t", "\\t"), ("\b", "\\b"), ("\f", "\\f")]
+_OTHER_CONTROL_CHARS = r'[\x00-\x07\x0b\x0e-\x1f]'
+
+
+def _escaped_strings(array: pa.Array) -> pa.Array:
+    escaped = pc.replace_substring(array, "\\", "\\\\")
+    escaped = pc.replace_substring(escaped, '"', '\\"')
+    for char, escape in _SIMPLE_ESCAPES:
+        escaped = pc.replace_substring(escaped, char, escape)
+    fragments = pc.binary_join_element_wise('"', escaped, '"', "")
+    needs_python = pc.fill_null(pc.match_substring_regex(array, _OTHER_CONTROL_CHARS), False)
+    if pc.any(needs_python).as_py():
+        # Rare: let json.dumps write the \u00XX escapes for the few values that need them
+        values = array.to_pylist()
+        exact = pa.array([json.dumps(v, ensure_ascii=False) if v is not None else None for v in values], pa.string())
+        fragments = pc.if_else(needs_python, exact, fragments)
+    return fragments
+
+
+def _string_fragments(array: pa.Array) -> pa.Array:
+    # Result columns usually repeat a few values (cities, categories): escape each distinct value once
+    encoded = pc.dictionary_encode(array)
+    if len(encoded.dictionary) * 2 <= len(array):
+        return pc.take(_escaped_strings(encoded.dictionary), encoded.indices)
+    return _escaped_strings(array)
+
+
+def _float_fragments(array: pa.Array) -> pa.Array:
+    # Arrow writes the shortest round-trip form, as json.dumps does, but "100" for 100.0: keep the ".0"
+    text = pc.cast(array, pa.string())
+    integral = pc.invert(pc.or_(pc.match_substring(text, "."), pc.match_substring(text, "e")))
+    text = pc.if_else(integral, pc.binary_join_element_wise(text, ".0", ""), text)
+    # NaN is missing data; JSON has no infinities either
+    return pc.if_else(pc.is_finite(array), text, pa.scalar(None, pa.string()))
+
+
+@lru_cache(maxsize=1)
+def _clock_strings() -> pa.Array:
+    """The clock part ("THH:MM:SS") of every second of the day, indexed by seconds since midnight."""
+    return pa.array([f"T{h:02d}:{m:02d}:{s:02d}" for h in range(24) for m in range(60) for s in range(60)], pa.string())
+
+
+def _fraction_strings(fraction: np.ndarray) -> pa.Array:
+    # Timestamp.isoformat() writes microseconds when the nanoseconds are zero, all nine digits otherwise
+    text = np.full(len(fraction), "", dtype=object)
+    micro = (fraction != 0) & (fraction % 1000 == 0)
+    nano = (fraction % 1000) != 0
+    if micro.any():
+        text[micro] = "." + np.char.zfill((fraction[micro] // 1000).astype(str), 6).astype(object)
+    if nano.any():
+        text[nano] = "." + np.char.zfill(fraction[nano].astype(str), 9).astype(object)
+    return pa.array(text, pa.string())
+
+
+def _offset_strings(offset_minutes: np.ndarray) -> pa.Array:
+    # Few distinct offsets per column (DST at most), so format each once
+    distinct, positions = np.unique(offset_minutes, return_inverse=True)
+    labels = []
+    for offset in distinct:
+        hours, minutes = divmod(abs(int(offset)), 60)
+        labels.append(f"{'+' if offset >= 0 else '-'}{hours:02d}:{minutes:02d}")
+    return pc.take(pa.array(labels, pa.string()), pa.array(positions))
+
+
+def _epoch_ns(array: pa.Array) -> np.ndarray:
+    return pc.fill_null(pc.cast(pc.cast(array, pa.timestamp("ns", tz=array.type.tz)), pa.int64()), 0).to_numpy()
+
+
+def _timestamp_fragments(array: pa.Array) -> pa.Array:
+    """Quoted ISO 8601 strings, as Timestamp.isoformat() writes them: date + clock lookups, no per-value formatting."""
+    tz = array.type.tz
+    local_ns = _epoch_ns(array)
+    if tz is not None:
+        utc_ns = local_ns
+        # pandas rounds historical offsets with seconds (LMT) to whole minutes, wall time included
+        offset_minutes = np.round((_epoch_ns(pc.local_timestamp(array)) - utc_ns) / 60_000_000_000).astype(np.int64)
+        local_ns = utc_ns + offset_minutes * 60_000_000_000
+    seconds = local_ns // 1_000_000_000
+    fraction = local_ns - seconds * 1_000_000_000
+    days = seconds // 86_400
+    parts = ['"', pc.cast(pa.array(days.astype(np.int32), pa.date32()), pa.string()), pc.take(_clock_strings(), pa.array(seconds - days * 86_400))]
+    if fraction.any():
+        parts.append(_fraction_strings(fraction))
+    if tz is not None:
+        parts.append(_offset_strings(offset_minutes))
+    fragments = pc.binary_join_element_wise(*parts, '"', "")
+    return pc.if_else(pc.is_valid(array), fragments, pa.scalar(None, pa.string()))
+
+
+def _value_fragments(array: pa.Array) -> pa.Array:
+    """Each value of the column as a JSON fragment; nulls become null."""
+    value_type = array.type
+    if pa.types.is_dictionary(value_type):
+        return _value_fragments(array.dictionary_decode())
+    if pa.types.is_null(value_type):
+        return pa.array([_NULL] * len(array), pa.string())
+    if pa.types.is_boolean(value_type):
+        fragments = pc.if_else(array, "true", "false")
+    elif pa.types.is_integer(value_type):
+        fragments = pc.cast(array, pa.string())
+    elif pa.types.is_floating(value_type):
+        fragments = _float_fragments(array)
+    elif pa.types.is_timestamp(value_type):
+        fragments = _timestamp_fragments(array)
+    elif pa.types.is_date(value_type):
+        fragments = pc.binary_join_element_wise('"', pc.cast(array, pa.string()), '"', "")
+    elif pa.types.is_string(value_type) or pa.types.is_large_string(value_type):
+        fragments = _string_fragments(array)
+    else:
+        # Decimals, binary, nested values: rare in spreadsheets, so per value
+        fragments = pa.array([json.dumps(v, ensure_ascii=False, default=str) for v in array.to_pylist()], pa.string())
+    return pc.fill_null(fragments, _NULL)
+
+
+def _batch_rows_json(batch: pa.RecordBatch, keys: list) -> bytes:
+    """The batch's rows as JSON objects, each followed by a comma, in one buffer."""
+    parts = []
+    for key, column in zip(keys, batch.columns):
+        parts.extend([key, _value_fragments(column)])
+    rows = pc.binary_join_element_wise(*parts, "},", "") if parts else pa.array(["{},"] * batch.num_rows, pa.string())
+    return concatenated_bytes(rows)
+
+
+def concatenated_bytes(strings: pa.Array) -> bytes:
+    """All values of a string array back to back, straight from its data buffer (nulls add nothing)."""
+    offsets = np.frombuffer(strings.buffers()[1], dtype=np.int32)
+    start, end = offsets[strings.offset], offsets[strings.offset + len(strings)]
+    return strings.buffers()[2].to_pybytes()[start:end] if end > start else b""
+
+
+def iter_rows_json(rows: Union[pd.DataFrame, pa.Table], batch_rows: int = SERIALIZE_BATCH_ROWS) -> Iterator[bytes]:
+    """
+    Rows of a DataFrame (or of an Arrow table, e.g. a page read from Parquet) as JSON objects in
+    batches of batch_rows: each yielded chunk is "{...},{...}" (no brackets, no trailing comma),
+    ready to go inside a JSON array. Goes through Arrow column by column, so there are no per-row
+    dicts and no per-cell Python calls for the common types.
+    """
+    table = rows if isinstance(rows, pa.Table) else columnar.dataframe_to_arrow_table(rows)
+    if table.num_rows == 0:
+        return
+    keys = [("{" if i == 0 else ",") + json.dumps(str(name), ensure_ascii=False) + ":" for i, name in enumerate(table.column_names)]
+    for batch in table.to_batches(max_chunksize=batch_rows):
+        if batch.num_rows:
+            yield _batch_rows_json(batch, keys)[:-1]
+
+
+def rows_json_array(rows: Union[pd.DataFrame, pa.Table]) -> bytes:
+    return b"[" + b",".join(iter_rows_json(rows)) + b"]"
+
+
+def response_json_with_rows(response: BaseModel, field: str, rows: Union[pd.DataFrame, pa.Table]) -> bytes:
+    """
+    JSON of a response model whose field holds the given rows. The model is validated without its
+    rows (the rows never become Python dicts); field is appended as the last key.
+    """
+    head = response.model_dump_json(exclude={field})
+    separator = "," if head != "{}" else ""
+    return head[:-1].encode("utf-8") + f'{separator}"{field}":'.encode("utf-8") + rows_json_array(rows) + b"}"
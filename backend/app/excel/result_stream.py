@@ -0,0 +1,134 @@
+# app/excel/result_stream.py
+import io
+import json
+import logging
+from typing import Dict, Any, Optional, Iterator, List
+import pandas as pd
+import pyarrow as pa
+import pyarrow.ipc
+import pyarrow.parquet as pq
+from app.core.config import settings
+from app.excel import result_serializer
+
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+STREAM_BATCH_ROWS = settings.QUERY_STREAM_BATCH_ROWS
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+ARROW_STREAM_MEDIA_TYPE = "application/vnd.apache.arrow.stream"
+PARQUET_MEDIA_TYPE = "application/vnd.apache.parquet"
+RESPONSE_FORMATS = ("json", "ndjson", "arrow", "parquet")
+BINARY_FORMATS = ("arrow", "parquet") # The whole filtered frame as a file, for programmatic clients
+# Accept header media types, checked in this order; JSON is the fallback
+_ACCEPT_MEDIA_TYPES = [
+    (ARROW_STREAM_MEDIA_TYPE, "arrow"),
+    (PARQUET_MEDIA_TYPE, "parquet"),
+    ("application/x-parquet", "parquet"),
+    (NDJSON_MEDIA_TYPE, "ndjson"),
+]
+PARQUET_ROW_GROUP_ROWS = settings.QUERY_RESULT_ROW_GROUP_ROWS
+
+
+def negotiate_format(accept: Optional[str], requested: Optional[str]) -> str:
+    """Response format for /query: the request's format field wins, then the Accept header, else JSON."""
+    if requested:
+        requested = requested.lower()
+        if requested not in RESPONSE_FORMATS:
+            raise ValueError(f"Unsupported response format '{requested}'. Supported: {', '.join(RESPONSE_FORMATS)}.")
+        return requested
+    if accept:
+        accept = accept.lower()
+        for media_type, response_format in _ACCEPT_MEDIA_TYPES:
+            if media_type in accept:
+                return response_format
+    return "json"
+
+
+def frame_batches(df: pd.DataFrame, batch_rows: int = STREAM_BATCH_ROWS) -> Iterator[pd.DataFrame]:
+    for start in range(0, len(df), batch_rows):
+        yield df.iloc[start:start + batch_rows]
+
+
+def _line(record: Dict[str, Any]) -> bytes:
+    return (json.dumps(record, ensure_ascii=False, default=str) + "\n").encode("utf-8")
+
+
+def ndjson_stream(header: Dict[str, Any], batches: Iterator[pd.DataFrame]) -> Iterator[bytes]:
+    """
+    NDJSON body for a streamed /query result: {"type": "header", ...} first, then one
+    {"type": "rows", "rows": [...]} line per batch and {"type": "end", "row_count": n} last.
+    Only one batch is converted at a time. A failure after the header has gone out can no longer
+    change the status code, so it ends the stream with {"type": "error", "detail": ...} instead.
+    """
+    yield _line({"type": "header", **header})
+    row_count = 0
+    try:
+        for batch in batches:
+            if batch.empty:
+                continue
+            row_count += len(batch)
+            rows_json = b"".join(result_serializer.iter_rows_json(batch, batch_rows=len(batch)))
+            yield b'{"type": "rows", "rows": [' + rows_json + b']}\n'
+    except Exception as e:
+        logger.error(f"Streaming query result failed after {row_count} rows: {e}", exc_info=True)
+        yield _line({"type": "error", "detail": str(e)})
+        return
+    yield _line({"type": "end", "row_count": row_count})
+
+
+class ChunkSink(io.RawIOBase):
+    """Write-only file that hands out what was written so far; tell() keeps counting, as the Parquet writer needs."""
+
+    def __init__(self):
+        super().__init__()
+        self._pending: List[bytes] = []
+        self._position = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        chunk = bytes(data)
+        self._pending.append(chunk)
+        self._position += len(chunk)
+        return len(chunk)
+
+    def tell(self) -> int:
+        return self._position
+
+    def take(self) -> bytes:
+        data, self._pending = b"".join(self._pending), []
+        return data
+
+
+def _with_metadata(table: pa.Table, metadata: Dict[str, Any]) -> pa.Table:
+    # JSON-encoded values next to the pandas metadata from_pandas already put there
+    extra = {key.encode("utf-8"): json.dumps(value, ensure_ascii=False, default=str).encode("utf-8") for key, value in metadata.items()}
+    return table.replace_schema_metadata({**(table.schema.metadata or {}), **extra})
+
+
+def arrow_ipc_stream(table: pa.Table, metadata: Dict[str, Any], batch_rows: int = STREAM_BATCH_ROWS) -> Iterator[bytes]:
+    """
+    Arrow IPC stream of table, one record batch of batch_rows at a time. metadata (parsed conditions
+    etc.) goes in the schema metadata, JSON-encoded per key, so pa.ipc.open_stream(...).schema.metadata
+    has it before the first batch is read.
+    """
+    table = _with_metadata(table, metadata)
+    sink = ChunkSink()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        yield sink.take()
+        for batch in table.to_batches(max_chunksize=batch_rows):
+            writer.write_batch(batch)
+            yield sink.take()
+    yield sink.take() # End-of-stream marker
+
+
+def parquet_stream(table: pa.Table, metadata: Dict[str, Any], row_group_rows: int = PARQUET_ROW_GROUP_ROWS) -> Iterator[bytes]:
+    """Parquet file of table written row group by row group; metadata goes in the schema metadata as for arrow_ipc_stream."""
+    table = _with_metadata(table, metadata)
+    sink = ChunkSink()
+    with pq.ParquetWriter(sink, table.schema) as writer:
+        for start in range(0, max(table.num_rows, 1), row_group_rows):
+            writer.write_table(table.slice(start, row_group_rows))
+            yield sink.take()
+    yield sink.take() # Footer
@@ -1,18 +1,23 @@
-from fastapi import APIRouter, Depends, HTTPException, status, UploadFile, File
-from fastapi.responses import StreamingResponse
+from fastapi import APIRouter, Depends, HTTPException, status, UploadFile, File, Request, Query
+from fastapi.responses import StreamingResponse, Response
+from fastapi.concurrency import run_in_threadpool
 from typing import List, Optional, Dict, Any # Added Dict, Any
 import pandas as pd
 from io import BytesIO
 import numpy as np
 import json
+import itertools
 from pathlib import Path
 from sqlmodel import Session
 from pydantic import BaseModel # Ensure BaseModel is imported if used for internal dicts
 
-from app.excel import models as excel_models, processing as excel_logic
+from app.excel import models as excel_models, processing as excel_logic, result_stream, result_serializer, temp_store, columnar, export_stream
 from app.database.models import User as DBUser, UploadedExcelFile as DBUploadedExcelFile
 from app.database.setup import get_db
 from app.core.dependencies import get_current_active_user
+from app.core.config import settings
+from app.excel.df_cache import dataframe_cache
+from app.excel.llm_dispatch import llm_dispatcher
 
 router = APIRouter()
 
@@ -61,14 +66,33 @@ async def upload_excel_files_route(
         errors=processing_errors
     )
 
+def _binary_query_response(response_format: str, result_df: pd.DataFrame, metadata: Dict[str, Any]) -> StreamingResponse:
+    # Arrow IPC stream or Parquet file of the whole result; metadata (parsed conditions etc.) rides in the schema
+    table = columnar.dataframe_to_arrow_table(result_df)
+    metadata = {**metadata, "total_rows": table.num_rows}
+    if response_format == "arrow":
+        return StreamingResponse(result_stream.arrow_ipc_stream(table, metadata), media_type=result_stream.ARROW_STREAM_MEDIA_TYPE)
+    return StreamingResponse(
+        result_stream.parquet_stream(table, metadata),
+        media_type=result_stream.PARQUET_MEDIA_TYPE,
+        headers={"Content-Disposition": 'attachment; filename="query_results.parquet"'}
+    )
+
+
 @router.post("/query", response_model=excel_models.QueryExecutionResponse)
 async def execute_excel_query_route(
     request_data: excel_models.ExcelQueryRequest, # This request might need a file_id
+    request: Request,
     db: Session = Depends(get_db),
     current_user: DBUser = Depends(get_current_active_user)
 ):
     if not current_user.user_group_id:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="User does not belong to a group.")
+    try:
+        # "ndjson" streams the rows in batches instead of building one JSON document; "arrow"/"parquet" send the frame as binary
+        response_format = result_stream.negotiate_format(request.headers.get("accept"), request_data.format)
+    except ValueError as ve:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(ve))
 
     # --- CRITICAL CHANGE: How do you select which file to query? ---
     # Option 1: Request_data includes a file_id_to_query
@@ -86,80 +110,144 @@ async def execute_excel_query_route(
     file_record_to_query = group_files[0]
     # --- END CRITICAL CHANGE ---
 
-    try:
-        # Now using stored_file_path of the specific original file
-        data_to_query_df = excel_logic.read_and_prepare_dataframe_from_file(file_record_to_query.stored_file_path)
-    except FileNotFoundError:
-        excel_logic.logger.error(f"Data file missing for record ID {file_record_to_query.id}: {file_record_to_query.stored_file_path}")
+    # Files past the large-file threshold are filtered from disk (DuckDB or chunked) and never loaded here
+    filter_backend, source_path = excel_logic.filter_backend_for_record(file_record_to_query)
+    data_to_query_df = None
+    if filter_backend == "pandas":
+        try:
+            # Reads the columnar copy written at ingest; the original is re-parsed only if the copy is missing or stale
+            data_to_query_df = await run_in_threadpool(excel_logic.load_dataframe_for_record, db, file_record_to_query)
+        except FileNotFoundError:
+            excel_logic.logger.error(f"Data file missing for record ID {file_record_to_query.id}: {file_record_to_query.stored_file_path}")
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Data file not found on server.")
+        except ValueError as ve:
+            raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Error processing data file: {str(ve)}")
+    elif not Path(source_path).exists():
+        excel_logic.logger.error(f"Data file missing for record ID {file_record_to_query.id}: {source_path}")
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Data file not found on server.")
-    except ValueError as ve:
-        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Error processing data file: {str(ve)}")
 
     # original_filenames_list will now be just the one file being queried
     original_filenames_list = [file_record_to_query.original_filename]
 
-    if data_to_query_df.empty:
+    if data_to_query_df is not None and data_to_query_df.empty:
+        if response_format == "ndjson":
+            header = {"query": request_data.query, "parsed_conditions": {"filters": [], "logical_operator": "AND"}, "source_files": original_filenames_list, "total_rows": 0}
+            return StreamingResponse(result_stream.ndjson_stream(header, iter(())), media_type=result_stream.NDJSON_MEDIA_TYPE)
+        if response_format in result_stream.BINARY_FORMATS:
+            metadata = {"query": request_data.query, "parsed_conditions": {"filters": [], "logical_operator": "AND"}, "source_files": original_filenames_list}
+            return _binary_query_response(response_format, data_to_query_df, metadata)
         return excel_models.QueryExecutionResponse(
             query=request_data.query,
             parsed_conditions={"filters": [], "logical_operator": "AND"},
             results=[],
-            source_files=original_filenames_list
+            source_files=original_filenames_list,
+            total_rows=0
         )
 
-    # Generate columns_info for THIS specific DataFrame
-    # (DBUploadedExcelFile model does not store columns_info_json for each original in this simplified setup)
-    columns_info = excel_logic.generate_columns_info(data_to_query_df)
+    # Column profile stored at ingest (recomputed only if missing or from an older profiler version)
+    columns_info = await run_in_threadpool(excel_logic.get_columns_info_for_record, db, file_record_to_query, data_to_query_df)
     if not columns_info: # Handle case where DataFrame might be empty or have no columns after read
         excel_logic.logger.warning(f"No column information could be generated for file: {file_record_to_query.original_filename}")
         # Depending on LLM, you might need to raise an error or return empty parsed_conditions
         # For now, proceed with empty columns_info, LLM might handle it or fail gracefully.
 
-    # ... (LLM configuration and parsing logic remains similar but acts on 'columns_info' from the single DF) ...
-    llm_req_config = request_data.config
-    effective_llm_config = json.loads(json.dumps(excel_logic.DEFAULT_LLM_CONFIG))
-
-    if llm_req_config:
-        if llm_req_config.apiType:
-            effective_llm_config["apiType"] = llm_req_config.apiType
-        if llm_req_config.siliconflow:
-            sf_conf_dict = llm_req_config.siliconflow.model_dump(exclude_none=True)
-            effective_llm_config["siliconflow"].update(sf_conf_dict)
-        if llm_req_config.ollama:
-            ol_conf_dict = llm_req_config.ollama.model_dump(exclude_none=True)
-            effective_llm_config["ollama"].update(ol_conf_dict)
-
-    api_type_to_use = effective_llm_config["apiType"]
-    provider_specific_config = effective_llm_config.get(api_type_to_use, {})
-    if not provider_specific_config and api_type_to_use in ["siliconflow", "ollama"]:
-        provider_specific_config = effective_llm_config.get(api_type_to_use.lower(), {})
-
+    # LLM call goes through the shared async client, so a slow provider does not block the event loop
     try:
-        if api_type_to_use == 'siliconflow':
-            parsed_conditions = excel_logic.parse_with_siliconflow(request_data.query, columns_info, provider_specific_config)
-        elif api_type_to_use == 'ollama':
-            parsed_conditions = excel_logic.parse_with_ollama(request_data.query, columns_info, provider_specific_config)
-        else:
-            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Unsupported API type: {api_type_to_use}")
+        parsed_conditions, parse_info = await excel_logic.parse_query_with_llm(request_data.query, columns_info, request_data.config)
     except HTTPException as e:
         raise e
     except Exception as e:
         excel_logic.logger.error(f"Unhandled error during LLM parsing: {e}", exc_info=True)
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Error parsing query via LLM: {str(e)}")
 
-    filtered_df = excel_logic.apply_dynamic_filters(data_to_query_df, parsed_conditions)
+    if response_format == "ndjson":
+        header = {
+            "query": request_data.query,
+            "parsed_conditions": parsed_conditions,
+            "source_files": original_filenames_list,
+            "parsed_from_cache": parse_info["cache_hit"],
+            "parse_source": parse_info["source"],
+            "llm_provider": parse_info.get("provider"),
+            "llm_latency_ms": parse_info.get("latency_ms"),
+            "total_rows": None, # Unknown up front when the file is filtered from disk while streaming
+        }
+        if filter_backend == "pandas":
+            filtered_df, executed_plan = await run_in_threadpool(excel_logic.apply_dynamic_filters_with_plan, data_to_query_df, parsed_conditions, columns_info)
+            header["total_rows"] = len(filtered_df)
+            if request_data.explain:
+                header["filter_plan"] = executed_plan
+            batches = result_stream.frame_batches(filtered_df)
+        else:
+            batches = excel_logic.iter_filter_with_backend(filter_backend, source_path, parsed_conditions, columns_info)
+        # A plain iterator: Starlette runs it in the threadpool, one batch at a time
+        return StreamingResponse(result_stream.ndjson_stream(header, batches), media_type=result_stream.NDJSON_MEDIA_TYPE)
 
-    df_for_json = filtered_df.copy()
-    for col_name in df_for_json.select_dtypes(include=['datetime64[ns]', 'datetime64[ns, UTC]', 'datetimetz']):
-        df_for_json[col_name] = df_for_json[col_name].apply(lambda x: x.isoformat() if pd.notnull(x) else None)
-    df_for_json = df_for_json.replace({np.nan: None, pd.NaT: None})
-    results_list = df_for_json.to_dict('records')
+    # Loading, profiling and filtering run in the threadpool too: a large frame must not stall the event loop
+    if filter_backend == "pandas":
+        filtered_df, executed_plan = await run_in_threadpool(excel_logic.apply_dynamic_filters_with_plan, data_to_query_df, parsed_conditions, columns_info)
+    else:
+        try:
+            filtered_df, executed_plan = await run_in_threadpool(excel_logic.filter_with_backend, filter_backend, source_path, None, parsed_conditions, columns_info)
+        except ValueError as ve:
+            raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(ve))
+
+    if response_format in result_stream.BINARY_FORMATS:
+        metadata = {
+            "query": request_data.query,
+            "parsed_conditions": parsed_conditions,
+            "source_files": original_filenames_list,
+            "parse_source": parse_info["source"],
+        }
+        if request_data.explain:
+            metadata["filter_plan"] = executed_plan
+        return await run_in_threadpool(_binary_query_response, response_format, filtered_df, metadata)
+
+    # The full result stays on the server; the client gets the first page and pages through the rest by result_id
+    result_id = await run_in_threadpool(
+        temp_store.store_query_result_as_file,
+        {"user_group_id": current_user.user_group_id, "query": request_data.query, "parsed_conditions": parsed_conditions, "source_files": original_filenames_list},
+        filtered_df
+    )
+    if result_id is None:
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Could not store the query result.")
+    page_size = min(max(request_data.page_size or settings.QUERY_RESULT_PAGE_ROWS, 1), settings.QUERY_RESULT_MAX_PAGE_ROWS)
 
-    return excel_models.QueryExecutionResponse(
+    query_response = excel_models.QueryExecutionResponse(
         query=request_data.query,
         parsed_conditions=parsed_conditions,
-        results=results_list,
-        source_files=original_filenames_list # Will be the single file name
+        results=[], # Serialized straight from the frame below, without per-row dicts or validation
+        source_files=original_filenames_list, # Will be the single file name
+        result_id=result_id,
+        total_rows=len(filtered_df),
+        parsed_from_cache=parse_info["cache_hit"],
+        parse_source=parse_info["source"],
+        llm_provider=parse_info.get("provider"),
+        llm_latency_ms=parse_info.get("latency_ms"),
+        filter_plan=executed_plan if request_data.explain else None
     )
+    body = await run_in_threadpool(result_serializer.response_json_with_rows, query_response, "results", filtered_df.iloc[:page_size])
+    return Response(content=body, media_type="application/json")
+
+
+@router.get("/results/{result_id}", response_model=excel_models.QueryResultPageResponse)
+async def get_query_result_page_route(
+    result_id: str,
+    offset: int = Query(0, ge=0),
+    limit: int = Query(settings.QUERY_RESULT_PAGE_ROWS, ge=1, le=settings.QUERY_RESULT_MAX_PAGE_ROWS),
+    current_user: DBUser = Depends(get_current_active_user)
+):
+    # Reads the stored result only: no LLM call and no filtering
+    query_params = temp_store.get_query_params_for_result(result_id)
+    if not query_params or query_params.get("user_group_id") != current_user.user_group_id:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Query result not found or expired.")
+    page = await run_in_threadpool(temp_store.get_query_result_page, result_id, offset, limit)
+    if page is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Query result not found or expired.")
+    page_table, total_rows = page
+
+    page_response = excel_models.QueryResultPageResponse(result_id=result_id, offset=offset, limit=limit, total_rows=total_rows, results=[])
+    body = await run_in_threadpool(result_serializer.response_json_with_rows, page_response, "results", page_table)
+    return Response(content=body, media_type="application/json")
 
 
 @router.post("/download")
@@ -170,6 +258,9 @@ async def download_excel_results_route(
 ):
     if not current_user.user_group_id:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="User does not belong to a group.")
+    download_format = request_data.format.lower()
+    if download_format not in export_stream.DOWNLOAD_FORMATS:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Unsupported download format '{request_data.format}'. Supported: {', '.join(export_stream.DOWNLOAD_FORMATS)}.")
 
     # Assuming you want to download results based on the LATEST uploaded file for the group
     group_excel_files_db: List[DBUploadedExcelFile] = excel_logic.get_excel_files_for_group(db, current_user.user_group_id, limit=1)
@@ -178,10 +269,14 @@ async def download_excel_results_route(
 
     latest_file_record = group_excel_files_db[0] # This is an instance of DBUploadedExcelFile
 
+    filter_backend, source_path = excel_logic.filter_backend_for_record(latest_file_record)
+    data_to_filter_df = None
     try:
-        # --- CHANGE HERE ---
-        # Use stored_file_path for the original uploaded file
-        data_to_filter_df = excel_logic.read_and_prepare_dataframe_from_file(latest_file_record.stored_file_path)
+        if filter_backend == "pandas":
+            # Reads the columnar copy written at ingest; the original is re-parsed only if the copy is missing or stale
+            data_to_filter_df = await run_in_threadpool(excel_logic.load_dataframe_for_record, db, latest_file_record)
+        elif not Path(source_path).exists():
+            raise FileNotFoundError(source_path)
     except FileNotFoundError:
         # --- CHANGE HERE (optional, for consistent logging) ---
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Data file not found on server for download.")
@@ -193,70 +288,76 @@ async def download_excel_results_route(
          raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Unexpected error processing data file for download: {str(e)}")
 
 
-    if data_to_filter_df.empty:
+    if data_to_filter_df is not None and data_to_filter_df.empty:
          raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Data file is empty after reading. Cannot download.")
 
     parsed_conditions_for_download = request_data.parsed_conditions
+    download_headers = {}
+    columns_info = None # Only loaded when the query still has to be parsed
     filename_suffix = Path(latest_file_record.original_filename).stem # Use original filename stem for download
 
     if not parsed_conditions_for_download and request_data.query:
-        # Generate columns_info for THIS specific DataFrame if query needs parsing
-        columns_info = excel_logic.generate_columns_info(data_to_filter_df)
+        # Column profile stored at ingest (recomputed only if missing or from an older profiler version)
+        columns_info = await run_in_threadpool(excel_logic.get_columns_info_for_record, db, latest_file_record, data_to_filter_df)
         if not columns_info:
             excel_logic.logger.warning(f"No column information for LLM for file: {latest_file_record.original_filename}")
             # Decide how to handle: perhaps download unfiltered if no columns_info for LLM
 
-        # ... (LLM configuration and parsing logic - no change needed here) ...
-        llm_req_config = request_data.config
-        effective_llm_config = json.loads(json.dumps(excel_logic.DEFAULT_LLM_CONFIG))
-
-        if llm_req_config:
-            if llm_req_config.apiType:
-                effective_llm_config["apiType"] = llm_req_config.apiType
-            if llm_req_config.siliconflow:
-                sf_conf_dict = llm_req_config.siliconflow.model_dump(exclude_none=True)
-                effective_llm_config["siliconflow"].update(sf_conf_dict)
-            if llm_req_config.ollama:
-                ol_conf_dict = llm_req_config.ollama.model_dump(exclude_none=True)
-                effective_llm_config["ollama"].update(ol_conf_dict)
-
-        api_type_to_use = effective_llm_config["apiType"]
-        provider_specific_config = effective_llm_config.get(api_type_to_use, {})
-        if not provider_specific_config and api_type_to_use in ["siliconflow", "ollama"]:
-            provider_specific_config = effective_llm_config.get(api_type_to_use.lower(), {})
-
         try:
-            if api_type_to_use == 'siliconflow':
-                parsed_conditions_for_download = excel_logic.parse_with_siliconflow(request_data.query, columns_info, provider_specific_config)
-            elif api_type_to_use == 'ollama':
-                parsed_conditions_for_download = excel_logic.parse_with_ollama(request_data.query, columns_info, provider_specific_config)
-            else:
-                raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Unsupported API type for download parsing: {api_type_to_use}")
+            parsed_conditions_for_download, parse_info = await excel_logic.parse_query_with_llm(request_data.query, columns_info, request_data.config)
+            download_headers['X-Parsed-From-Cache'] = 'true' if parse_info["cache_hit"] else 'false'
+            if parse_info.get("provider"):
+                download_headers['X-LLM-Provider'] = parse_info["provider"]
+                download_headers['X-LLM-Latency-Ms'] = str(parse_info["latency_ms"])
         except Exception as e:
             raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Error parsing query for download: {str(e)}")
 
-    if not parsed_conditions_for_download or not parsed_conditions_for_download.get("filters"):
-        filtered_df_for_download = data_to_filter_df.copy()
-        filename_suffix += "_full_data" # Append to original filename stem
+    column_types = None # Parquet types fixed before the first batch is written
+    if filter_backend != "pandas":
+        # Rows come from the disk filter batch by batch and go straight into the writer; the full result is never held
+        batches = excel_logic.iter_filter_with_backend(filter_backend, source_path, parsed_conditions_for_download, columns_info)
+        try:
+            first_batch = await run_in_threadpool(next, batches, None) # Errors before the first byte still become a 500
+        except ValueError as ve:
+            raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(ve))
+        needs_profile = first_batch is None or (download_format == "parquet" and filter_backend == "chunked")
+        if needs_profile and columns_info is None:
+            columns_info = await run_in_threadpool(excel_logic.get_columns_info_for_record, db, latest_file_record, None)
+        if first_batch is not None:
+            column_names = list(first_batch.columns)
+            batches = itertools.chain([first_batch], batches)
+        else:
+            column_names = list(columns_info.keys())
+        if download_format == "parquet" and filter_backend == "chunked":
+            # Chunks are typed one by one: text columns of the profile must not take a chunk's number type
+            column_types = export_stream.text_column_types(columns_info)
+        filename_suffix += "_query_results" if parsed_conditions_for_download and parsed_conditions_for_download.get("filters") else "_full_data"
     else:
-        filtered_df_for_download = excel_logic.apply_dynamic_filters(data_to_filter_df, parsed_conditions_for_download)
-        filename_suffix += "_query_results" # Append to original filename stem
-
-    output = BytesIO()
-    try:
-        with pd.ExcelWriter(output, engine='openpyxl') as writer:
-            filtered_df_for_download.to_excel(writer, sheet_name='Query_Results', index=False)
-        output.seek(0)
-    except Exception as e:
-        excel_logic.logger.error(f"Error writing Excel file for download: {e}", exc_info=True)
-        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Error generating Excel file for download.")
+        if not parsed_conditions_for_download or not parsed_conditions_for_download.get("filters"):
+            filtered_df_for_download = data_to_filter_df # Only read from here on, no copy needed
+            filename_suffix += "_full_data" # Append to original filename stem
+        else:
+            filtered_df_for_download = await run_in_threadpool(excel_logic.apply_dynamic_filters, data_to_filter_df, parsed_conditions_for_download, columns_info)
+            filename_suffix += "_query_results" # Append to original filename stem
+        column_names = list(filtered_df_for_download.columns)
+        batches = result_stream.frame_batches(filtered_df_for_download)
+        if download_format == "parquet":
+            column_types = await run_in_threadpool(export_stream.object_column_types, filtered_df_for_download)
+
+    # The writers pull one batch at a time while the response is being sent
+    if download_format == "xlsx":
+        body = export_stream.xlsx_stream(column_names, batches)
+    elif download_format == "csv":
+        body = export_stream.csv_stream(column_names, batches)
+    else:
+        body = export_stream.parquet_download_stream(column_names, batches, column_types)
 
-    download_filename = f'{filename_suffix}_{pd.Timestamp.now().strftime("%Y%m%d%H%M%S")}.xlsx'
+    download_filename = f'{filename_suffix}_{pd.Timestamp.now().strftime("%Y%m%d%H%M%S")}.{download_format}'
 
     return StreamingResponse(
-        output,
-        media_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
-        headers={'Content-Disposition': f'attachment; filename="{download_filename}"'}
+        body,
+        media_type=export_stream.DOWNLOAD_FORMATS[download_format],
+        headers={'Content-Disposition': f'attachment; filename="{download_filename}"', **download_headers}
     )
 
 @router.get("/files", response_model=List[excel_models.UploadedExcelFileResponse])
@@ -274,4 +375,19 @@ async def list_group_excel_files_route(
         # from app.database.models
         api_response_item = excel_models.UploadedExcelFileResponse.model_validate(db_file)
         response_list.append(api_response_item)
-    return response_list
\ No newline at end of file
+    return response_list
+
+@router.get("/cache/stats")
+async def dataframe_cache_stats_route(
+    current_user: DBUser = Depends(get_current_active_user)
+):
+    # Hit/miss/eviction counters of this worker's in-process DataFrame cache
+    return dataframe_cache.stats()
+
+
+@router.get("/llm/stats")
+async def llm_dispatch_stats_route(
+    current_user: DBUser = Depends(get_current_active_user)
+):
+    # Circuit state and hedge delay per LLM provider, for this worker
+    return llm_dispatcher.stats()
@@ -0,0 +1,357 @@
+# app/excel/sql_backend.py
+import logging
+import re
+import threading
+from pathlib import Path
+from typing import Dict, List, Any, Optional, Tuple, Iterator
+import pandas as pd
+import pyarrow as pa
+from app.core.config import settings
+from app.excel import columnar
+from app.excel.filter_plan import RANGE_OPERATORS, NULL_OPERATORS, _to_datetime64, _to_number, _looks_numeric
+
+try:
+    import duckdb # Optional: without it every file is filtered in memory with pandas
+except ImportError:
+    duckdb = None
+
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+EXECUTION_BACKEND = settings.FILTER_EXECUTION_BACKEND.lower()
+SQL_BACKEND_MIN_BYTES = settings.FILTER_SQL_BACKEND_MIN_BYTES
+DUCKDB_TEMP_DIR = Path(settings.DUCKDB_TEMP_DIR)
+SQL_SOURCE_SUFFIXES = (columnar.COLUMNAR_SUFFIX, ".csv") # DuckDB reads these without loading them into memory
+# CSV columns are typed like pd.read_csv would: no date detection, dates stay text
+_CSV_TYPE_CANDIDATES = "['BOOLEAN', 'BIGINT', 'DOUBLE', 'VARCHAR']"
+_CSV_SQL_TYPES = {pa.bool_(): "BOOLEAN", pa.int64(): "BIGINT", pa.float64(): "DOUBLE"} # Anything else is read as VARCHAR
+_DATE_PREFIX_REGEX = r'^\d{4}-\d{2}-\d{2}'
+_COMPARISONS = {"greater_than": ">", "less_than": "<", "greater_than_or_equal_to": ">=", "less_than_or_equal_to": "<="}
+
+_warned_missing = threading.Event()
+
+
+def sql_backend_available() -> bool:
+    if duckdb is None and EXECUTION_BACKEND != "pandas" and not _warned_missing.is_set():
+        _warned_missing.set()
+        logger.warning("duckdb is not installed, large files are filtered in memory with pandas.")
+    return duckdb is not None
+
+
+def is_large_file(file_size_bytes: Optional[int]) -> bool:
+    """Files this large are not parsed into memory at all: DuckDB or the chunked filter reads them from disk."""
+    return EXECUTION_BACKEND != "pandas" and (file_size_bytes or 0) >= SQL_BACKEND_MIN_BYTES > 0
+
+
+def use_sql_backend(file_size_bytes: Optional[int], source_path: Optional[str]) -> bool:
+    """Whether a file is filtered with DuckDB: FILTER_EXECUTION_BACKEND, the file size and the source format decide."""
+    if EXECUTION_BACKEND not in ("auto", "duckdb") or not source_path or Path(source_path).suffix.lower() not in SQL_SOURCE_SUFFIXES:
+        return False
+    if EXECUTION_BACKEND == "duckdb" or is_large_file(file_size_bytes):
+        return sql_backend_available()
+    return False
+
+
+def _fetch_arrow(cursor) -> pa.Table:
+    result = cursor.arrow() # A table in older DuckDB releases, a record batch reader in newer ones
+    return result.read_all() if isinstance(result, pa.RecordBatchReader) else result
+
+
+def quote_identifier(name: str) -> str:
+    return '"' + str(name).replace('"', '""') + '"'
+
+
+def _sql_string(text: str) -> str:
+    return "'" + str(text).replace("'", "''") + "'"
+
+
+def _py(value: Any) -> Any:
+    """Plain Python scalar for a DuckDB parameter (NumPy scalars and datetime64 included)."""
+    if hasattr(value, "dtype") and getattr(value.dtype, "kind", "") == "M":
+        return pd.Timestamp(value).to_pydatetime()
+    return value.item() if hasattr(value, "item") else value
+
+
+class SQLColumn:
+    """SQL counterpart of filter_plan.ColumnArtifacts: the column's kind and its typed SQL expressions."""
+
+    def __init__(self, name: str, arrow_type: pa.DataType, source: "SQLSource"):
+        self.name = name
+        self.arrow_type = arrow_type
+        self.source = source
+        self.ident = quote_identifier(name)
+        if pa.types.is_timestamp(arrow_type) or pa.types.is_date(arrow_type):
+            self.kind = "datetime"
+        elif pa.types.is_integer(arrow_type) or pa.types.is_floating(arrow_type) or pa.types.is_decimal(arrow_type) or pa.types.is_boolean(arrow_type):
+            self.kind = "numeric" # pandas counts bool as numeric too
+        else:
+            self.kind = "other"
+        self.tz = getattr(arrow_type, "tz", None)
+        self.is_text = pa.types.is_string(arrow_type) or pa.types.is_large_string(arrow_type)
+        self._looks_like_dates: Optional[bool] = None
+
+    def numeric(self) -> str:
+        if self.kind == "numeric":
+            return f"CAST({self.ident} AS DOUBLE)" if pa.types.is_boolean(self.arrow_type) else self.ident
+        return f"TRY_CAST({self.ident} AS DOUBLE)"
+
+    def datetime(self) -> str:
+        """Naive UTC timestamps, like ColumnArtifacts.datetime()."""
+        if self.tz is not None:
+            return f"CAST(timezone('UTC', {self.ident}) AS TIMESTAMP)"
+        if self.kind == "datetime":
+            return f"CAST({self.ident} AS TIMESTAMP)"
+        # Via TIMESTAMPTZ: a plain TIMESTAMP cast drops the UTC offset of "2024-06-01 08:00:00+08:00"
+        return f"CAST(timezone('UTC', TRY_CAST({self.ident} AS TIMESTAMPTZ)) AS TIMESTAMP)"
+
+    def strings(self) -> str:
+        if pa.types.is_boolean(self.arrow_type):
+            # str(True) is 'True'; DuckDB's VARCHAR cast would give 'true'
+            return f"CASE WHEN {self.ident} THEN 'True' WHEN NOT {self.ident} THEN 'False' END"
+        return self.ident if self.is_text else f"CAST({self.ident} AS VARCHAR)"
+
+    def looks_like_dates(self) -> bool:
+        if self._looks_like_dates is None:
+            row = self.source.connection.execute(
+                f"SELECT 1 FROM source WHERE regexp_matches({self.strings()}, ?) LIMIT 1", [_DATE_PREFIX_REGEX]).fetchone()
+            self._looks_like_dates = row is not None
+        return self._looks_like_dates
+
+
+class SQLSource:
+    """A DuckDB connection with the file exposed as the view "source", column names normalized."""
+
+    def __init__(self, source_path: str):
+        from app.excel.processing import normalize_column_names # processing imports this module
+        DUCKDB_TEMP_DIR.mkdir(parents=True, exist_ok=True)
+        self.connection = duckdb.connect(database=":memory:", config={
+            "memory_limit": settings.DUCKDB_MEMORY_LIMIT,
+            "temp_directory": str(DUCKDB_TEMP_DIR), # Operators that outgrow memory_limit spill here
+            "threads": settings.DUCKDB_THREADS,
+            "preserve_insertion_order": True, # Same row order as the pandas backend
+        })
+        self.connection.execute("SET TimeZone = 'UTC'") # Text dates without an offset are UTC, as pd.to_datetime reads them
+        path = Path(source_path)
+        if path.suffix.lower() == columnar.COLUMNAR_SUFFIX:
+            # Memory-mapped Arrow table: DuckDB scans the mapping, nothing is copied into the heap
+            table = columnar.open_columnar_table(source_path)
+            self.connection.register("source", table)
+            schema = table.schema
+        else:
+            # Types are sniffed over the whole file (pd.read_csv sees every row too: a code column
+            # that turns into "A3" after the sniffer's sample must stay text), then pinned so
+            # queries on the view do not sniff again
+            csv_path = _sql_string(path.resolve())
+            sniff = f"read_csv({csv_path}, header = true, sample_size = -1, auto_type_candidates = {_CSV_TYPE_CANDIDATES})"
+            raw_schema = self.connection.execute(f"SELECT * FROM {sniff} LIMIT 0").arrow().schema
+            types = ", ".join(f"{_sql_string(field.name)}: '{_CSV_SQL_TYPES.get(field.type, 'VARCHAR')}'" for field in raw_schema)
+            raw_view = f"read_csv({csv_path}, header = true, types = {{{types}}})"
+            # Header names as pd.read_csv gives them (it renames repeats "a.1", DuckDB "a_1"), by position
+            names = normalize_column_names(pd.read_csv(path, nrows=0).columns)
+            select_list = ", ".join(f"{quote_identifier(field.name)} AS {quote_identifier(name)}" for field, name in zip(raw_schema, names))
+            self.connection.execute(f"CREATE VIEW source AS SELECT {select_list} FROM {raw_view}")
+            schema = self.connection.execute("SELECT * FROM source LIMIT 0").arrow().schema
+        self.columns: Dict[str, SQLColumn] = {field.name: SQLColumn(field.name, field.type, self) for field in schema}
+        self.nan_nulls = path.suffix.lower() != columnar.COLUMNAR_SUFFIX
+
+    def is_null_cell(self, value: Any) -> bool:
+        """Whether value is the null pandas holds in the text cells of this file when loaded."""
+        if self.nan_nulls:
+            return isinstance(value, float) and value != value
+        return value is None
+
+    def close(self) -> None:
+        self.connection.close()
+
+
+def _range_predicate(column: SQLColumn, op: str, val: Any) -> Tuple[str, List[Any], str]:
+    if op in ("between", "not_between"):
+        if not (isinstance(val, list) and len(val) == 2):
+            raise ValueError("'between' 值应为列表[min, max]")
+        bounds = val
+    else:
+        bounds = [val]
+
+    text_dates = column.kind == "other" and all(isinstance(b, str) for b in bounds) and column.looks_like_dates()
+    if column.kind == "datetime" or text_dates:
+        expression, typed = column.datetime(), [_py(_to_datetime64(b, column.tz)) for b in bounds]
+        value_type = "datetime"
+    elif column.kind == "numeric" or all(_looks_numeric(b) for b in bounds):
+        expression, typed = column.numeric(), [_py(_to_number(b)) for b in bounds]
+        value_type = "numeric"
+    elif column.is_text and all(isinstance(b, str) for b in bounds):
+        expression, typed = column.ident, bounds # Uncoerced text comparison; nulls never match
+        value_type = "raw"
+    else:
+        return "FALSE", [], "raw" # pandas cannot order text against other types either
+
+    if op in ("between", "not_between"):
+        return f"{expression} BETWEEN ? AND ?", typed, value_type
+    return f"{expression} {_COMPARISONS[op]} ?", typed, value_type
+
+
+def _in_list(expression: str, candidates: List[Any]) -> str:
+    return f"{expression} IN ({', '.join('?' for _ in candidates)})" if candidates else "FALSE"
+
+
+def _equality_predicate(column: SQLColumn, val: Any) -> Tuple[str, List[Any], str]:
+    if column.kind == "numeric" and not isinstance(val, bool):
+        try:
+            return f"{column.numeric()} = ?", [_py(_to_number(val))], "numeric"
+        except ValueError:
+            pass
+    if column.kind == "datetime":
+        try:
+            return f"{column.datetime()} = ?", [_py(_to_datetime64(val, column.tz))], "datetime"
+        except ValueError:
+            pass
+    if isinstance(val, str) or column.kind != "other":
+        return f"{column.strings()} = ?", [str(val)], "string"
+    if column.is_text:
+        return "FALSE", [], "raw" # A non-text value never equals a text cell
+    return f"{column.ident} = ?", [_py(val)], "raw"
+
+
+def _membership_predicate(column: SQLColumn, val: Any) -> Tuple[str, List[Any], str]:
+    candidates = val if isinstance(val, list) else [val]
+    if column.kind in ("numeric", "datetime"):
+        typed = []
+        for candidate in candidates:
+            try:
+                typed.append(_py(_to_number(candidate)) if column.kind == "numeric" else _py(_to_datetime64(candidate, column.tz)))
+            except ValueError:
+                pass # Cannot equal any value of the column
+        expression = column.numeric() if column.kind == "numeric" else column.datetime()
+        return _in_list(expression, typed), typed, column.kind
+    # isin matches a null candidate only against the same kind of null: None for text read from the
+    # columnar copy, NaN for text pd.read_csv read
+    matches_null = any(column.source.is_null_cell(candidate) for candidate in candidates)
+    present = [c for c in candidates if not (c is None or (isinstance(c, float) and c != c)) and (isinstance(c, str) or not column.is_text)]
+    clause = _in_list(column.ident, present)
+    if matches_null:
+        clause = f"({clause} OR {column.ident} IS NULL)"
+    return clause, [_py(c) for c in present], "raw"
+
+
+def _contains_predicate(column: SQLColumn, val: Any, use_regex: bool) -> Tuple[str, List[Any], str]:
+    if use_regex:
+        try:
+            re.compile(str(val))
+        except re.error as e:
+            raise ValueError(f"无效的正则表达式: {e}")
+        return f"regexp_matches({column.strings()}, ?, 'i')", [str(val)], "regex"
+    return f"contains(lower({column.strings()}), ?)", [str(val).casefold()], "string"
+
+
+def build_where_clause(parsed_conditions: Dict, columns: Dict[str, SQLColumn]) -> Tuple[str, List[Any], List[Dict[str, Any]], List[int]]:
+    """
+    Translates parsed conditions into a parameterized WHERE clause with the semantics of
+    apply_dynamic_filters. Returns (where_sql, params, predicates, skipped): values are only ever
+    bound as parameters, column names are quoted identifiers of existing columns.
+    """
+    logical_op = str(parsed_conditions.get("logical_operator", "AND")).upper()
+    if logical_op not in ("AND", "OR"):
+        logger.warning(f"Unknown logical operator '{logical_op}', defaulting to AND.")
+        logical_op = "AND"
+
+    clauses: List[str] = []
+    params: List[Any] = []
+    predicates: List[Dict[str, Any]] = []
+    skipped: List[int] = []
+    for condition_idx, condition in enumerate(parsed_conditions.get("filters", [])):
+        col, op, val = condition.get("column"), condition.get("operator"), condition.get("value")
+        if not col or not op or col not in columns:
+            logger.warning(f"跳过无效或不完整的筛选条件 (索引 {condition_idx}): {condition}")
+            skipped.append(condition_idx)
+            continue
+        if op not in NULL_OPERATORS and val is None:
+            logger.warning(f"Skipping filter condition (索引 {condition_idx}) due to missing 'value' for operator '{op}': {condition}")
+            skipped.append(condition_idx)
+            continue
+        if op in ("equals", "not_equals") and isinstance(val, list):
+            op = "in" if op == "equals" else "not_in"
+
+        column = columns[col]
+        try:
+            if op in RANGE_OPERATORS:
+                clause, clause_params, value_type = _range_predicate(column, op, val)
+            elif op in ("equals", "not_equals"):
+                clause, clause_params, value_type = _equality_predicate(column, val)
+            elif op in ("in", "not_in"):
+                clause, clause_params, value_type = _membership_predicate(column, val)
+            elif op in ("contains", "not_contains"):
+                clause, clause_params, value_type = _contains_predicate(column, val, use_regex=condition.get("regex") is True)
+            elif op in NULL_OPERATORS:
+                clause, clause_params, value_type = f"{column.ident} IS NULL", [], "null"
+            else:
+                logger.warning(f"未知操作符 (索引 {condition_idx}) '{op}'，跳过条件。")
+                skipped.append(condition_idx)
+                continue
+        except (ValueError, TypeError) as e:
+            # Like filter_plan.FailedKernel: the condition matches no rows, whatever its negation
+            logger.warning(f"筛选值或列类型不匹配 (索引 {condition_idx}, 列 '{col}', 操作 '{op}', 值 '{val}'): {e}. This condition matches no rows.")
+            clauses.append("FALSE")
+            predicates.append({"index": condition_idx, "column": col, "operator": op, "value_type": "failed"})
+            continue
+        # Comparisons with NULL are unknown in SQL; pandas treats them as False, so negations keep nulls
+        clause = f"COALESCE({clause}, FALSE)"
+        if op in ("not_between", "not_equals", "not_in", "not_contains", "is_not_null"):
+            clause = f"NOT {clause}"
+        clauses.append(clause)
+        params.extend(clause_params)
+        predicates.append({"index": condition_idx, "column": col, "operator": op, "value_type": value_type})
+
+    if not clauses:
+        return ("TRUE" if logical_op == "AND" else "FALSE"), [], predicates, skipped
+    return f" {logical_op} ".join(f"({clause})" for clause in clauses), params, predicates, skipped
+
+
+def _where_for(source: SQLSource, parsed_conditions: Dict) -> Tuple[str, List[Any], List[Dict[str, Any]], List[int]]:
+    if not parsed_conditions or not parsed_conditions.get("filters"):
+        return "TRUE", [], [], []
+    return build_where_clause(parsed_conditions, source.columns)
+
+
+def filter_file_with_plan(source_path: str, parsed_conditions: Dict) -> Tuple[pd.DataFrame, Optional[Dict[str, Any]]]:
+    """
+    apply_dynamic_filters_with_plan for files that are not loaded into memory: the conditions run
+    as one parameterized query in DuckDB, which scans the columnar copy (or the CSV itself) and
+    spills to DUCKDB_TEMP_DIR beyond DUCKDB_MEMORY_LIMIT. Only the matching rows become a DataFrame.
+    """
+    source = SQLSource(source_path)
+    try:
+        where_sql, params, predicates, skipped = _where_for(source, parsed_conditions)
+        logger.debug(f"DuckDB filter on {source_path}: WHERE {where_sql} {params}")
+        try:
+            result = _fetch_arrow(source.connection.execute(f"SELECT * FROM source WHERE {where_sql}", params))
+        except duckdb.Error as e:
+            logger.error(f"DuckDB filter failed on {source_path}: {e}", exc_info=True)
+            raise ValueError(f"Error filtering data file with DuckDB: {e}")
+    finally:
+        source.close()
+    df = result.to_pandas()
+    plan_info = {
+        "backend": "duckdb",
+        "logical_operator": str((parsed_conditions or {}).get("logical_operator", "AND")).upper(),
+        "where": where_sql,
+        "predicates": predicates,
+        "skipped": skipped,
+        "matched_rows": len(df),
+    }
+    return df, plan_info
+
+
+def iter_filter_file(source_path: str, parsed_conditions: Dict, batch_rows: int) -> Iterator[pd.DataFrame]:
+    """Like filter_file_with_plan, but yields the matching rows batch_rows at a time as DuckDB produces them."""
+    source = SQLSource(source_path)
+    try:
+        where_sql, params, _, _ = _where_for(source, parsed_conditions)
+        try:
+            reader = source.connection.execute(f"SELECT * FROM source WHERE {where_sql}", params).fetch_record_batch(batch_rows)
+            for batch in reader:
+                yield batch.to_pandas()
+        except duckdb.Error as e:
+            logger.error(f"DuckDB filter failed on {source_path}: {e}", exc_info=True)
+            raise ValueError(f"Error filtering data file with DuckDB: {e}")
+    finally:
+        source.close()
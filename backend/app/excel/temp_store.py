@@ -3,11 +3,14 @@ import logging
 import uuid
 import time
 import shutil
-from typing import Dict, Any, Optional
+from typing import Dict, Any, Optional, Tuple
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 import threading
 from pathlib import Path
 from app.core.config import settings # For base directory configuration
+from app.excel import columnar
 
 # --- Configuration ---
 # Use a dedicated directory for temporary query results
@@ -18,8 +21,10 @@ TEMP_RESULTS_DIR = BASE_DATA_DIR / TEMP_RESULTS_DIR_NAME
 TEMP_RESULTS_DIR.mkdir(parents=True, exist_ok=True)
 
 RESULTS_METADATA_TTL_SECONDS = 60 * 60  # 1 hour for metadata and temp file lifetime
+# A page read decodes only the row groups it overlaps, so this bounds the work per page
+RESULT_ROW_GROUP_ROWS = settings.QUERY_RESULT_ROW_GROUP_ROWS
 
-# Metadata structure: {result_id: {"filepath": Path, "timestamp": float, "query_params": dict}}
+# Metadata structure: {result_id: {"filepath": Path, "timestamp": float, "query_params": dict, "total_rows": int}}
 _results_metadata_store: Dict[str, Dict[str, Any]] = {}
 _metadata_lock = threading.Lock()
 
@@ -29,35 +34,41 @@ def generate_result_id() -> str:
     return str(uuid.uuid4())
 
 def store_query_result_as_file(query_params: Dict[str, Any], results_df: pd.DataFrame) -> Optional[str]:
+    periodic_cleanup_expired_results() # Sweep old results as new ones come in
     result_id = generate_result_id()
     # Sanitize query or use part of original filename for a slightly more readable temp filename
     # For simplicity, just use result_id for the filename.
     temp_filename = f"{result_id}.parquet"
     temp_filepath = TEMP_RESULTS_DIR / temp_filename
+    tmp_filepath = temp_filepath.with_name(f".{temp_filename}.tmp")
 
     try:
-        results_df.to_parquet(temp_filepath, index=False)
+        # Same Arrow conversion as the columnar copies, so mixed-type columns are stored as strings
+        table = columnar.dataframe_to_arrow_table(results_df)
+        pq.write_table(table, tmp_filepath, row_group_size=RESULT_ROW_GROUP_ROWS)
+        tmp_filepath.replace(temp_filepath) # Readers never see a partial file
         with _metadata_lock:
             _results_metadata_store[result_id] = {
                 "filepath": temp_filepath,
                 "timestamp": time.time(),
-                "query_params": query_params
+                "query_params": query_params,
+                "total_rows": table.num_rows
             }
-        logger.info(f"Stored query result {result_id} to {temp_filepath}")
+        logger.info(f"Stored query result {result_id} ({table.num_rows} rows) to {temp_filepath}")
         return result_id
     except Exception as e:
         logger.error(f"Failed to store query result {result_id} to file {temp_filepath}: {e}", exc_info=True)
         # Attempt to clean up partial file if it exists
-        if temp_filepath.exists():
-            try:
-                temp_filepath.unlink()
-            except OSError:
-                logger.error(f"Could not remove partial temp file {temp_filepath}", exc_info=True)
+        for partial_path in (tmp_filepath, temp_filepath):
+            if partial_path.exists():
+                try:
+                    partial_path.unlink()
+                except OSError:
+                    logger.error(f"Could not remove partial temp file {partial_path}", exc_info=True)
         return None
 
 
-def get_query_result_from_file(result_id: str) -> Optional[pd.DataFrame]:
-    metadata = None
+def _live_metadata(result_id: str) -> Optional[Dict[str, Any]]:
     with _metadata_lock:
         metadata = _results_metadata_store.get(result_id)
 
@@ -69,6 +80,13 @@ def get_query_result_from_file(result_id: str) -> Optional[pd.DataFrame]:
         logger.info(f"Result {result_id} has expired. Cleaning up.")
         cleanup_single_result(result_id) # Cleans up metadata and file
         return None
+    return metadata
+
+
+def get_query_result_from_file(result_id: str) -> Optional[pd.DataFrame]:
+    metadata = _live_metadata(result_id)
+    if not metadata:
+        return None
 
     try:
         df = pd.read_parquet(metadata["filepath"])
@@ -81,19 +99,39 @@ def get_query_result_from_file(result_id: str) -> Optional[pd.DataFrame]:
         return None
 
 
-def get_query_params_for_result(result_id: str) -> Optional[Dict[str, Any]]:
-    with _metadata_lock:
-        metadata = _results_metadata_store.get(result_id)
-        if metadata:
-            if (time.time() - metadata["timestamp"]) < RESULTS_METADATA_TTL_SECONDS:
-                return metadata["query_params"]
-            else:
-                # Expired, remove it (metadata only, file cleanup handled by get_query_result or periodic cleanup)
-                # Actually, better to have cleanup_single_result handle both
-                cleanup_single_result(result_id)
-                return None
+def get_query_result_page(result_id: str, offset: int, limit: int) -> Optional[Tuple[pa.Table, int]]:
+    """
+    Rows [offset, offset + limit) of a stored result and its total row count. Only the row groups
+    overlapping the range are read from the Parquet file.
+    """
+    metadata = _live_metadata(result_id)
+    if not metadata:
         return None
 
+    try:
+        parquet_file = pq.ParquetFile(metadata["filepath"])
+        end = offset + limit
+        row_groups, first_group_start, group_start = [], None, 0
+        for index in range(parquet_file.num_row_groups):
+            group_end = group_start + parquet_file.metadata.row_group(index).num_rows
+            if group_start < end and group_end > offset:
+                row_groups.append(index)
+                if first_group_start is None:
+                    first_group_start = group_start
+            group_start = group_end
+        if not row_groups: # Past the end
+            return parquet_file.schema_arrow.empty_table(), metadata["total_rows"]
+        table = parquet_file.read_row_groups(row_groups)
+        return table.slice(offset - first_group_start, limit), metadata["total_rows"]
+    except Exception as e:
+        logger.error(f"Failed to read page of query result {result_id} from file {metadata['filepath']}: {e}", exc_info=True)
+        return None
+
+
+def get_query_params_for_result(result_id: str) -> Optional[Dict[str, Any]]:
+    metadata = _live_metadata(result_id)
+    return metadata["query_params"] if metadata else None
+
 def cleanup_single_result(result_id: str):
     """Removes metadata and the associated temporary file."""
     with _metadata_lock:
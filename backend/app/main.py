@@ -1,9 +1,12 @@
+import asyncio
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
 # Import domain-specific routers
 from app.users import routes as user_api_router
 from app.excel import routes as excel_api_router
+from app.excel.llm_client import llm_client
+from app.excel.processing import preload_ollama_model, should_preload_ollama
 
 # Import database setup
 from app.database.setup import create_db_and_tables, engine
@@ -52,6 +55,17 @@ def on_startup():
             print(f"Error during startup data initialization: {e}")
             session.rollback()
 
+@app.on_event("startup")
+async def warm_up_llm():
+    # Load the local model in the background; startup does not wait for it
+    if should_preload_ollama():
+        app.state.ollama_preload_task = asyncio.create_task(preload_ollama_model())
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    # Close the pooled keep-alive connections to the LLM providers
+    await llm_client.aclose()
+
 # Include domain-specific routers
 app.include_router(user_api_router.router, prefix="/api/v1/users", tags=["User Management & Authentication"])
 app.include_router(excel_api_router.router, prefix="/api/v1/excel", tags=["Excel Data Processing"])
@@ -0,0 +1,85 @@
+# test/bench_result_serializer.py
+
+import sys
+import json
+import time
+import argparse
+from pathlib import Path
+import logging
+
+# Add project root to Python path to allow importing app modules
+project_root = Path(__file__).resolve().parent.parent
+sys.path.append(str(project_root))
+
+import numpy as np
+import pandas as pd
+
+from app.excel import models as excel_models, result_serializer
+
+logging.basicConfig(level=logging.INFO, format='%(levelname)s: %(message)s')
+logger = logging.getLogger(__name__)
+
+DEFAULT_ROW_COUNTS = [10_000, 100_000, 1_000_000]
+
+
+def make_frame(rows: int) -> pd.DataFrame:
+    """A typical query result: ids, amounts with gaps, text, a flag and timestamps with NaT."""
+    rng = np.random.default_rng(42)
+    df = pd.DataFrame({
+        "order_id": np.arange(rows),
+        "amount": rng.integers(0, 1000, rows),
+        "price": rng.normal(100, 25, rows).round(2),
+        "city": rng.choice(["上海", "北京", "Shenzhen", 'Hang "zhou"', None], rows),
+        "paid": rng.choice([True, False], rows),
+        "ordered_at": pd.to_datetime(rng.integers(1_600_000_000, 1_700_000_000, rows), unit="s"),
+    })
+    df.loc[::10, "price"] = np.nan
+    df.loc[::17, "ordered_at"] = pd.NaT
+    return df
+
+
+def legacy_body(df: pd.DataFrame) -> bytes:
+    """The previous /query path: per-cell isoformat, replace, to_dict and a validated response model."""
+    df_for_json = df.copy()
+    for col_name in df_for_json.select_dtypes(include=['datetime64[ns]', 'datetime64[ns, UTC]', 'datetimetz']):
+        df_for_json[col_name] = df_for_json[col_name].apply(lambda x: x.isoformat() if pd.notnull(x) else None)
+    df_for_json = df_for_json.replace({np.nan: None, pd.NaT: None})
+    response = excel_models.QueryExecutionResponse(
+        query="bench", parsed_conditions={}, results=df_for_json.to_dict('records'), source_files=["bench.xlsx"]
+    )
+    return response.model_dump_json().encode("utf-8")
+
+
+def serializer_body(df: pd.DataFrame) -> bytes:
+    response = excel_models.QueryExecutionResponse(query="bench", parsed_conditions={}, results=[], source_files=["bench.xlsx"])
+    return result_serializer.response_json_with_rows(response, "results", df)
+
+
+def timed(func, df: pd.DataFrame, repeats: int):
+    best, body = float("inf"), b""
+    for _ in range(repeats):
+        start = time.perf_counter()
+        body = func(df)
+        best = min(best, time.perf_counter() - start)
+    return best, body
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the legacy and the Arrow-based /query JSON serialization.")
+    parser.add_argument("rows", nargs="*", type=int, default=DEFAULT_ROW_COUNTS)
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+
+    logger.info(f"{'rows':>10} {'legacy s':>10} {'arrow s':>10} {'speedup':>8} {'MB':>8}")
+    for rows in args.rows:
+        df = make_frame(rows)
+        legacy_seconds, legacy = timed(legacy_body, df, args.repeats)
+        new_seconds, new = timed(serializer_body, df, args.repeats)
+        if json.loads(legacy) != json.loads(new):
+            logger.error(f"Outputs differ for {rows} rows")
+            sys.exit(1)
+        logger.info(f"{rows:>10} {legacy_seconds:>10.3f} {new_seconds:>10.3f} {legacy_seconds / new_seconds:>7.1f}x {len(new) / 1e6:>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
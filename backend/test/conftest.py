@@ -0,0 +1,22 @@
+# test/conftest.py
+
+import sys
+from pathlib import Path
+
+# Add project root to Python path to allow importing app modules
+project_root = Path(__file__).resolve().parent.parent
+sys.path.append(str(project_root))
+
+import pytest
+
+from app.excel import columnar, parse_cache, sql_backend
+
+
+@pytest.fixture(autouse=True)
+def isolated_data_dirs(tmp_path, monkeypatch):
+    # Columnar copies, the parse cache and DuckDB spill files go to the test's tmp_path, never to data/
+    monkeypatch.setattr(columnar, "COLUMNAR_FILES_DIR", tmp_path / "columnar_files")
+    (tmp_path / "columnar_files").mkdir()
+    monkeypatch.setattr(parse_cache.parsed_conditions_cache, "db_path", tmp_path / "llm_parse_cache.sqlite3")
+    monkeypatch.setattr(parse_cache.parsed_conditions_cache, "_conn", None)
+    monkeypatch.setattr(sql_backend, "DUCKDB_TEMP_DIR", tmp_path / "duckdb_tmp")
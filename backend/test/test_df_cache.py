@@ -0,0 +1,89 @@
+# test/test_df_cache.py
+
+import sys
+from pathlib import Path
+
+# Add project root to Python path to allow importing app modules
+project_root = Path(__file__).resolve().parent.parent
+sys.path.append(str(project_root))
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from app.excel import filter_plan
+from app.excel.df_cache import DataFrameCache, dataframe_nbytes
+
+
+def _frame(rows: int = 1000) -> pd.DataFrame:
+    return pd.DataFrame({
+        "amount": np.arange(rows),
+        "city": np.array(["Shanghai", "Beijing"] * (rows // 2), dtype=object),
+        "price": pd.array(np.arange(rows) * 1.5, dtype="double[pyarrow]"),
+    })
+
+
+@pytest.mark.filterwarnings("ignore::pandas.errors.SettingWithCopyWarning")
+def test_cached_frame_cannot_be_changed_through_a_served_view():
+    df = _frame()
+    cache = DataFrameCache(max_bytes=10 * dataframe_nbytes(df))
+    view = cache.put((1, 0, 0), df)
+
+    with pytest.raises(ValueError):
+        view.loc[0, "amount"] = -1
+    with pytest.raises(ValueError):
+        series = view["amount"]
+        series.iloc[0] = -1
+    other = cache.get((1, 0, 0))
+    other.loc[0, "price"] = -1.0 # Arrow column: only this view's array is replaced
+
+    served = cache.get((1, 0, 0))
+    assert served["amount"].iloc[0] == 0
+    assert served["price"].iloc[0] == 0.0
+    assert not pd.options.mode.copy_on_write # The cache does not change process-wide pandas options
+
+
+@pytest.mark.filterwarnings("ignore::pandas.errors.SettingWithCopyWarning")
+def test_extension_columns_cannot_be_changed_through_a_served_view():
+    df = pd.DataFrame({
+        "ordered_at": pd.to_datetime(["2024-01-01", "2024-01-02"]).tz_localize("Asia/Shanghai"),
+        "quantity": pd.array([1, None], dtype="Int64"),
+        "paid": pd.array([True, None], dtype="boolean"),
+        "grade": pd.Categorical(["a", "b"]),
+    })
+    cache = DataFrameCache(max_bytes=100 * dataframe_nbytes(df))
+    view = cache.put((1, 0, 0), df)
+
+    view.loc[0, "ordered_at"] = pd.Timestamp("2020-01-01", tz="Asia/Shanghai")
+    view.loc[0, "quantity"] = 99
+    view.loc[0, "paid"] = False
+    view.loc[0, "grade"] = "b"
+    series = view["quantity"]
+    series.iloc[1] = 7
+
+    served = cache.get((1, 0, 0))
+    assert served["ordered_at"].iloc[0] == pd.Timestamp("2024-01-01", tz="Asia/Shanghai")
+    assert served["quantity"].iloc[0] == 1 and pd.isna(served["quantity"].iloc[1])
+    assert bool(served["paid"].iloc[0]) is True
+    assert served["grade"].iloc[0] == "a"
+
+
+def test_filter_artifacts_are_shared_by_views_and_charged_to_the_entry():
+    df = _frame()
+    cache = DataFrameCache(max_bytes=10 * dataframe_nbytes(df))
+    first, second = cache.put((1, 0, 0), df), cache.get((1, 0, 0))
+    assert filter_plan.get_dataset_artifacts(first) is filter_plan.get_dataset_artifacts(second)
+
+    filter_plan.get_dataset_artifacts(second).column("city").strings()
+    stats = cache.stats()
+    assert stats["artifact_bytes"] > 0
+    assert stats["current_bytes"] == dataframe_nbytes(df) + stats["artifact_bytes"]
+
+
+def test_artifacts_beyond_the_budget_evict_the_entry():
+    df = _frame()
+    cache = DataFrameCache(max_bytes=dataframe_nbytes(df) + 100)
+    view = cache.put((1, 0, 0), df)
+    filter_plan.get_dataset_artifacts(view).column("city").strings()
+    assert cache.stats()["entries"] == 0
+    assert cache.stats()["current_bytes"] == 0
@@ -0,0 +1,39 @@
+# test/test_export_stream.py
+
+import io
+import sys
+from pathlib import Path
+
+# Add project root to Python path to allow importing app modules
+project_root = Path(__file__).resolve().parent.parent
+sys.path.append(str(project_root))
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from app.excel import export_stream, result_stream
+
+
+def test_parquet_download_keeps_columns_that_change_kind_between_batches():
+    df = pd.DataFrame({
+        "code": pd.Series([1, 2, 3, 4, 5, "A3", 7], dtype=object), # Numbers in the first batch, text in the second
+        "amount": pd.Series([1, 2, 3, 4, 5, 6.5, None], dtype=object),
+        "note": pd.Series([None] * 5 + ["x", None], dtype=object),
+        "paid": [True] * 7,
+    })
+    batches = result_stream.frame_batches(df, 5)
+    body = b"".join(export_stream.parquet_download_stream(list(df.columns), batches, export_stream.object_column_types(df)))
+
+    table = pq.read_table(io.BytesIO(body))
+    assert table.schema.field("code").type == pa.string()
+    assert table.schema.field("amount").type == pa.float64()
+    assert table.column("code").to_pylist() == ["1", "2", "3", "4", "5", "A3", "7"]
+    assert table.column("amount").to_pylist() == [1.0, 2.0, 3.0, 4.0, 5.0, 6.5, None]
+    assert table.column("note").to_pylist() == [None] * 5 + ["x", None]
+    assert table.num_rows == len(df)
+
+
+def test_text_column_types_follow_the_profile():
+    columns_info = {"code": {"dtype": "object"}, "amount": {"dtype": "int64"}}
+    assert export_stream.text_column_types(columns_info) == {"code": pa.string()}
@@ -0,0 +1,55 @@
+# test/test_fast_parser.py
+
+import sys
+from pathlib import Path
+
+# Add project root to Python path to allow importing app modules
+project_root = Path(__file__).resolve().parent.parent
+sys.path.append(str(project_root))
+
+import pytest
+
+from app.core.config import settings
+from app.excel.fast_parser import parse_query_locally
+
+COLUMNS_INFO = {
+    "city": {"dtype": "object", "unique_count": 3, "sample_values": ["北京", "上海"], "top_values": [{"value": "深圳", "count": 10}]},
+    "amount": {"dtype": "int64", "unique_count": 100, "sample_values": ["10", "250"]},
+    "order_date": {"dtype": "object", "unique_count": 30, "sample_values": ["2024-01-05", "2024-03-01"]},
+}
+
+
+@pytest.mark.parametrize("query, expected", [
+    ("amount > 1000", {"column": "amount", "operator": "greater_than", "value": 1000}),
+    ("city = 北京", {"column": "city", "operator": "equals", "value": "北京"}),
+    ("city in (北京, 深圳)", {"column": "city", "operator": "in", "value": ["北京", "深圳"]}),
+    ("city 包含 京", {"column": "city", "operator": "contains", "value": "京"}),
+    ("order date 介于 2024-01-01 和 2024-03-31 之间", {"column": "order_date", "operator": "between", "value": ["2024-01-01", "2024-03-31"]}),
+])
+def test_simple_queries_are_answered_locally(query, expected):
+    parsed, confidence = parse_query_locally(query, COLUMNS_INFO)
+    assert parsed == {"filters": [expected], "logical_operator": "AND"}
+    assert confidence >= settings.FAST_PARSER_MIN_CONFIDENCE
+
+
+@pytest.mark.parametrize("query", [
+    "city = 北京的客户", # Strong operator, but not a value of the column
+    "city in (北京, 火星)",
+    "city 包含 火星",
+    "city 是 火星",
+])
+def test_unknown_text_literals_fall_back_to_the_llm(query):
+    parsed, confidence = parse_query_locally(query, COLUMNS_INFO)
+    assert parsed is not None
+    assert confidence < settings.FAST_PARSER_MIN_CONFIDENCE
+
+
+def test_weak_verb_with_a_known_value_is_trusted():
+    parsed, confidence = parse_query_locally("city 是 上海", COLUMNS_INFO)
+    assert parsed["filters"] == [{"column": "city", "operator": "equals", "value": "上海"}]
+    assert confidence >= settings.FAST_PARSER_MIN_CONFIDENCE
+
+
+@pytest.mark.parametrize("query", ["amount > 1000 and city = 北京 or amount < 5", "销售额最高的城市", "amount > abc"])
+def test_queries_the_rules_do_not_cover_are_not_parsed(query):
+    assert parse_query_locally(query, COLUMNS_INFO) == (None, 0.0)
@@ -0,0 +1,39 @@
+# test/test_filter_plan.py
+
+import sys
+from pathlib import Path
+
+# Add project root to Python path to allow importing app modules
+project_root = Path(__file__).resolve().parent.parent
+sys.path.append(str(project_root))
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from app.excel import filter_plan
+
+
+def _large_rows() -> int:
+    # Frames this large take the dictionary (bitmap) path for equals / in
+    return max(filter_plan.BITMAP_INDEX_MIN_ROWS, 1000)
+
+
+@pytest.mark.parametrize("values", [
+    np.array([True, False, True]),
+    pd.array([True, False, None], dtype="boolean"),
+    np.array([True, False, "x"], dtype=object),
+])
+@pytest.mark.parametrize("candidates", [[True], [False], [True, False], [1], ["True"]])
+@pytest.mark.parametrize("operator", ["in", "not_in"])
+def test_dictionary_membership_matches_isin_on_bool_column(values, candidates, operator):
+    rows = _large_rows()
+    df = pd.DataFrame({"flag": pd.Series(values).repeat(rows // 3 + 1).iloc[:rows].reset_index(drop=True)})
+    artifacts = filter_plan.get_dataset_artifacts(df)
+    plan = filter_plan.compile_filter_plan({"filters": [{"column": "flag", "operator": operator, "value": candidates}]}, artifacts)
+
+    assert isinstance(plan.predicates[0].kernel, filter_plan.DictionaryKernel)
+    expected = df["flag"].isin(candidates).to_numpy()
+    if operator == "not_in":
+        expected = ~expected
+    np.testing.assert_array_equal(filter_plan.execute_filter_plan(plan, artifacts), expected)
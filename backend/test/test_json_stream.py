@@ -0,0 +1,48 @@
+# test/test_json_stream.py
+
+import sys
+from pathlib import Path
+
+# Add project root to Python path to allow importing app modules
+project_root = Path(__file__).resolve().parent.parent
+sys.path.append(str(project_root))
+
+import pytest
+
+from app.excel.json_stream import JSONObjectStreamParser
+
+REPLY = '```json\n{"filters": [{"column": "note", "operator": "contains", "value": "a } \\" {"}], "logical_operator": "AND"}\n```'
+EXPECTED = {"filters": [{"column": "note", "operator": "contains", "value": 'a } " {'}], "logical_operator": "AND"}
+
+
+def _feed_all(parser: JSONObjectStreamParser, fragments):
+    for i, fragment in enumerate(fragments):
+        result = parser.feed(fragment)
+        if result is not None:
+            return result, i
+    return None, None
+
+
+@pytest.mark.parametrize("size", [1, 2, 3, 7, 16])
+def test_object_split_across_chunks_is_returned_once_complete(size):
+    fragments = [REPLY[i:i + size] for i in range(0, len(REPLY), size)]
+    result, index = _feed_all(JSONObjectStreamParser(), fragments)
+    assert result == EXPECTED
+    # Returned on the fragment holding the closing brace, before the trailing fence arrives
+    assert index == (REPLY.rindex("}") // size)
+
+
+def test_objects_without_the_required_key_are_skipped():
+    parser = JSONObjectStreamParser()
+    assert parser.feed('Example: {"note": "no filters here"} and then ') is None
+    assert parser.feed('{"filters": [], "logical_operator": "OR"}') == {"filters": [], "logical_operator": "OR"}
+
+
+def test_unparsable_object_is_skipped():
+    parser = JSONObjectStreamParser()
+    assert parser.feed('{filters: oops} {"filters": []}') == {"filters": []}
+
+
+def test_incomplete_object_returns_nothing():
+    parser = JSONObjectStreamParser()
+    assert _feed_all(parser, ['{"filters": [', '{"column": "a"}']) == (None, None)
@@ -0,0 +1,111 @@
+# test/test_llm_dispatch.py
+
+import asyncio
+import sys
+from pathlib import Path
+
+# Add project root to Python path to allow importing app modules
+project_root = Path(__file__).resolve().parent.parent
+sys.path.append(str(project_root))
+
+import pytest
+from fastapi import HTTPException
+
+from app.excel import llm_dispatch
+from app.excel.llm_dispatch import CircuitBreaker, LLMDispatcher, LLMReplyError
+
+CONDITIONS = {"filters": [], "logical_operator": "AND"}
+
+
+def _answer(delay: float = 0.0, result=CONDITIONS):
+    async def call():
+        await asyncio.sleep(delay)
+        return result
+    return call
+
+
+def _fail(error: BaseException, delay: float = 0.0):
+    async def call():
+        await asyncio.sleep(delay)
+        raise error
+    return call
+
+
+def test_breaker_opens_after_consecutive_failures_and_closes_after_a_good_trial(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(llm_dispatch.time, "monotonic", lambda: now[0])
+    breaker = CircuitBreaker(failure_threshold=2, cooldown_seconds=10)
+
+    breaker.record_failure()
+    assert breaker.state == "closed"
+    breaker.record_failure()
+    assert breaker.state == "open" and not breaker.allow()
+
+    now[0] += 10
+    assert breaker.state == "half_open"
+    assert breaker.allow() and not breaker.allow() # One trial at a time
+    breaker.record_success()
+    assert breaker.state == "closed" and breaker.consecutive_failures == 0
+
+
+def test_failed_half_open_trial_reopens_the_circuit(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(llm_dispatch.time, "monotonic", lambda: now[0])
+    breaker = CircuitBreaker(failure_threshold=1, cooldown_seconds=10)
+    breaker.record_failure()
+    now[0] += 10
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == "open"
+
+
+def test_provider_errors_fail_over_and_count_toward_the_breaker():
+    dispatcher = LLMDispatcher()
+    error = HTTPException(status_code=503, detail="down")
+    result, provider, _ = asyncio.run(dispatcher.dispatch({"a": _fail(error), "b": _answer()}, ["a", "b"]))
+    assert (result, provider) == (CONDITIONS, "b")
+    assert dispatcher.breakers["a"].consecutive_failures == 1
+    assert dispatcher.is_healthy("b") and not dispatcher.is_healthy("a")
+
+
+def test_malformed_replies_never_trip_the_breaker():
+    dispatcher = LLMDispatcher()
+    calls = {"a": _fail(LLMReplyError("not JSON"))}
+    for _ in range(llm_dispatch.CIRCUIT_FAILURE_THRESHOLD + 1):
+        with pytest.raises(LLMReplyError):
+            asyncio.run(dispatcher.dispatch(calls, ["a"]))
+    assert dispatcher.breakers["a"].state == "closed"
+    assert dispatcher.breakers["a"].consecutive_failures == 0
+
+
+def test_hedge_client_error_does_not_cancel_the_running_primary(monkeypatch):
+    monkeypatch.setattr(llm_dispatch, "HEDGE_DEFAULT_DELAY_SECONDS", 0.01)
+    dispatcher = LLMDispatcher()
+    calls = {"a": _answer(delay=0.2), "b": _fail(HTTPException(status_code=400, detail="bad request"))}
+    result, provider, _ = asyncio.run(dispatcher.dispatch(calls, ["a", "b"]))
+    assert (result, provider) == (CONDITIONS, "a")
+
+
+def test_client_error_is_raised_once_nothing_else_is_in_flight(monkeypatch):
+    monkeypatch.setattr(llm_dispatch, "HEDGE_DEFAULT_DELAY_SECONDS", 0.01)
+    dispatcher = LLMDispatcher()
+    calls = {"a": _fail(HTTPException(status_code=503, detail="down"), delay=0.1), "b": _fail(HTTPException(status_code=400, detail="bad request"))}
+    with pytest.raises(HTTPException) as raised:
+        asyncio.run(dispatcher.dispatch(calls, ["a", "b"]))
+    assert raised.value.status_code == 400
+    assert dispatcher.breakers["a"].consecutive_failures == 1 # The primary ran to completion
+    assert dispatcher.breakers["b"].consecutive_failures == 0
+
+
+def test_ollama_is_a_fallback_only_when_enabled_or_seen_healthy(monkeypatch):
+    from app.excel import processing
+    dispatcher = LLMDispatcher()
+    monkeypatch.setattr(processing, "llm_dispatcher", dispatcher)
+    monkeypatch.setattr(processing.settings, "LLM_OLLAMA_FALLBACK_ENABLED", False)
+    assert not processing._provider_usable("ollama", processing.DEFAULT_LLM_CONFIG)
+
+    dispatcher.mark_healthy("ollama")
+    assert processing._provider_usable("ollama", processing.DEFAULT_LLM_CONFIG)
+    monkeypatch.setattr(processing, "llm_dispatcher", LLMDispatcher())
+    monkeypatch.setattr(processing.settings, "LLM_OLLAMA_FALLBACK_ENABLED", True)
+    assert processing._provider_usable("ollama", processing.DEFAULT_LLM_CONFIG)
@@ -0,0 +1,69 @@
+# test/test_parse_cache.py
+
+import sys
+from pathlib import Path
+
+# Add project root to Python path to allow importing app modules
+project_root = Path(__file__).resolve().parent.parent
+sys.path.append(str(project_root))
+
+from app.excel import parse_cache
+from app.excel.parse_cache import ParsedConditionsCache, make_parse_cache_key
+
+COLUMNS_INFO = {"city": {"dtype": "object", "sample_values": ["北京"]}, "amount": {"dtype": "int64", "sample_values": ["10"]}}
+CONDITIONS = {"filters": [{"column": "city", "operator": "equals", "value": "北京"}], "logical_operator": "AND"}
+
+
+def _key(query: str, columns_info=COLUMNS_INFO, provider: str = "siliconflow", model: str = "m", temperature: float = 0.2) -> str:
+    return make_parse_cache_key(query, columns_info, provider, model, temperature)
+
+
+def test_key_ignores_spacing_but_keeps_literal_case():
+    assert _key("city =  北京 ") == _key("city = 北京")
+    assert _key("city = Shanghai") != _key("city = shanghai")
+
+
+def test_key_depends_on_schema_provider_model_temperature_and_version(monkeypatch):
+    base = _key("amount > 10")
+    assert _key("amount > 10", {**COLUMNS_INFO, "amount": {"dtype": "float64"}}) != base
+    assert _key("amount > 10", provider="ollama") != base
+    assert _key("amount > 10", model="other") != base
+    assert _key("amount > 10", temperature=0.7) != base
+    # Samples are not part of the schema fingerprint
+    assert _key("amount > 10", {**COLUMNS_INFO, "city": {"dtype": "object", "sample_values": ["上海"]}}) == base
+    monkeypatch.setattr(parse_cache, "PARSE_CACHE_KEY_VERSION", parse_cache.PARSE_CACHE_KEY_VERSION + 1)
+    assert _key("amount > 10") != base
+
+
+def test_entries_expire_after_the_ttl(tmp_path, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(parse_cache.time, "time", lambda: now[0])
+    cache = ParsedConditionsCache(tmp_path / "cache.sqlite3", ttl_seconds=60, max_entries=10)
+    cache.put("k", CONDITIONS)
+    now[0] += 59
+    assert cache.get("k") == CONDITIONS
+    now[0] += 1
+    assert cache.get("k") is None
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(parse_cache.time, "time", lambda: now[0])
+    cache = ParsedConditionsCache(tmp_path / "cache.sqlite3", ttl_seconds=3600, max_entries=2)
+    for key in ("a", "b"):
+        now[0] += 1
+        cache.put(key, CONDITIONS)
+    now[0] += 1
+    assert cache.get("a") is not None # "b" is now the least recently used
+    now[0] += 1
+    cache.put("c", CONDITIONS)
+    assert cache.get("b") is None
+    assert cache.get("a") is not None and cache.get("c") is not None
+
+
+def test_database_is_created_on_first_use(tmp_path):
+    path = tmp_path / "nested" / "cache.sqlite3"
+    cache = ParsedConditionsCache(path, ttl_seconds=60, max_entries=10)
+    assert not path.exists()
+    assert cache.get("k") is None
+    assert path.exists()
@@ -0,0 +1,70 @@
+# test/test_processing.py
+
+import sys
+from pathlib import Path
+
+# Add project root to Python path to allow importing app modules
+project_root = Path(__file__).resolve().parent.parent
+sys.path.append(str(project_root))
+
+import json
+
+import pandas as pd
+
+from app.database.models import UploadedExcelFile
+from app.excel import columnar
+from app.excel.processing import COLUMNS_INFO_VERSION, get_columns_info_for_record, normalize_column_names, read_and_prepare_dataframe_from_file
+
+
+class _RecordingSession:
+    """Stands in for a Session; records which records were committed."""
+
+    def __init__(self):
+        self.committed = []
+
+    def add(self, record):
+        self.committed.append(record)
+
+    def commit(self):
+        pass
+
+    def refresh(self, record):
+        pass
+
+    def rollback(self):
+        pass
+
+
+def _file_record(**fields) -> UploadedExcelFile:
+    return UploadedExcelFile(id=1, original_filename="orders.csv", stored_file_path="/missing/orders.csv", uploader_id=1, **fields)
+
+
+def test_headers_that_normalize_alike_get_suffixes():
+    assert normalize_column_names(["Amount", "amount ", "A B", "a_b", "a_b_2"]) == ["amount", "amount_2", "a_b", "a_b_3", "a_b_2"]
+
+
+def test_file_with_colliding_headers_converts_to_arrow(tmp_path):
+    path = tmp_path / "orders.csv"
+    path.write_text("Amount,amount ,City\n1,2,Shanghai\n", encoding="utf-8")
+    df = read_and_prepare_dataframe_from_file(str(path))
+    assert list(df.columns) == ["amount", "amount_2", "city"]
+    assert columnar.dataframe_to_arrow_table(df).column_names == ["amount", "amount_2", "city"]
+
+
+def test_stored_column_profile_is_reused():
+    stored = {"amount": {"dtype": "int64", "unique_count": 2}}
+    record = _file_record(columns_info_json=json.dumps(stored), columns_info_version=COLUMNS_INFO_VERSION)
+    db = _RecordingSession()
+    assert get_columns_info_for_record(db, record, pd.DataFrame({"amount": [1, 2, 3]})) == stored
+    assert db.committed == []
+
+
+def test_stale_column_profile_is_recomputed_and_stored():
+    stored = {"amount": {"dtype": "int64", "unique_count": 2}}
+    record = _file_record(columns_info_json=json.dumps(stored), columns_info_version=COLUMNS_INFO_VERSION - 1)
+    db = _RecordingSession()
+    columns_info = get_columns_info_for_record(db, record, pd.DataFrame({"amount": [1, 2, 3]}))
+    assert columns_info["amount"]["unique_count"] == 3
+    assert db.committed == [record]
+    assert record.columns_info_version == COLUMNS_INFO_VERSION
+    assert json.loads(record.columns_info_json) == columns_info
@@ -0,0 +1,76 @@
+# test/test_profiler.py
+
+import sys
+from pathlib import Path
+
+# Add project root to Python path to allow importing app modules
+project_root = Path(__file__).resolve().parent.parent
+sys.path.append(str(project_root))
+
+import numpy as np
+import pandas as pd
+
+from app.excel.profiler import FrequentItems, HyperLogLog, profile_dataframe_chunks, profile_file_streaming
+
+
+def _chunks(df: pd.DataFrame, rows: int):
+    for start in range(0, len(df), rows):
+        yield df.iloc[start:start + rows]
+
+
+def test_hyperloglog_estimates_distinct_counts_within_a_few_percent():
+    hll = HyperLogLog()
+    values = pd.Series(np.arange(200_000) % 50_000)
+    hll.add_hashes(pd.util.hash_pandas_object(values, index=False).to_numpy())
+    assert abs(hll.estimate() - 50_000) / 50_000 < 0.03
+
+
+def test_hyperloglog_is_exact_enough_for_small_cardinalities():
+    hll = HyperLogLog()
+    hll.add_hashes(pd.util.hash_pandas_object(pd.Series(["a", "b", "c", "a"]), index=False).to_numpy())
+    assert hll.estimate() == 3
+
+
+def test_frequent_items_keep_heavy_hitters_across_chunks():
+    frequent = FrequentItems(k=2)
+    rng = np.random.default_rng(0)
+    for _ in range(20):
+        # Two heavy values among many rare ones, spread over the chunks
+        chunk = pd.Series(np.concatenate([["heavy"] * 300, ["second"] * 200, rng.integers(0, 10_000, 500).astype(str)]))
+        frequent.add_value_counts(chunk.value_counts(sort=False))
+    top = frequent.top()
+    assert [item["value"] for item in top] == ["heavy", "second"]
+    # Misra-Gries counts are lower bounds
+    assert top[0]["count"] <= 6000 and top[1]["count"] <= 4000
+
+
+def test_chunked_profile_matches_the_exact_statistics():
+    df = pd.DataFrame({
+        "amount": [10, 20, None, 40, 50, 20, 70],
+        "city": ["北京", "上海", "北京", None, "深圳", "北京", "上海"],
+    })
+    columns_info = profile_dataframe_chunks(_chunks(df, 3))
+    amount = columns_info["amount"]
+    assert amount["dtype"] == "float64"
+    assert (amount["row_count"], amount["null_count"], amount["unique_count"]) == (7, 1, 5)
+    assert (amount["min"], amount["max"]) == ("10.0", "70.0")
+    city = columns_info["city"]
+    assert city["dtype"] == "object" and city["unique_count"] == 3
+    assert city["top_values"][0] == {"value": "北京", "count": 3}
+    assert len(city["sample_values"]) == 5 and "min" not in city
+
+
+def test_integer_and_float_chunks_merge_to_float64():
+    chunks = [pd.DataFrame({"amount": [1, 2]}), pd.DataFrame({"amount": [1.0, None]})]
+    columns_info = profile_dataframe_chunks(iter(chunks))
+    assert columns_info["amount"]["dtype"] == "float64"
+    assert columns_info["amount"]["unique_count"] == 2 # 1 and 1.0 count once
+
+
+def test_streaming_profile_of_a_csv_normalizes_column_names(tmp_path):
+    path = tmp_path / "orders.csv"
+    path.write_text("Order Amount,City\n" + "".join(f"{i},c{i % 4}\n" for i in range(100)), encoding="utf-8")
+    columns_info = profile_file_streaming(str(path), chunk_rows=7)
+    assert list(columns_info) == ["order_amount", "city"]
+    assert columns_info["order_amount"]["unique_count"] == 100
+    assert columns_info["city"]["unique_count"] == 4
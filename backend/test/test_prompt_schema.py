@@ -0,0 +1,61 @@
+# test/test_prompt_schema.py
+
+import json
+import sys
+from pathlib import Path
+
+# Add project root to Python path to allow importing app modules
+project_root = Path(__file__).resolve().parent.parent
+sys.path.append(str(project_root))
+
+from app.excel import prompt_schema
+from app.excel.prompt_schema import estimate_tokens, schema_token_budget, serialize_schema_for_prompt
+
+
+def _columns_info(count: int) -> dict:
+    return {f"col_{i}": {"dtype": "object", "unique_count": i + 1, "sample_values": [f"value {i} {j}" for j in range(5)]}
+            for i in range(count)}
+
+
+def test_schema_is_compact_with_short_keys_and_truncated_samples():
+    columns_info = {"city": {"dtype": "object", "unique_count": 3, "sample_values": ["北京", "x" * 100, "上海", "深圳"]}}
+    schema = json.loads(serialize_schema_for_prompt(columns_info))
+    assert schema == {"city": {"t": "object", "u": 3, "s": ["北京", "x" * prompt_schema.SAMPLE_MAX_CHARS + "…", "上海"]}}
+    assert "\n" not in serialize_schema_for_prompt(columns_info)
+
+
+def test_schema_within_budget_is_left_whole():
+    columns_info = _columns_info(3)
+    text = serialize_schema_for_prompt(columns_info)
+    assert serialize_schema_for_prompt(columns_info, token_budget=estimate_tokens(text)) == text
+
+
+def test_trimmed_schema_fits_the_budget_and_keeps_every_name_and_dtype():
+    columns_info = _columns_info(40)
+    budget = estimate_tokens(serialize_schema_for_prompt(columns_info)) // 2
+    text = serialize_schema_for_prompt(columns_info, token_budget=budget)
+    assert estimate_tokens(text) <= budget
+    schema = json.loads(text)
+    assert list(schema) == list(columns_info)
+    assert all(entry["t"] == "object" for entry in schema.values())
+    assert any("s" in entry for entry in schema.values()) # Only as many samples as needed are dropped
+
+
+def test_budget_too_small_for_names_keeps_names_and_dtypes_only():
+    schema = json.loads(serialize_schema_for_prompt(_columns_info(10), token_budget=1))
+    assert schema == {f"col_{i}": {"t": "object"} for i in range(10)}
+
+
+def test_token_estimate_counts_cjk_characters_one_each():
+    assert estimate_tokens("北京上海") == 4
+    assert estimate_tokens("abcdefgh") == 2
+
+
+def test_budget_comes_from_the_request_then_the_model_then_the_provider(monkeypatch):
+    monkeypatch.setattr(prompt_schema.settings, "LLM_SCHEMA_TOKEN_BUDGETS", '{"ollama": 800, "ollama:qwen": 400}')
+    monkeypatch.setattr(prompt_schema.settings, "LLM_SCHEMA_TOKEN_BUDGET", 3000)
+    assert schema_token_budget("ollama", "qwen", {"schemaTokenBudget": 200}) == 200
+    assert schema_token_budget("ollama", "qwen") == 400
+    assert schema_token_budget("ollama", "llama") == 800
+    assert schema_token_budget("siliconflow", "any") == 3000
+    assert schema_token_budget("siliconflow", "any", {"schemaTokenBudget": 0}) is None # Unlimited
@@ -0,0 +1,65 @@
+# test/test_query_template.py
+
+import sys
+from pathlib import Path
+
+# Add project root to Python path to allow importing app modules
+project_root = Path(__file__).resolve().parent.parent
+sys.path.append(str(project_root))
+
+from app.excel.query_template import build_template_conditions, extract_query_template, fill_template_conditions
+
+
+def test_literals_are_replaced_by_numbered_placeholders():
+    template, literals = extract_query_template('城市是"北京" 且 2024年3月5日 之后 金额大于 1000.5')
+    assert template == "城市是<S0> 且 <D1> 之后 金额大于 <N2>"
+    assert [(lit["kind"], lit["value"]) for lit in literals] == [("quoted", "北京"), ("date", "2024-03-05"), ("number", 1000.5)]
+
+
+def test_digits_inside_names_and_invalid_dates_stay_in_the_template():
+    template, literals = extract_query_template("top10 of q1 since 2024-13-40")
+    assert "top10" in template and "q1" in template
+    assert all(lit["kind"] == "number" for lit in literals) # 2024, 13 and 40, not a date
+
+
+def test_queries_differing_only_in_literals_reuse_one_parse():
+    _, literals = extract_query_template("amount > 1000 and order_date after 2024-01-01")
+    parsed = {"filters": [
+        {"column": "amount", "operator": "greater_than", "value": 1000},
+        {"column": "order_date", "operator": "greater_than", "value": "2024-01-01"},
+    ], "logical_operator": "AND"}
+    template_conditions = build_template_conditions(parsed, literals)
+    assert template_conditions is not None
+
+    template, new_literals = extract_query_template("amount > 250 and order_date after 2023-06-30")
+    assert template == extract_query_template("amount > 1000 and order_date after 2024-01-01")[0]
+    filled = fill_template_conditions(template_conditions, new_literals)
+    assert [f["value"] for f in filled["filters"]] == [250, "2023-06-30"]
+    assert parsed["filters"][0]["value"] == 1000 # The original parse is left untouched
+
+
+def test_numbers_the_llm_returned_as_strings_are_filled_as_strings():
+    _, literals = extract_query_template("code in 7 or 9")
+    parsed = {"filters": [{"column": "code", "operator": "in", "value": ["7", "9"]}], "logical_operator": "AND"}
+    template_conditions = build_template_conditions(parsed, literals)
+    _, new_literals = extract_query_template("code in 3 or 12")
+    assert fill_template_conditions(template_conditions, new_literals)["filters"][0]["value"] == ["3", "12"]
+
+
+def test_ambiguous_or_transformed_literals_are_not_templated():
+    # The same value twice: cannot tell which slot is which
+    _, literals = extract_query_template("amount between 10 and 10")
+    parsed = {"filters": [{"column": "amount", "operator": "between", "value": [10, 10]}], "logical_operator": "AND"}
+    assert build_template_conditions(parsed, literals) is None
+    # A unit conversion: the literal does not appear in the conditions
+    _, literals = extract_query_template("amount > 5万")
+    parsed = {"filters": [{"column": "amount", "operator": "greater_than", "value": 50000}], "logical_operator": "AND"}
+    assert build_template_conditions(parsed, literals) is None
+
+
+def test_literals_that_do_not_fit_the_slots_are_rejected():
+    _, literals = extract_query_template("amount > 1000")
+    template_conditions = build_template_conditions(
+        {"filters": [{"column": "amount", "operator": "greater_than", "value": 1000}], "logical_operator": "AND"}, literals)
+    assert fill_template_conditions(template_conditions, extract_query_template("amount > 2024-01-01")[1]) is None
+    assert fill_template_conditions(template_conditions, extract_query_template("amount > 1 and 2")[1]) is None